@@ -1,25 +1,19 @@
 import os
-from flask import Flask, send_from_directory
+from flask import Flask
 from flask_cors import CORS
-from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
-from pymongo import MongoClient
 
 # Initialize extensions WITHOUT app context
-bcrypt = Bcrypt()
 jwt = JWTManager()
 
-# Global variables for MongoDB
-mongo_client = None
-db = None
-workouts = None  # Add this
-
 def create_app():
-    global mongo_client, db, workouts  # Add workouts here
-
     build_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "client", "build"))
 
-    app = Flask(__name__, static_folder=build_path, static_url_path="/")
+    # The build is served from a startup manifest (app/assets.py), not
+    # Flask's static route, which would stat the disk on every request
+    app = Flask(__name__, static_folder=None)
+    from app.assets import build_manifest, send_asset
+    app.extensions["assets"] = build_manifest(build_path)
     
     # Configuration
     app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "default-secret-key")
@@ -30,53 +24,48 @@ def create_app():
     if os.getenv("FLASK_ENV") == "development":
         CORS(app)
 
+    # Pin the bcrypt cost if configured; bcrypt itself and the hashing pool
+    # load on first use (see app/hashing.py)
+    from app.hashing import init_hashing
+    init_hashing(app)
+
     # Initialize extensions with app
-    bcrypt.init_app(app)
     jwt.init_app(app)
 
-    # MongoDB connection
-    MONGO_URI = os.getenv("MONGO_URI")
-    if MONGO_URI:
-        try:
-            mongo_client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-            mongo_client.server_info()
-            db = mongo_client["fitnessApp"]
-            workouts = db["workouts"]  # Add this line
-            print("✅ Connected to MongoDB!")
-        except Exception as e:
-            print(f"⚠️ MongoDB connection failed: {e}")
-            mongo_client = None
-            db = None
-            workouts = None  # Add this
-    else:
-        print("⚠️ MongoDB URI not found")
-        workouts = None  # Add this
+    # Per-request latency histograms and GET /metrics
+    from app.metrics import init_metrics
+    init_metrics(app)
 
-    # Cleanup on app shutdown
-    @app.teardown_appcontext
-    def shutdown_session(exception=None):
-        if mongo_client:
-            mongo_client.close()
+    # MongoDB: one lazily connected client per process (see app/mongo.py).
+    # Requests share its pool; nothing here waits for the server to be up.
+    # Reaching it and ensuring indexes happen in the background, behind
+    # GET /api/health/ready (see app/startup.py).
+    from app.startup import readiness
+    readiness.start(app)
 
-    # IMPORTANT: Import blueprints AFTER db is created
+    # Import blueprints after the extensions are initialized
     from app.auth import auth_bp
     from app.routes import api
     from app.nutrition import nutrition_bp
     from app.planner import planner_bp
+    from app.analytics import analytics_bp
+    from app.transfer import transfer_bp
+    from app.training import training_bp
 
     # Register blueprints
     app.register_blueprint(auth_bp, url_prefix="/auth")
     app.register_blueprint(api)
     app.register_blueprint(nutrition_bp, url_prefix="/nutrition")
     app.register_blueprint(planner_bp, url_prefix="/planner")
+    app.register_blueprint(analytics_bp, url_prefix="/api/analytics")
+    app.register_blueprint(transfer_bp, url_prefix="/api/history")
+    app.register_blueprint(training_bp, url_prefix="/api/training")
 
     # Serve React build
     @app.route("/", defaults={"path": ""})
     @app.route("/<path:path>")
     def serve(path):
-        if path and os.path.exists(os.path.join(app.static_folder, path)):
-            return send_from_directory(app.static_folder, path)
-        return send_from_directory(app.static_folder, "index.html")
+        return send_asset(app.extensions["assets"], path)
 
     return app
 
@@ -0,0 +1,322 @@
+import os
+import json
+import math
+import asyncio
+from urllib.parse import parse_qs
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+import aiohttp
+from asgiref.wsgi import WsgiToAsgi
+from motor.motor_asyncio import AsyncIOMotorClient
+from flask_jwt_extended import decode_token
+from jwt import ExpiredSignatureError
+from werkzeug.http import parse_etags, quote_etag
+from app import metrics, etags
+
+# ASGI entry point. The routes whose time is spent waiting on I/O are served
+# natively here (Motor for Mongo, aiohttp for Nutritionix); every other route
+# falls through to the regular Flask app, which asgiref runs in a thread pool.
+# Email is already handed to the background queue (app.emailer), so no
+# request waits on SMTP in either mode. Live workout sessions (app/live.py)
+# are WebSockets, so they exist only in this mode.
+
+NDJSON_FLUSH_BYTES = 64 * 1024
+LIVE_PATH = "/api/sessions/live"
+LIVE_AUTH_TIMEOUT = 10.0
+LIVE_KINDS = ("set", "ping", "end")  # metric labels; any other type counts as "unknown"
+
+class HTTPError(Exception):
+    def __init__(self, status, body, retry_after=None):
+        super().__init__(body)
+        self.status = status
+        self.body = body
+        self.headers = [(b"retry-after", str(max(1, math.ceil(retry_after))).encode())] if retry_after else []
+
+class Request:
+    def __init__(self, scope):
+        self.scope = scope
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.client = (scope.get("client") or (None,))[0]
+        self.args = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload, default=str).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                            *headers]})
+    await send({"type": "http.response.body", "body": body})
+
+class AsyncApp:
+    def __init__(self, flask_app):
+        self.flask = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.mongo = None
+        self.db = None
+        self.http = None
+        self.routes = {
+            ("GET", "/api/workouts"): self.get_workouts,
+            ("GET", "/nutrition/foods/search"): self.foods_search,
+        }
+
+    # ---- lifecycle -----------------------------------------------------
+    async def startup(self):
+        from app.mongo import mongo_uri, DB_NAME, POOL_SIZE
+
+        if mongo_uri():
+            self.mongo = AsyncIOMotorClient(mongo_uri(), maxPoolSize=POOL_SIZE)
+            self.db = self.mongo[DB_NAME]
+        self.http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100),
+            timeout=aiohttp.ClientTimeout(total=10)
+        )
+
+    async def shutdown(self):
+        if self.http is not None:
+            await self.http.close()
+        if self.mongo is not None:
+            self.mongo.close()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await self.startup()
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await self.shutdown()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        if scope["type"] == "websocket":
+            if scope["path"] == LIVE_PATH:
+                return await self.live_session(scope, receive, send)
+            await receive()  # websocket.connect
+            return await send({"type": "websocket.close", "code": 4404})
+
+        handler = self.routes.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if handler is None:
+            return await self.wsgi(scope, receive, send)
+        status = 500
+
+        async def send_tracked(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        token = metrics.start_request(scope["path"])
+        try:
+            await handler(Request(scope), send_tracked)
+        except HTTPError as e:
+            await send_json(send_tracked, e.status, e.body, e.headers)
+        finally:
+            metrics.finish_request(token, scope["method"], status)
+
+    # ---- auth ----------------------------------------------------------
+    async def identity(self, request, optional=False):
+        """JWT subject of the request's bearer token."""
+        header = request.headers.get("authorization", "")
+        if not header.startswith("Bearer "):
+            if optional:
+                return None
+            raise HTTPError(401, {"msg": "Missing Authorization Header"})
+        return await self.token_identity(header[len("Bearer "):])
+
+    async def token_identity(self, token):
+        """JWT subject of an access token, with the same revocation checks as
+        the Flask app's blocklist loader (cache first, Motor on a miss)."""
+        from app import auth
+
+        try:
+            with self.flask.app_context():
+                payload = decode_token(token)
+        except ExpiredSignatureError:
+            raise HTTPError(401, {"msg": "Token has expired"})
+        except Exception as e:
+            raise HTTPError(422, {"msg": str(e)})
+        if payload.get("type") != "access":
+            raise HTTPError(422, {"msg": "Only non-refresh tokens are allowed"})
+
+        if self.db is not None:
+            jti, uid = payload["jti"], payload["sub"]
+            revoked = auth.cached_revocation(jti)
+            if revoked is None:
+                revoked = await self.db["token_blacklist"].find_one({"jti": jti}, {"_id": 1}) is not None
+                auth.remember_revocation(jti, revoked)
+            hit, tv = auth.cached_token_version(uid)
+            if not hit:
+                user = await self.db["users"].find_one({"_id": ObjectId(uid)}, {"token_version": 1})
+                tv = auth.remember_token_version(uid, user)
+            if revoked or tv != int(payload.get("tv", 0)):
+                raise HTTPError(401, {"msg": "Token has been revoked"})
+        return payload["sub"]
+
+    # ---- routes --------------------------------------------------------
+    async def get_workouts(self, request, send):
+        from app.routes import workout_query, public_workout, encode_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+
+        if self.db is None:
+            raise HTTPError(500, {"error": "MongoDB not connected"})
+        uid = await self.identity(request, optional=True)
+        if not uid and request.args.get("user"):
+            raise HTTPError(401, {"error": "Sign in to list a user's workouts"})
+        owner = uid or etags.GLOBAL
+        version = await self.db["resource_versions"].find_one({"_id": etags.version_id("workouts", owner)})
+        etag, _ = etags.from_version("workouts", owner, version, request.scope.get("query_string", b""))
+        cache_headers = [(b"etag", quote_etag(etag, weak=True).encode()),
+                         (b"cache-control", etags.CACHE_CONTROL.encode()), (b"vary", b"Authorization")]
+        if parse_etags(request.headers.get("if-none-match")).contains_weak(etag):
+            await send({"type": "http.response.start", "status": 304, "headers": cache_headers})
+            return await send({"type": "http.response.body", "body": b""})
+
+        ndjson = request.args.get("format") == "ndjson"
+        try:
+            query = workout_query(request.args, uid)
+            limit = int(request.args.get("limit", 0 if ndjson else DEFAULT_PAGE_SIZE))
+        except (ValueError, InvalidId):
+            raise HTTPError(400, {"error": "Invalid cursor, limit or date range"})
+
+        cursor = self.db["workouts"].find(query).sort([("performedAt", -1), ("_id", -1)])
+        if not ndjson:
+            limit = max(1, min(limit, MAX_PAGE_SIZE))
+            docs = await cursor.limit(limit + 1).to_list(limit + 1)
+            next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+            return await send_json(send, 200, {"items": [public_workout(d) for d in docs[:limit]], "next": next_cursor},
+                                   cache_headers)
+
+        if limit > 0:
+            cursor = cursor.limit(limit)
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/x-ndjson"), *cache_headers]})
+        buf = bytearray()
+        async for doc in cursor:
+            buf += (json.dumps(public_workout(doc), default=str) + "\n").encode("utf-8")
+            if len(buf) >= NDJSON_FLUSH_BYTES:
+                await send({"type": "http.response.body", "body": bytes(buf), "more_body": True})
+                buf.clear()
+        await send({"type": "http.response.body", "body": bytes(buf)})
+
+    async def foods_search(self, request, send):
+        from app.food_search import search_local, search_foods_async, ProviderError
+        from app import ratelimit
+
+        uid = await self.identity(request)
+        keys = {"user": uid, "ip": ratelimit.client_ip(request.client, request.headers.get("x-forwarded-for"))}
+        # the shared (Mongo) store is blocking I/O; the in-process one is a dict update
+        if ratelimit.STORAGE == "mongo":
+            wait = await asyncio.to_thread(ratelimit.check, "foods_search", **keys)
+        else:
+            wait = ratelimit.check("foods_search", **keys)
+        if wait:
+            raise HTTPError(429, {"error": "Too many requests, please slow down."}, retry_after=wait)
+        q = request.args.get("q", "").strip()
+        if not q:
+            raise HTTPError(400, {"error": "Missing q"})
+
+        local = search_local(q)
+        if local:
+            return await send_json(send, 200, {"query": q, "items": local, "source": "local"})
+        if not (os.getenv("NUTRITIONIX_APP_ID") and os.getenv("NUTRITIONIX_API_KEY")):
+            raise HTTPError(500, {"error": "Nutrition API keys not configured"})
+
+        store = self.db["food_search_cache"] if self.db is not None else None
+        try:
+            items, source = await search_foods_async(q, self.http, store)
+        except ProviderError as e:
+            raise HTTPError(502, {"error": "nutrition provider error", "status": e.status})
+        except (aiohttp.ClientError, TimeoutError):
+            raise HTTPError(502, {"error": "nutrition provider unreachable"})
+        await send_json(send, 200, {"query": q, "items": items[:25], "source": source})
+
+    # ---- live sessions (WebSocket) -------------------------------------
+    async def live_session(self, scope, receive, send):
+        from app.live import LiveSession, SetError
+
+        if (await receive())["type"] != "websocket.connect":
+            return
+        await send({"type": "websocket.accept"})
+        closed = False
+
+        async def push(event):
+            nonlocal closed
+            if closed:
+                return
+            try:
+                await send({"type": "websocket.send", "text": json.dumps(event, default=str)})
+            except Exception:  # the client went away mid-send
+                closed = True
+
+        async def next_message():
+            """The next JSON object from the client, or None once it has gone."""
+            while True:
+                message = await receive()
+                if message["type"] == "websocket.disconnect":
+                    return None
+                try:
+                    data = json.loads(message.get("text") or message.get("bytes") or b"")
+                except ValueError:
+                    data = None
+                if isinstance(data, dict):
+                    return data
+                await push({"type": "error", "error": "Expected a JSON object"})
+
+        async def close(code):
+            nonlocal closed
+            if not closed:
+                closed = True
+                await send({"type": "websocket.close", "code": code})
+
+        # browsers can't set headers on a WebSocket, so the token is the first message
+        try:
+            hello = await asyncio.wait_for(next_message(), LIVE_AUTH_TIMEOUT)
+        except asyncio.TimeoutError:
+            return await close(4401)
+        if hello is None:
+            return
+        try:
+            if hello.get("type") != "auth":
+                raise HTTPError(401, {"msg": "First message must be auth"})
+            uid = await self.token_identity(str(hello.get("token") or ""))
+        except HTTPError as e:
+            await push({"type": "error", "error": e.body.get("msg")})
+            return await close(4401)
+
+        session = LiveSession(uid, hello.get("session"), push)
+        try:
+            await session.open()
+            while True:
+                msg = await next_message()
+                if msg is None:
+                    break
+                kind = msg.get("type")
+                label = kind if kind in LIVE_KINDS else "unknown"
+                token = metrics.start_request(f"{LIVE_PATH}:{label}")
+                try:
+                    if kind == "set":
+                        await session.add_set(msg)
+                    elif kind == "ping":
+                        await push({"type": "pong"})
+                    elif kind == "end":
+                        await session.close()
+                        await push(session.summary())
+                        break
+                    else:
+                        raise SetError(f"Unknown message type: {kind}")
+                except SetError as e:
+                    await push({"type": "error", "seq": msg.get("seq"), "error": str(e)})
+                finally:
+                    metrics.finish_request(token, "WS", 200)
+        except Exception:
+            await close(1011)
+            raise
+        finally:
+            await close(1000)
+            await session.close()
+
+def create_asgi_app():
+    """Build the Flask app with the sync factory and wrap it for ASGI servers."""
+    from app import create_app
+    return AsyncApp(create_app())
@@ -0,0 +1,190 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pymongo import UpdateOne
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from .mongo import collection
+from .training import update_states, workout_row
+
+analytics_bp = Blueprint("analytics", __name__)
+
+# Materialized per-user rollups: one document per (period, bucket, exercise),
+# kept current with $inc/$max as workouts are inserted, so charts read a
+# handful of small documents instead of the user's whole history.
+rollups = lambda: collection("workout_rollups")
+workouts = lambda: collection("workouts")
+
+PERIODS = ("week", "month")
+
+def e1rm(weight_kg, reps):
+    # Epley estimate; a single is its own 1RM
+    if not weight_kg or not reps:
+        return 0.0
+    return weight_kg if reps == 1 else weight_kg * (1 + reps / 30.0)
+
+def bucket_of(ts, period):
+    """(label, start timestamp) of the ISO week or calendar month holding `ts`."""
+    dt = datetime.fromtimestamp(ts, timezone.utc)
+    if period == "week":
+        year, week, weekday = dt.isocalendar()
+        start = (dt - timedelta(days=weekday - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return f"{year}-W{week:02d}", int(start.timestamp())
+    start = dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return f"{dt.year}-{dt.month:02d}", int(start.timestamp())
+
+def workout_stats(weight, reps, sets):
+    return {
+        "volume": sets * reps * weight,
+        "sets": sets,
+        "reps": sets * reps,
+        "workouts": 1,
+        "maxWeight": weight,
+        "bestE1rm": round(e1rm(weight, reps), 2),
+    }
+
+def record_workouts(docs):
+    """Fold newly inserted workouts into the rollups (one upsert per touched
+    bucket) and into the per-exercise training states (app/training.py)."""
+    docs = list(docs)
+    merged = {}
+    for doc in docs:
+        # rows that can't count (no owner, wrong types, time out of range) are skipped
+        row = workout_row(doc)
+        if row is None:
+            continue
+        uid, exercise, ts, weight, reps, sets = row
+        try:
+            buckets = [(period, *bucket_of(ts, period)) for period in PERIODS]
+        except (OverflowError, OSError, ValueError):
+            continue
+        stats = workout_stats(weight, reps, sets)
+        for period, label, start in buckets:
+            key = f"{uid}|{period}|{label}|{exercise}"
+            cur = merged.get(key)
+            if cur is None:
+                merged[key] = {"meta": {"userId": uid, "period": period, "bucket": label,
+                                        "bucketStart": start, "exercise": exercise},
+                               **stats}
+                continue
+            for k in ("volume", "sets", "reps", "workouts"):
+                cur[k] += stats[k]
+            cur["maxWeight"] = max(cur["maxWeight"], stats["maxWeight"])
+            cur["bestE1rm"] = max(cur["bestE1rm"], stats["bestE1rm"])
+
+    update_states(docs)
+    if not merged:
+        return
+    ops = [
+        UpdateOne(
+            {"_id": key},
+            {
+                "$inc": {k: v[k] for k in ("volume", "sets", "reps", "workouts")},
+                "$max": {"maxWeight": v["maxWeight"], "bestE1rm": v["bestE1rm"]},
+                "$setOnInsert": v["meta"],
+            },
+            upsert=True,
+        )
+        for key, v in merged.items()
+    ]
+    rollups().bulk_write(ops, ordered=False)
+
+def rollup_pipeline(uid, period):
+    """Aggregation that recomputes one user's rollups for `period` from raw workouts."""
+    date = {"$toDate": {"$multiply": ["$performedAt", 1000]}}
+    if period == "week":
+        label = {"$concat": [{"$toString": {"$isoWeekYear": date}}, "-W",
+                             {"$cond": [{"$lt": [{"$isoWeek": date}, 10]}, "0", ""]},
+                             {"$toString": {"$isoWeek": date}}]}
+    else:
+        label = {"$dateToString": {"format": "%Y-%m", "date": date}}
+    reps = {"$ifNull": ["$reps", 0]}
+    sets = {"$ifNull": ["$sets", 1]}
+    weight = {"$ifNull": ["$weight_kg", 0]}
+    return [
+        {"$match": {"userId": uid, "exercise": {"$type": "string"}, "performedAt": {"$type": "number"}}},
+        {"$group": {
+            "_id": {"bucket": label, "exercise": {"$toLower": "$exercise"}},
+            "bucketStart": {"$min": "$performedAt"},
+            "volume": {"$sum": {"$multiply": [sets, reps, weight]}},
+            "sets": {"$sum": sets},
+            "reps": {"$sum": {"$multiply": [sets, reps]}},
+            "workouts": {"$sum": 1},
+            "maxWeight": {"$max": weight},
+            "bestE1rm": {"$max": {"$switch": {"branches": [
+                {"case": {"$lte": [reps, 0]}, "then": 0},
+                {"case": {"$eq": [reps, 1]}, "then": weight},
+            ], "default": {"$multiply": [weight, {"$add": [1, {"$divide": [reps, 30]}]}]}}}},
+        }},
+    ]
+
+def rebuild_rollups(uid):
+    """Recompute a user's rollups from scratch, e.g. after a delete or backfill.
+    Each bucket is overwritten in place and only then are buckets that no
+    longer exist deleted, so readers never see the user's rollups empty."""
+    ops, keys = [], []
+    for period in PERIODS:
+        for row in workouts().aggregate(rollup_pipeline(uid, period)):
+            label, exercise = row["_id"]["bucket"], row["_id"]["exercise"]
+            _, start = bucket_of(row["bucketStart"], period)
+            keys.append(f"{uid}|{period}|{label}|{exercise}")
+            ops.append(UpdateOne(
+                {"_id": keys[-1]},
+                {"$set": {
+                    "userId": uid, "period": period, "bucket": label, "bucketStart": start, "exercise": exercise,
+                    **{k: row[k] for k in ("volume", "sets", "reps", "workouts", "maxWeight")},
+                    "bestE1rm": round(row["bestE1rm"] or 0, 2),
+                }},
+                upsert=True,
+            ))
+    if ops:
+        rollups().bulk_write(ops, ordered=False)
+    rollups().delete_many({"userId": uid, "_id": {"$nin": keys}})
+    return len(ops)
+
+def public_rollup(doc):
+    return {k: (round(v, 2) if isinstance(v, float) else v) for k, v in doc.items() if k not in ("_id", "userId")}
+
+@analytics_bp.route("/volume", methods=["GET"])
+@jwt_required()
+def volume():
+    """Volume, sets, reps, best weight and e1RM per exercise per week or month."""
+    uid = get_jwt_identity()
+    period = request.args.get("period", "week")
+    if period not in PERIODS:
+        return jsonify({"error": "period must be week or month"}), 400
+
+    query = {"userId": uid, "period": period}
+    if request.args.get("exercise"):
+        query["exercise"] = request.args["exercise"].strip().lower()
+    try:
+        window = {}
+        if request.args.get("from"):
+            window["$gte"] = int(request.args["from"])
+        if request.args.get("to"):
+            window["$lt"] = int(request.args["to"])
+    except ValueError:
+        return jsonify({"error": "from/to must be unix seconds"}), 400
+    if window:
+        query["bucketStart"] = window
+
+    docs = rollups().find(query).sort([("bucketStart", 1), ("exercise", 1)])
+    return jsonify({"period": period, "buckets": [public_rollup(d) for d in docs]})
+
+@analytics_bp.route("/prs", methods=["GET"])
+@jwt_required()
+def prs():
+    """All-time best weight and estimated 1RM per exercise (from monthly rollups)."""
+    uid = get_jwt_identity()
+    best = defaultdict(lambda: {"maxWeight": 0, "bestE1rm": 0, "volume": 0})
+    for d in rollups().find({"userId": uid, "period": "month"}, {"exercise": 1, "maxWeight": 1, "bestE1rm": 1, "volume": 1}):
+        b = best[d["exercise"]]
+        b["maxWeight"] = max(b["maxWeight"], d.get("maxWeight", 0))
+        b["bestE1rm"] = max(b["bestE1rm"], d.get("bestE1rm", 0))
+        b["volume"] += d.get("volume", 0)
+    return jsonify({"prs": [{"exercise": k, **{f: round(v, 2) for f, v in b.items()}} for k, b in sorted(best.items())]})
+
+@analytics_bp.route("/rebuild", methods=["POST"])
+@jwt_required()
+def rebuild():
+    uid = get_jwt_identity()
+    return jsonify({"rollups": rebuild_rollups(uid)})
@@ -0,0 +1,69 @@
+import os
+import re
+import mimetypes
+from collections import namedtuple
+from flask import request, send_file
+
+# In-memory manifest of the React build, made once at startup so serving an
+# asset never touches the filesystem to decide what exists.
+#   - content-hashed files (static/js/main.1a2b3c4d.js) are immutable for a year
+#   - everything else (index.html, manifest.json, ...) is revalidated via ETag
+#   - foo.js.br / foo.js.gz next to foo.js are served to clients that accept
+#     them (see utils/precompress.py)
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+HASHED = re.compile(r"\.[0-9a-f]{8,}\.(?:chunk\.)?[A-Za-z0-9]+$")
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]  # preferred first
+
+Asset = namedtuple("Asset", "path mimetype etag mtime immutable encoded")
+
+def build_manifest(root):
+    """{url path: Asset} for every file under `root` (empty if it doesn't exist)."""
+    manifest = {}
+    suffixes = tuple(s for _, s in ENCODINGS)
+    for dirpath, _, files in os.walk(root):
+        names = set(files)
+        for name in files:
+            if name.endswith(suffixes) and name.rsplit(".", 1)[0] in names:
+                continue  # a precompressed variant, attached below
+            path = os.path.join(dirpath, name)
+            st = os.stat(path)
+            rel = os.path.relpath(path, root).replace(os.sep, "/")
+            encoded = {enc: path + suffix for enc, suffix in ENCODINGS if name + suffix in names}
+            manifest[rel] = Asset(
+                path=path,
+                mimetype=mimetypes.guess_type(name)[0] or "application/octet-stream",
+                etag=f"{st.st_size:x}-{int(st.st_mtime):x}",
+                mtime=st.st_mtime,
+                immutable=bool(HASHED.search(name)),
+                encoded=encoded,
+            )
+    return manifest
+
+def pick_encoding(asset):
+    for enc, _ in ENCODINGS:
+        if enc in asset.encoded and request.accept_encodings[enc]:
+            return enc
+    return None
+
+def send_asset(manifest, path):
+    """The build file at `path`, else index.html (client-side routes), else 404."""
+    asset = manifest.get(path) or manifest.get("index.html")
+    if asset is None:
+        return "⚠️ React build not found. Run 'npm run build' inside the client folder.", 404
+
+    enc = pick_encoding(asset)
+    resp = send_file(
+        asset.encoded[enc] if enc else asset.path,
+        mimetype=asset.mimetype,
+        etag=f"{asset.etag}-{enc}" if enc else asset.etag,
+        last_modified=asset.mtime,
+        conditional=True,
+    )
+    if enc:
+        resp.headers["Content-Encoding"] = enc
+    if asset.encoded:
+        resp.vary.add("Accept-Encoding")
+    resp.headers["Cache-Control"] = IMMUTABLE if asset.immutable else REVALIDATE
+    return resp
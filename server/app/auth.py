@@ -1,10 +1,13 @@
 import os
 import time
 import secrets
-from datetime import timedelta
+import threading
+from datetime import datetime, timedelta, timezone
+from cachetools import TTLCache
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from flask import Blueprint, request, jsonify
-from email_validator import validate_email, EmailNotValidError
 from flask_jwt_extended import (
     create_access_token, 
     create_refresh_token,
@@ -12,40 +15,124 @@ from flask_jwt_extended import (
     get_jwt_identity, 
     get_jwt
 )
-from app import db, bcrypt
-from .emailer import send_email
+from app import jwt
+from .mongo import collection
+from .emailer import VERIFY_EMAIL, enqueue_email
+from . import etags
+from .ratelimit import rate_limit
+from .targets_cache import profile_for, remember_profile
+from .hashing import HashPoolBusy, HashPoolTimeout, hash_password, check_password, needs_rehash, rehash_in_background
 
 auth_bp = Blueprint("auth", __name__)
 
 # Database collection helpers
 def users():
-    return db["users"]
+    return collection("users")
 
 def profiles():
-    return db["profiles"]
+    return collection("profiles")
 
 def blacklist():
-    return db["token_blacklist"]
+    return collection("token_blacklist")
+
+def verification_codes():
+    return collection("verification_codes")
+
+# Revocation state cached in-process so protected routes skip Mongo.
+# Changes made by this worker apply immediately; changes made by other
+# workers are picked up once the entry expires.
+REVOCATION_CACHE_SEC = int(os.getenv("JWT_REVOCATION_CACHE_SEC", "60"))
+_cache_lock = threading.Lock()
+revoked_jtis = TTLCache(maxsize=100_000, ttl=REVOCATION_CACHE_SEC)    # jti -> bool
+token_versions = TTLCache(maxsize=100_000, ttl=REVOCATION_CACHE_SEC)  # uid -> int or None
+
+def cached_revocation(jti):
+    """True/False if this worker knows whether `jti` is revoked, else None."""
+    with _cache_lock:
+        return revoked_jtis.get(jti)
+
+def remember_revocation(jti, revoked):
+    with _cache_lock:
+        revoked_jtis[jti] = revoked
+
+def cached_token_version(uid):
+    """(hit, token_version) from the cache; token_version is None for unknown users."""
+    with _cache_lock:
+        if uid in token_versions:
+            return True, token_versions[uid]
+    return False, None
+
+def remember_token_version(uid, user):
+    tv = int(user.get("token_version", 0)) if user else None
+    with _cache_lock:
+        token_versions[uid] = tv
+    return tv
+
+def is_revoked(jti):
+    cached = cached_revocation(jti)
+    if cached is not None:
+        return cached
+    revoked = blacklist().find_one({"jti": jti}, {"_id": 1}) is not None
+    remember_revocation(jti, revoked)
+    return revoked
+
+def user_token_version(uid):
+    """Current token_version for a user, or None if the user does not exist."""
+    hit, tv = cached_token_version(uid)
+    if hit:
+        return tv
+    return remember_token_version(uid, users().find_one({"_id": ObjectId(uid)}, {"token_version": 1}))
+
+@jwt.token_in_blocklist_loader
+def token_revoked(jwt_header, jwt_payload):
+    if blacklist() is None:
+        return False
+    if is_revoked(jwt_payload["jti"]):
+        return True
+    # logout_all bumps token_version, which retires every older token
+    return user_token_version(jwt_payload["sub"]) != int(jwt_payload.get("tv", 0))
 
 # Verification code generator
 def new_verification():
     code = f"{secrets.randbelow(1000000):06d}"  # 6-digit
     return code, int(time.time()) + 15*60       # 15 min expiry
 
-# Email template
-def email_html(code):
-    return f"""
-    <div style="font-family:sans-serif">
-      <h2>Verify your email</h2>
-      <p>Your code is:</p>
-      <div style="font-size:28px;font-weight:700;letter-spacing:3px">{code}</div>
-      <p>This code expires in 15 minutes.</p>
-    </div>
-    """
+# Pending codes live in their own collection, one per user, and a TTL index
+# on expireAt deletes them (see app/indexes.py). The TTL monitor runs about
+# once a minute, so expiry is still checked on use.
+def verification_doc(uid, code, exp):
+    return {"_id": uid, "code": code, "expireAt": datetime.fromtimestamp(exp, timezone.utc)}
+
+def store_verification(uid, code, exp):
+    verification_codes().replace_one({"_id": uid}, verification_doc(uid, code, exp), upsert=True)
+
+def pending_verification(uid, user):
+    """(code, expiry timestamp) of the user's pending code, or None."""
+    doc = verification_codes().find_one({"_id": uid})
+    if doc:
+        at = doc["expireAt"]
+        if at.tzinfo is None:
+            at = at.replace(tzinfo=timezone.utc)
+        return doc["code"], at.timestamp()
+    legacy = user.get("verify")  # issued before codes moved out of the user document
+    if legacy:
+        return legacy.get("code"), int(legacy.get("expiresAt", 0))
+    return None
+
+def busy():
+    resp = jsonify({"error": "Server busy, please retry shortly."})
+    resp.headers["Retry-After"] = "1"
+    return resp, 429
+
+def hashing_timed_out():
+    resp = jsonify({"error": "Password hashing timed out, please retry shortly."})
+    resp.headers["Retry-After"] = "1"
+    return resp, 503
 
 @auth_bp.route("/register", methods=["POST"])
+@rate_limit("register")
 def register():
-    if not users():
+    if users() is None:
         return jsonify({"error": "DB not ready"}), 500
         
     data = request.get_json() or {}
@@ -53,7 +140,8 @@ def register():
     password = data.get("password") or ""
     name = data.get("name") or ""
 
-    # Validate email
+    # Validate email (email_validator is only needed here, so it loads on first use)
+    from email_validator import validate_email, EmailNotValidError
     try:
         validate_email(email)
     except EmailNotValidError as e:
@@ -65,22 +153,30 @@ def register():
     if users().find_one({"email": email}):
         return jsonify({"error": "Email already registered."}), 409
 
-    # Hash password
-    pw_hash = bcrypt.generate_password_hash(password).decode("utf-8")
+    # Hash password (in the hashing process pool)
+    try:
+        pw_hash = hash_password(password)
+    except HashPoolBusy:
+        return busy()
+    except HashPoolTimeout:
+        return hashing_timed_out()
     
     # Generate verification code
     code, exp = new_verification()
     
-    # Create user
-    res = users().insert_one({
-        "email": email,
-        "password": pw_hash,
-        "name": name,
-        "emailVerified": False,
-        "verify": {"code": code, "expiresAt": exp},
-        "token_version": 0,
-        "createdAt": int(time.time())
-    })
+    # Create user (the unique email index settles concurrent sign-ups)
+    try:
+        res = users().insert_one({
+            "email": email,
+            "password": pw_hash,
+            "name": name,
+            "emailVerified": False,
+            "token_version": 0,
+            "createdAt": int(time.time())
+        })
+    except DuplicateKeyError:
+        return jsonify({"error": "Email already registered."}), 409
+    store_verification(str(res.inserted_id), code, exp)
     
     # Create profile
     profiles().insert_one({
@@ -94,11 +190,9 @@ def register():
         "goals": {}
     })
 
-    # Send verification email
-    try:
-        send_email(email, "Verify your WorkoutApp email", email_html(code))
-    except Exception as e:
-        print("Email send error:", e)
+    # Queue verification email (delivered in the background)
+    if not enqueue_email(email, *VERIFY_EMAIL.render(code=code)):
+        print("Email send error: delivery queue full")
 
     # Issue tokens
     uid = str(res.inserted_id)
@@ -126,8 +220,9 @@ def register():
     }), 201
 
 @auth_bp.route("/login", methods=["POST"])
+@rate_limit("login")
 def login():
-    if not users():
+    if users() is None:
         return jsonify({"error": "DB not ready"}), 500
         
     data = request.get_json() or {}
@@ -135,9 +230,22 @@ def login():
     password = data.get("password") or ""
     
     user = users().find_one({"email": email})
-    if not user or not bcrypt.check_password_hash(user["password"], password):
+    try:
+        ok = bool(user) and check_password(user["password"], password)
+    except HashPoolBusy:
+        return busy()
+    except HashPoolTimeout:
+        return hashing_timed_out()
+    if not ok:
         return jsonify({"error": "Invalid credentials."}), 401
 
+    # Upgrade the stored hash to the current cost factor
+    if needs_rehash(user["password"]):
+        user_id = user["_id"]
+        rehash_in_background(password, lambda new_hash: users().update_one(
+            {"_id": user_id}, {"$set": {"password": new_hash}}
+        ))
+
     tv = int(user.get("token_version", 0))
     uid = str(user["_id"])
     
@@ -155,6 +263,7 @@ def login():
 
 @auth_bp.route("/send-verification", methods=["POST"])
 @jwt_required()
+@rate_limit("send_verification")
 def send_verification():
     uid = get_jwt_identity()
     user = users().find_one({"_id": ObjectId(uid)})
@@ -165,16 +274,11 @@ def send_verification():
         return jsonify({"message": "Already verified"}), 200
 
     code, exp = new_verification()
-    users().update_one(
-        {"_id": ObjectId(uid)}, 
-        {"$set": {"verify": {"code": code, "expiresAt": exp}}}
-    )
+    store_verification(uid, code, exp)
     
-    try:
-        send_email(user["email"], "Verify your WorkoutApp email", email_html(code))
-    except Exception as e:
-        print("Email send error:", e)
-        
+    if not enqueue_email(user["email"], *VERIFY_EMAIL.render(code=code)):
+        return jsonify({"error": "Email service busy, try again shortly"}), 503
+
     return jsonify({"message": "Verification code sent"})
 
 @auth_bp.route("/verify", methods=["POST"])
@@ -190,14 +294,16 @@ def verify():
     if user.get("emailVerified"):
         return jsonify({"message": "Already verified"}), 200
 
-    v = (user.get("verify") or {})
-    if not v or v.get("code") != code or int(time.time()) > int(v.get("expiresAt", 0)):
+    pending = pending_verification(uid, user)
+    if not pending or pending[0] != code or time.time() > pending[1]:
         return jsonify({"error": "Invalid or expired code"}), 400
 
     users().update_one(
         {"_id": ObjectId(uid)}, 
         {"$set": {"emailVerified": True}, "$unset": {"verify": ""}}
     )
+    verification_codes().delete_one({"_id": uid})
+    etags.bump("me", uid)
     return jsonify({"message": "Email verified"})
 
 @auth_bp.route("/refresh", methods=["POST"])
@@ -205,16 +311,16 @@ def verify():
 def refresh():
     uid = get_jwt_identity()
     claims = get_jwt()
-    user = users().find_one({"_id": ObjectId(uid)})
-    
-    if not user:
+    tv = user_token_version(uid)
+
+    if tv is None:
         return jsonify({"error": "No user"}), 404
-    if int(claims.get("tv", 0)) != int(user.get("token_version", 0)):
+    if int(claims.get("tv", 0)) != tv:
         return jsonify({"error": "Token version mismatch"}), 401
-        
+
     new_access = create_access_token(
         identity=uid, 
-        additional_claims={"tv": int(user.get("token_version", 0))}
+        additional_claims={"tv": tv}
     )
     return jsonify({"access": new_access})
 
@@ -222,38 +328,109 @@ def refresh():
 @jwt_required(verify_type=False)  # supports access or refresh
 def logout():
     jti = get_jwt()["jti"]
-    blacklist().insert_one({"jti": jti, "revokedAt": int(time.time())})
+    # revokedAt is a Date so the TTL index can expire it after the token would have
+    blacklist().update_one(
+        {"jti": jti},
+        {"$setOnInsert": {"jti": jti, "revokedAt": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    remember_revocation(jti, True)
     return jsonify({"message": "Logged out"})
 
 @auth_bp.route("/logout_all", methods=["POST"])
 @jwt_required()
 def logout_all():
     uid = get_jwt_identity()
-    users().update_one({"_id": ObjectId(uid)}, {"$inc": {"token_version": 1}})
+    user = users().find_one_and_update(
+        {"_id": ObjectId(uid)},
+        {"$inc": {"token_version": 1}},
+        projection={"token_version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    remember_token_version(uid, user)
+    etags.bump("me", uid)
     return jsonify({"message": "All sessions revoked"})
 
+# GET /auth/me serves the user's public fields and profile. The joined body
+# is kept per worker and keyed by the "me" version, which every write to
+# either document bumps; so a warm read is the one version lookup that the
+# ETag check needs anyway. ?fields=email,profile narrows the response (and
+# skips the users read when no user field is asked for).
+USER_FIELDS = ("email", "name", "emailVerified", "createdAt")
+ME_FIELDS = ("id",) + USER_FIELDS + ("profile",)
+ME_CACHE_SEC = int(os.getenv("ME_CACHE_SEC", "300"))
+me_bodies = TTLCache(maxsize=50_000, ttl=ME_CACHE_SEC)  # (uid, fields) -> (etag, body)
+
+def me_fields(arg):
+    """Requested fields from ?fields=..., all of ME_FIELDS by default."""
+    if not arg:
+        return ME_FIELDS
+    fields = tuple(f for f in (p.strip() for p in arg.split(",")) if f)
+    unknown = [f for f in fields if f not in ME_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(ME_FIELDS)}")
+    return fields
+
+def me_body(uid, fields):
+    body = {}
+    wanted = [f for f in USER_FIELDS if f in fields]
+    # whatever was asked for, a deleted account has no body
+    user = users().find_one({"_id": ObjectId(uid)}, {"_id": 1, **{f: 1 for f in wanted}})
+    if user is None:
+        return None
+    if wanted or "id" in fields:
+        body["user"] = {**({"id": uid} if "id" in fields else {}), **{f: user[f] for f in wanted if f in user}}
+    if "profile" in fields:
+        # read through: the version moved, and this worker's cached profile may predate it
+        body["profile"] = profiles().find_one({"userId": uid}, {"_id": 0}) or {}
+        remember_profile(uid, body["profile"])
+    return body
+
 @auth_bp.route("/me", methods=["GET", "PATCH"])
 @jwt_required()
 def me():
-    if not users():
+    if users() is None:
         return jsonify({"error": "DB not ready"}), 500
         
     uid = get_jwt_identity()
-    user = users().find_one({"_id": ObjectId(uid)}, {"password": 0})
-    prof = profiles().find_one({"userId": uid}, {"_id": 0}) or {}
-    
     if request.method == "GET":
-        user_data = {k: v for k, v in user.items() if k != "_id"}
-        user_data["id"] = uid
-        return jsonify({"user": user_data, "profile": prof})
+        try:
+            fields = me_fields(request.args.get("fields"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        # user + profile only change through routes that bump "me"
+        etag, last_modified = etags.validators("me", uid, ",".join(fields).encode())
+        cached = etags.not_modified(etag, last_modified)
+        if cached is not None:
+            return cached
+
+        with _cache_lock:
+            hit = me_bodies.get((uid, fields))
+        if hit is not None and hit[0] == etag:
+            body = hit[1]
+        else:
+            body = me_body(uid, fields)
+            if body is None:
+                return jsonify({"error": "User not found"}), 404
+            with _cache_lock:
+                me_bodies[(uid, fields)] = (etag, body)
+        return etags.tag(jsonify(body), etag, last_modified)
 
     # PATCH to update profile fields
     updates = (request.get_json() or {})
     allowed = {"sex", "age", "height_cm", "weight_kg", "body_fat_percent", "activity_level"}
     payload = {k: v for k, v in updates.items() if k in allowed}
     
-    if payload:
-        profiles().update_one({"userId": uid}, {"$set": payload}, upsert=True)
-        
-    prof = profiles().find_one({"userId": uid}, {"_id": 0})
+    if not payload:
+        return jsonify({"profile": profile_for(uid)})
+
+    prof = profiles().find_one_and_update(
+        {"userId": uid},
+        {"$set": payload},
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    remember_profile(uid, prof)
+    etags.bump("me", uid)
     return jsonify({"profile": prof})
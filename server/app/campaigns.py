@@ -0,0 +1,284 @@
+"""
+Bulk mail campaigns, run from the command line (from server/):
+
+    python -m app.campaigns verify [--sessions 4] [--page 500] [--rate 0]
+    python -m app.campaigns digest [--id digest-2024-W19] [--max-pages 10]
+
+`verify` gives every unverified user a fresh code and mails it; `digest`
+mails verified users last week's training and nutrition summary.
+
+Recipients are read in _id order a page at a time and handed to --sessions
+SMTP connections that stay open for the whole run (--rate caps messages per
+second across all of them). Once a page is fully sent, its last _id and the
+running counts are saved in mail_campaigns, so running the same --id again
+after a crash picks up where it stopped; only the page in flight is sent
+twice. A finished campaign is not run again unless --restart is given. Don't
+run one id from two processes at once.
+"""
+import os
+import sys
+import time
+import queue
+import smtplib
+import argparse
+import threading
+from datetime import datetime, timezone
+from pymongo import ReplaceOne
+from .mongo import collection
+from .emailer import MessageTemplate, VERIFY_EMAIL, build_message, open_connection, smtp_settings
+from .metrics import timed
+from .analytics import bucket_of
+from .auth import new_verification, verification_doc
+
+campaigns = lambda: collection("mail_campaigns")
+users = lambda: collection("users")
+
+DIGEST_EMAIL = MessageTemplate("Your WorkoutApp week {{ week }}", """
+<div style="font-family:sans-serif">
+  <h2>Hi {{ name or "there" }}, here's your week</h2>
+  {% if workouts %}
+  <p>You logged <b>{{ workouts }}</b> exercise{{ "s" if workouts != 1 }} ({{ sets }} sets),
+     moving <b>{{ "{:,.0f}".format(volume) }} kg</b> in total.</p>
+  <p>Most volume: {{ top_exercise }}.</p>
+  {% else %}
+  <p>No workouts logged last week. A short session is better than none!</p>
+  {% endif %}
+  {% if days_logged %}
+  <p>Food logged on {{ days_logged }} of 7 days, averaging {{ avg_calories }} kcal.</p>
+  {% endif %}
+</div>
+""")
+
+# ---- campaign kinds --------------------------------------------------------
+# Each kind selects recipients from `users` and turns a page of user
+# documents into [(email, template context)], reading or writing whatever
+# else it needs once per page rather than once per user.
+
+def verify_page(page, now):
+    ops, out = [], []
+    for user in page:
+        uid = str(user["_id"])
+        code, exp = new_verification()
+        ops.append(ReplaceOne({"_id": uid}, verification_doc(uid, code, exp), upsert=True))
+        out.append((user["email"], {"code": code}))
+    if ops:
+        collection("verification_codes").bulk_write(ops, ordered=False)
+    return out
+
+def digest_page(page, now):
+    week, start = bucket_of(now - 7 * 86400, "week")
+    uids = [str(u["_id"]) for u in page]
+    training = {}
+    for r in collection("workout_rollups").find({"userId": {"$in": uids}, "period": "week", "bucketStart": start}):
+        t = training.setdefault(r["userId"], {"workouts": 0, "sets": 0, "volume": 0.0, "by_exercise": {}})
+        t["workouts"] += r.get("workouts", 0)
+        t["sets"] += r.get("sets", 0)
+        t["volume"] += r.get("volume", 0.0)
+        t["by_exercise"][r["exercise"]] = r.get("volume", 0.0)
+    days = [datetime.fromtimestamp(start + i * 86400, timezone.utc).strftime("%Y-%m-%d") for i in range(7)]
+    eating = {}
+    for d in collection("food_log_days").find({"_id": {"$in": [f"{uid}:{day}" for uid in uids for day in days]}},
+                                              {"userId": 1, "calories": 1}):
+        eating.setdefault(d["userId"], []).append(max(0.0, d.get("calories", 0)))
+
+    out = []
+    for user, uid in zip(page, uids):
+        t = training.get(uid, {"workouts": 0, "sets": 0, "volume": 0.0, "by_exercise": {}})
+        cals = eating.get(uid, [])
+        out.append((user["email"], {
+            "name": user.get("name"), "week": week,
+            "workouts": t["workouts"], "sets": t["sets"], "volume": t["volume"],
+            "top_exercise": max(t["by_exercise"], key=t["by_exercise"].get) if t["by_exercise"] else None,
+            "days_logged": len(cals), "avg_calories": round(sum(cals) / len(cals)) if cals else 0,
+        }))
+    return out
+
+KINDS = {
+    "verify": ({"emailVerified": False}, verify_page, VERIFY_EMAIL),
+    "digest": ({"emailVerified": True}, digest_page, DIGEST_EMAIL),
+}
+
+def default_id(kind, now):
+    if kind == "digest":
+        return f"digest-{bucket_of(now - 7 * 86400, 'week')[0]}"
+    return f"{kind}-{datetime.fromtimestamp(now, timezone.utc):%Y-%m-%d}"
+
+# ---- sending ---------------------------------------------------------------
+PERMANENT = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)
+
+class SenderPool:
+    """
+    `sessions` threads, each holding one authenticated SMTP connection for the
+    pool's lifetime. send() blocks while every session is busy; drain() waits
+    for everything handed over so far and returns (sent, failed) since the
+    last drain. Transient errors reconnect and retry; refused addresses don't.
+    """
+
+    def __init__(self, settings, sessions=4, rate=0.0, max_retries=3):
+        self.settings = settings
+        self.max_retries = max_retries
+        self._interval = 1.0 / rate if rate else 0.0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=sessions * 2)
+        self._sent = self._failed = 0
+        self.errors = []  # (address, error) for failed recipients, most recent last
+        self._threads = [threading.Thread(target=self._run, name=f"campaign-smtp-{i}", daemon=True)
+                         for i in range(sessions)]
+        for t in self._threads:
+            t.start()
+
+    def send(self, to_email, message):
+        self._queue.put((to_email, message))
+
+    def drain(self):
+        self._queue.join()
+        with self._lock:
+            counts = self._sent, self._failed
+            self._sent = self._failed = 0
+        return counts
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+
+    def _pace(self):
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _deliver(self, server, to_email, message):
+        """Returns (server, error); error is None once the message is accepted."""
+        error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                if server is None:
+                    with timed("smtp", "connect"):
+                        server = open_connection(self.settings)
+                with timed("smtp", "send"):
+                    server.sendmail(self.settings["from"], [to_email], message)
+                return server, None
+            except PERMANENT as e:
+                return server, e
+            except (smtplib.SMTPException, OSError) as e:
+                error = e
+                try:
+                    if server is not None:
+                        server.close()
+                finally:
+                    server = None
+                time.sleep(min(0.5 * 2 ** attempt, 5.0))
+        return server, error
+
+    def _run(self):
+        server = None
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                break
+            self._pace()
+            server, error = self._deliver(server, *job)
+            with self._lock:
+                if error is None:
+                    self._sent += 1
+                else:
+                    self._failed += 1
+                    self.errors = self.errors[-99:] + [(job[0], str(error))]
+            self._queue.task_done()
+        if server is not None:
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+
+# ---- the run loop ----------------------------------------------------------
+def run(kind, campaign_id=None, sessions=4, page_size=500, rate=0.0, max_pages=None, restart=False,
+        log=print):
+    """Run (or resume) a campaign. Returns its mail_campaigns document."""
+    match, prepare, template = KINDS[kind]
+    now = time.time()
+    campaign_id = campaign_id or default_id(kind, now)
+    coll, people = campaigns(), users()
+    if coll is None or people is None:
+        raise RuntimeError("MONGO_URI not set")
+
+    state = coll.find_one({"_id": campaign_id})
+    if state and state.get("status") == "done" and not restart:
+        log(f"📭 {campaign_id} already finished ({state['sent']} sent); use --restart to send it again")
+        return state
+    if state is None or restart:
+        state = {"_id": campaign_id, "kind": kind, "status": "running", "lastId": None, "sent": 0,
+                 "failed": 0, "seconds": 0.0, "startedAt": datetime.now(timezone.utc)}
+        coll.replace_one({"_id": campaign_id}, state, upsert=True)
+    elif state.get("lastId") is not None:
+        log(f"↩️ resuming {campaign_id} after {state['sent'] + state['failed']} recipients")
+
+    settings = smtp_settings()
+    pool = SenderPool(settings, sessions=sessions, rate=rate)
+    started, counted, pages, done = time.monotonic(), 0.0, 0, False
+    try:
+        while max_pages is None or pages < max_pages:
+            query = dict(match)
+            if state["lastId"] is not None:
+                query["_id"] = {"$gt": state["lastId"]}
+            page = list(people.find(query, {"email": 1, "name": 1}).sort("_id", 1).limit(page_size))
+            if not page:
+                done = True
+                break
+            for to_email, context in prepare(page, now):
+                pool.send(to_email, build_message(settings["from"], to_email, *template.render(**context)))
+            sent, failed = pool.drain()
+
+            elapsed = time.monotonic() - started
+            state["lastId"] = page[-1]["_id"]
+            state["sent"] += sent
+            state["failed"] += failed
+            coll.update_one({"_id": campaign_id}, {
+                "$set": {"lastId": state["lastId"], "updatedAt": datetime.now(timezone.utc),
+                         "errors": [{"to": to, "error": err} for to, err in pool.errors[-20:]]},
+                "$inc": {"sent": sent, "failed": failed, "seconds": elapsed - counted},
+            })
+            counted = elapsed
+            pages += 1
+            log(f"📬 {campaign_id}: {state['sent']} sent, {state['failed']} failed, "
+                f"{(state['sent'] + state['failed']) / elapsed:.1f} msg/s this run")
+    finally:
+        pool.close()
+
+    if done:
+        coll.update_one({"_id": campaign_id}, {"$set": {"status": "done", "finishedAt": datetime.now(timezone.utc)}})
+    state = coll.find_one({"_id": campaign_id})
+    rate_all = (state["sent"] + state["failed"]) / state["seconds"] if state.get("seconds") else 0.0
+    log(f"{'✅' if done else '⏸️'} {campaign_id} {'finished' if done else 'paused'}: {state['sent']} sent, "
+        f"{state['failed']} failed, {rate_all:.1f} msg/s overall")
+    return state
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.campaigns", description="Send a bulk mail campaign.")
+    parser.add_argument("kind", choices=sorted(KINDS))
+    parser.add_argument("--id", dest="campaign_id", help="campaign id (default: per day, or per week for digest)")
+    parser.add_argument("--sessions", type=int, default=int(os.getenv("CAMPAIGN_SMTP_SESSIONS", "4")))
+    parser.add_argument("--page", type=int, default=500, help="recipients per page / checkpoint")
+    parser.add_argument("--rate", type=float, default=0.0, help="max messages per second (0 = unlimited)")
+    parser.add_argument("--max-pages", type=int, help="stop after this many pages; run again to continue")
+    parser.add_argument("--restart", action="store_true", help="start over even if the campaign exists")
+    args = parser.parse_args(argv)
+    try:
+        state = run(args.kind, args.campaign_id, args.sessions, args.page, args.rate, args.max_pages, args.restart)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return 2
+    return 0 if state.get("status") == "done" else 3
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
+    sys.exit(main())
@@ -1,47 +1,307 @@
 import os
-import smtplib
+import time
+import queue
+import atexit
+import base64
+import threading
+from email.header import Header
 from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from email.utils import formatdate, make_msgid, parseaddr
+from jinja2 import Environment
+from .metrics import timed
+
+def smtp_settings():
+    """
+    Read SMTP settings from environment variables.
+
+    Raises:
+        Exception: If SMTP credentials are not configured
+    """
+    settings = {
+        "host": os.getenv("SMTP_HOST", "smtp.gmail.com"),
+        "port": int(os.getenv("SMTP_PORT", "587")),
+        "user": os.getenv("SMTP_USER"),
+        "password": os.getenv("SMTP_PASSWORD"),
+        "starttls": os.getenv("SMTP_STARTTLS", "1") != "0",
+    }
+    settings["from"] = os.getenv("FROM_EMAIL", settings["user"])
+
+    if not settings["user"] or not settings["password"]:
+        raise Exception("SMTP credentials not configured. Set SMTP_USER and SMTP_PASSWORD in .env")
+    return settings
+
+# Templates are compiled once at import; rendering one is a few microseconds.
+# Values are HTML-escaped, so user-supplied names can't inject markup.
+_templates = Environment(autoescape=True, trim_blocks=True, lstrip_blocks=True)
+
+class MessageTemplate:
+    def __init__(self, subject, html):
+        self.subject = _templates.from_string(subject)
+        self.html = _templates.from_string(html)
+
+    def render(self, **context):
+        """(subject, html_body)"""
+        return self.subject.render(**context), self.html.render(**context)
+
+VERIFY_EMAIL = MessageTemplate("Verify your WorkoutApp email", """
+<div style="font-family:sans-serif">
+  <h2>Verify your email</h2>
+  <p>Your code is:</p>
+  <div style="font-size:28px;font-weight:700;letter-spacing:3px">{{ code }}</div>
+  <p>This code expires in 15 minutes.</p>
+</div>
+""")
+
+def build_message(from_email, to_email, subject, html_body):
+    """The message as bytes, ready for SMTP.sendmail: a single base64 text/html
+    part, assembled directly rather than through the email package, which costs
+    several times as much per message."""
+    domain = parseaddr(from_email)[1].rpartition("@")[2] or None
+    try:
+        to_email.encode("ascii")
+        from_email.encode("ascii")
+    except UnicodeEncodeError:
+        # internationalized address: let the email package get the headers right
+        msg = MIMEText(html_body, "html", "utf-8")
+        msg["Subject"], msg["From"], msg["To"] = subject, from_email, to_email
+        msg["Date"], msg["Message-ID"] = formatdate(), make_msgid(domain=domain)
+        return msg.as_bytes()
+    if not subject.isascii():
+        subject = Header(subject, "utf-8").encode()
+    headers = (
+        'Content-Type: text/html; charset="utf-8"\r\n'
+        "MIME-Version: 1.0\r\n"
+        "Content-Transfer-Encoding: base64\r\n"
+        f"Subject: {subject}\r\n"
+        f"From: {from_email}\r\n"
+        f"To: {to_email}\r\n"
+        f"Date: {formatdate()}\r\n"
+        f"Message-ID: {make_msgid(domain=domain)}\r\n"
+        "\r\n"
+    )
+    return headers.encode("ascii") + base64.encodebytes(html_body.encode("utf-8")).replace(b"\n", b"\r\n")
+
+def open_connection(settings):
+    import smtplib  # loaded with the first connection, not at startup
+    server = smtplib.SMTP(settings["host"], settings["port"], timeout=30)
+    if settings["starttls"]:
+        server.starttls()  # Enable TLS encryption
+    server.login(settings["user"], settings["password"])
+    return server
 
 def send_email(to_email, subject, html_body):
     """
-    Send an email using SMTP.
-    
+    Send an email using SMTP, blocking until the server accepts it.
+    Request handlers should use enqueue_email instead.
+
     Args:
         to_email (str): Recipient email address
         subject (str): Email subject
         html_body (str): HTML content of the email
-    
+
     Raises:
         Exception: If email sending fails
     """
-    # Get SMTP settings from environment variables
-    SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
-    SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
-    SMTP_USER = os.getenv("SMTP_USER")
-    SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
-    FROM_EMAIL = os.getenv("FROM_EMAIL", SMTP_USER)
-    
-    if not SMTP_USER or not SMTP_PASSWORD:
-        raise Exception("SMTP credentials not configured. Set SMTP_USER and SMTP_PASSWORD in .env")
-    
-    # Create message
-    msg = MIMEMultipart("alternative")
-    msg["Subject"] = subject
-    msg["From"] = FROM_EMAIL
-    msg["To"] = to_email
-    
-    # Attach HTML content
-    html_part = MIMEText(html_body, "html")
-    msg.attach(html_part)
-    
-    # Send email
+    settings = smtp_settings()
+    msg = build_message(settings["from"], to_email, subject, html_body)
+
     try:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-            server.starttls()  # Enable TLS encryption
-            server.login(SMTP_USER, SMTP_PASSWORD)
-            server.send_message(msg)
+        with open_connection(settings) as server:
+            server.sendmail(settings["from"], [to_email], msg)
             print(f"✅ Email sent to {to_email}")
     except Exception as e:
         print(f"❌ Failed to send email to {to_email}: {e}")
-        raise
\ No newline at end of file
+        raise
+
+class EmailQueue:
+    """
+    Background delivery queue. Each worker thread keeps one authenticated SMTP
+    connection open, sends messages in batches over it, and closes it after
+    `idle_timeout` seconds without work. Failed sends are retried with
+    exponential backoff, except refused senders or recipients, which fail at
+    once and keep the connection.
+    """
+
+    def __init__(self, workers=2, batch_size=20, max_size=10000, max_retries=3,
+                 backoff=2.0, idle_timeout=30.0):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self._queue = queue.Queue(maxsize=max_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stopping = False
+        self._metrics = {
+            "enqueued": 0,
+            "sent": 0,
+            "failed": 0,
+            "retried": 0,
+            "dropped": 0,
+            "connections_opened": 0,
+            "last_latency_ms": None,
+            "total_latency_ms": 0.0,
+        }
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._metrics[key] += n
+
+    def start(self):
+        # threads do not survive a fork, so (re)start them in each process
+        with self._lock:
+            if self._pid == os.getpid() and self._threads:
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._threads = [
+                threading.Thread(target=self._run, name=f"email-worker-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for t in self._threads:
+                t.start()
+
+    def stop(self, timeout=5.0):
+        """Let workers drain the queue for up to `timeout` seconds, then stop."""
+        deadline = time.monotonic() + timeout
+        while not self._queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self._stopping = True
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)  # wake idle workers
+            except queue.Full:
+                break
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+
+    def enqueue(self, to_email, subject, html_body):
+        """Queue a message and return immediately. False if the queue is full."""
+        self.start()
+        try:
+            self._queue.put_nowait({
+                "to": to_email,
+                "subject": subject,
+                "html": html_body,
+                "attempts": 0,
+                "queuedAt": time.monotonic(),
+            })
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("enqueued")
+        return True
+
+    def stats(self):
+        with self._lock:
+            m = dict(self._metrics)
+        delivered = m.pop("total_latency_ms")
+        m["avg_latency_ms"] = round(delivered / m["sent"], 2) if m["sent"] else None
+        m["queue_depth"] = self._queue.qsize()
+        m["workers"] = sum(t.is_alive() for t in self._threads)
+        return m
+
+    def _retry_later(self, job, error):
+        job["attempts"] += 1
+        if job["attempts"] > self.max_retries:
+            self._count("failed")
+            print(f"❌ Failed to send email to {job['to']}: {error}")
+            return
+        self._count("retried")
+        delay = self.backoff * (2 ** (job["attempts"] - 1))
+        timer = threading.Timer(delay, self._requeue, args=(job,))
+        timer.daemon = True
+        timer.start()
+
+    def _requeue(self, job):
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._count("dropped")
+
+    def _next_batch(self):
+        try:
+            job = self._queue.get(timeout=self.idle_timeout)
+        except queue.Empty:
+            return []
+        batch = [job] if job is not None else []
+        while batch and len(batch) < self.batch_size:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                break
+            batch.append(job)
+        return batch
+
+    def _run(self):
+        import smtplib
+        server = None
+        while not self._stopping:
+            batch = self._next_batch()
+            if not batch:
+                # idle: don't hold the SMTP session open indefinitely
+                if server is not None:
+                    try:
+                        server.quit()
+                    except (smtplib.SMTPException, OSError):
+                        pass
+                    server = None
+                continue
+
+            try:
+                settings = smtp_settings()
+            except Exception as e:
+                for job in batch:
+                    self._retry_later(job, e)
+                continue
+
+            for job in batch:
+                msg = build_message(settings["from"], job["to"], job["subject"], job["html"])
+                try:
+                    if server is None:
+                        with timed("smtp", "connect"):
+                            server = open_connection(settings)
+                        self._count("connections_opened")
+                    with timed("smtp", "send"):
+                        server.sendmail(settings["from"], [job["to"]], msg)
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused) as e:
+                    # a permanent answer about this message; the session is still good
+                    self._count("failed")
+                    print(f"❌ Failed to send email to {job['to']}: {e}")
+                    continue
+                except (smtplib.SMTPException, OSError) as e:
+                    # the connection may be unusable now; reopen on next send
+                    try:
+                        if server is not None:
+                            server.close()
+                    finally:
+                        server = None
+                    self._retry_later(job, e)
+                    continue
+
+                latency = (time.monotonic() - job["queuedAt"]) * 1000
+                with self._lock:
+                    self._metrics["sent"] += 1
+                    self._metrics["last_latency_ms"] = round(latency, 2)
+                    self._metrics["total_latency_ms"] += latency
+
+        if server is not None:
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+
+mail_queue = EmailQueue(
+    workers=int(os.getenv("SMTP_POOL_SIZE", "2")),
+    batch_size=int(os.getenv("SMTP_BATCH_SIZE", "20")),
+    max_retries=int(os.getenv("SMTP_MAX_RETRIES", "3")),
+)
+atexit.register(mail_queue.stop)
+
+def enqueue_email(to_email, subject, html_body):
+    """Queue an email for background delivery and return immediately."""
+    return mail_queue.enqueue(to_email, subject, html_body)
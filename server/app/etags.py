@@ -0,0 +1,75 @@
+import zlib
+import hashlib
+from datetime import datetime, timezone
+from flask import Response, request
+from pymongo import UpdateOne
+from .mongo import collection
+
+# Conditional GETs driven by per-owner version counters. Every write to a
+# resource bumps {_id: "<owner>:<resource>"} in resource_versions; a read
+# first fetches that one small document and answers 304 when the client's
+# ETag (or Last-Modified) still matches, before running the real query.
+#
+# Owners are user ids, or "*" for views that span users (e.g. GET
+# /api/workouts without a user). The ETag carries a hash of the owner, so one
+# user's tag never validates another user's response, and responses are
+# marked private and Vary: Authorization for shared browsers and caches.
+# Last-Modified has one-second resolution, so clients should prefer
+# If-None-Match, which always wins when sent.
+
+versions = lambda: collection("resource_versions")
+
+GLOBAL = "*"
+CACHE_CONTROL = "private, no-cache"
+
+def version_id(resource, owner):
+    return f"{owner}:{resource}"
+
+def bump(resource, *owners):
+    """Record that `resource` changed for each owner (None owners are skipped)."""
+    coll = versions()
+    if coll is None:
+        return
+    now = datetime.now(timezone.utc)
+    ops = [UpdateOne({"_id": version_id(resource, owner)}, {"$inc": {"v": 1}, "$set": {"at": now}}, upsert=True)
+           for owner in {o for o in owners if o}]
+    if ops:
+        coll.bulk_write(ops, ordered=False)
+
+def owner_tag(owner):
+    return hashlib.blake2b(str(owner).encode(), digest_size=8).hexdigest()
+
+def from_version(resource, owner, doc, variant=b""):
+    """(etag, last_modified) from `owner`'s resource_versions document (or
+    None). `variant` (e.g. the query string) distinguishes different views of it."""
+    doc = doc or {}
+    etag = f"{resource}-{owner_tag(owner)}-{doc.get('v', 0)}-{zlib.crc32(variant):08x}"
+    at = doc.get("at")
+    if at is not None and at.tzinfo is None:
+        at = at.replace(tzinfo=timezone.utc)
+    return etag, at
+
+def validators(resource, owner, variant=b""):
+    """(etag, last_modified) for `owner`'s current version of `resource`."""
+    coll = versions()
+    doc = coll.find_one({"_id": version_id(resource, owner)}) if coll is not None else None
+    return from_version(resource, owner, doc, variant)
+
+def tag(resp, etag, last_modified):
+    resp.set_etag(etag, weak=True)
+    if last_modified is not None:
+        resp.last_modified = last_modified
+    # cacheable by the client only, per credentials, and always revalidated
+    resp.headers["Cache-Control"] = CACHE_CONTROL
+    resp.vary.add("Authorization")
+    return resp
+
+def not_modified(etag, last_modified):
+    """A 304 response when the request's validators match, else None."""
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified is not None:
+        fresh = last_modified.replace(microsecond=0) <= request.if_modified_since
+    else:
+        fresh = False
+    return tag(Response(status=304), etag, last_modified) if fresh else None
@@ -0,0 +1,235 @@
+import os
+import asyncio
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from cachetools import TTLCache
+from .mongo import collection
+from .metrics import timed
+
+# Cached front end for the Nutritionix instant search.
+#   1. in-memory LRU (per worker, short TTL)
+#   2. Mongo collection food_search_cache (shared, TTL index on cachedAt)
+#   3. the provider, with concurrent identical queries coalesced into one call
+
+PROVIDER_URL = os.getenv("NUTRITIONIX_URL", "https://trackapi.nutritionix.com/v2/search/instant")
+PROVIDER_TIMEOUT = 10
+PROVIDER_PAGE = 20          # Nutritionix returns at most this many per list
+CACHE_TTL_SEC = int(os.getenv("FOOD_CACHE_TTL_SEC", str(24 * 3600)))
+MIN_PREFIX = 2
+
+class ProviderUnreachable(Exception):
+    """The provider could not be reached (connection error, timeout)."""
+
+class ProviderBusy(Exception):
+    """Gave up waiting on another request's call for the same query."""
+
+class ProviderError(Exception):
+    def __init__(self, status):
+        super().__init__(f"nutrition provider error {status}")
+        self.status = status
+
+_lock = threading.Lock()
+_memory = TTLCache(maxsize=int(os.getenv("FOOD_CACHE_SIZE", "5000")), ttl=min(CACHE_TTL_SEC, 3600))
+_inflight = {}
+_async_inflight = {}
+_session = None
+_local = None
+
+def search_cache():
+    return collection("food_search_cache")
+
+def http():
+    """Shared keep-alive session for provider calls. requests is imported
+    here, so workers that never call the provider don't load it."""
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        s = requests.Session()
+        s.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+        s.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+        _session = s
+    return _session
+
+def local_index():
+    """Offline index from FOOD_INDEX_PATH (built with utils.food_index), if any.
+    utils.food_index (and numpy) is imported on the first search that has one."""
+    global _local
+    path = os.getenv("FOOD_INDEX_PATH")
+    if _local is None and path and os.path.isdir(path):
+        with _lock:
+            if _local is None:
+                from utils.food_index import FoodIndex
+                _local = FoodIndex(path)
+                print(f"🥦 Loaded local food index ({len(_local)} foods)")
+    return _local
+
+def search_local(q, limit=25):
+    index = local_index()
+    return index.search(q, limit) if index is not None else []
+
+def normalize(q):
+    return " ".join(q.lower().split())
+
+def shape_item(item):
+    # minimal shape (foods + macros per serving)
+    nf = {
+        "name": item.get("food_name") or item.get("brand_name_item_name"),
+        "brand": item.get("brand_name"),
+        "serving_qty": item.get("serving_qty"),
+        "serving_unit": item.get("serving_unit"),
+        "calories": item.get("nf_calories"),
+        "protein_g": item.get("nf_protein"),
+        "carbs_g": item.get("nf_total_carbohydrate"),
+        "fat_g": item.get("nf_total_fat")
+    }
+    return {k: v for k, v in nf.items() if v is not None}
+
+def provider_request(q):
+    headers = {"x-app-id": os.getenv("NUTRITIONIX_APP_ID"), "x-app-key": os.getenv("NUTRITIONIX_API_KEY")}
+    return {"url": PROVIDER_URL, "headers": headers, "params": {"query": q, "detailed": "true"}}
+
+def fetch_provider(q):
+    import requests  # already loaded by http()
+    try:
+        with timed("http", "nutritionix"):
+            resp = http().get(**provider_request(q), timeout=PROVIDER_TIMEOUT)
+    except requests.RequestException as e:
+        raise ProviderUnreachable(str(e)) from e
+    if resp.status_code != 200:
+        raise ProviderError(resp.status_code)
+    return parse_provider(resp.json())
+
+def parse_provider(data):
+    common, branded = data.get("common", []), data.get("branded", [])
+    return {
+        "items": [shape_item(i) for i in common + branded],
+        # a short result list holds every match, so longer queries can filter it
+        "complete": len(common) < PROVIDER_PAGE and len(branded) < PROVIDER_PAGE,
+    }
+
+def from_superset(key):
+    """Serve "chicken br" from a complete cached result for "chicken" or "chick"."""
+    words = key.split()
+    with _lock:
+        for n in range(len(key) - 1, MIN_PREFIX - 1, -1):
+            entry = _memory.get(key[:n])
+            if entry and entry["complete"]:
+                break
+        else:
+            return None
+    matches = [i for i in entry["items"] if all(w in (i.get("name") or "").lower() for w in words)]
+    return {"items": matches, "complete": True} if matches else None
+
+def _lookup_memory(key):
+    with _lock:
+        entry = _memory.get(key)
+    if entry is not None:
+        return entry, "memory"
+
+    entry = from_superset(key)
+    if entry is not None:
+        return entry, "prefix"
+    return None, None
+
+def _from_store(key, doc):
+    entry = {"items": doc["items"], "complete": doc.get("complete", False)}
+    with _lock:
+        _memory[key] = entry
+    return entry
+
+def _store_doc(entry):
+    return {"$set": {**entry, "cachedAt": datetime.now(timezone.utc)}}
+
+def _lookup(key):
+    entry, source = _lookup_memory(key)
+    if entry is not None:
+        return entry, source
+
+    coll = search_cache()
+    if coll is not None:
+        doc = coll.find_one({"_id": key}, {"items": 1, "complete": 1})
+        if doc:
+            return _from_store(key, doc), "store"
+    return None, None
+
+def search_foods(q):
+    """
+    Return (items, source) for a query, where source is one of
+    memory/prefix/store/provider. Raises ProviderError on an upstream error
+    response, ProviderUnreachable when the provider can't be reached and
+    ProviderBusy when the call this one waited on didn't finish in time.
+    """
+    key = normalize(q)
+    entry, source = _lookup(key)
+    if entry is not None:
+        return entry["items"], source
+
+    # single flight: the first caller fetches, the rest wait on its result
+    with _lock:
+        pending = _inflight.get(key)
+        leader = pending is None
+        if leader:
+            pending = _inflight[key] = Future()
+    if not leader:
+        try:
+            return pending.result(timeout=PROVIDER_TIMEOUT + 1)["items"], "provider"
+        except FutureTimeout:
+            raise ProviderBusy() from None
+
+    try:
+        entry = fetch_provider(key)
+        with _lock:
+            _memory[key] = entry
+        coll = search_cache()
+        if coll is not None:
+            coll.update_one({"_id": key}, _store_doc(entry), upsert=True)
+        pending.set_result(entry)
+    except BaseException as e:
+        pending.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+    return entry["items"], "provider"
+
+async def search_foods_async(q, client, store=None):
+    """
+    search_foods for the ASGI app: same cache tiers, but the provider call
+    goes through an aiohttp.ClientSession and the Mongo tier through a Motor
+    collection (`store`), so waiting on either never holds a thread.
+    """
+    key = normalize(q)
+    entry, source = _lookup_memory(key)
+    if entry is not None:
+        return entry["items"], source
+    if store is not None:
+        doc = await store.find_one({"_id": key}, {"items": 1, "complete": 1})
+        if doc:
+            return _from_store(key, doc)["items"], "store"
+
+    pending = _async_inflight.get(key)
+    if pending is not None:
+        return (await asyncio.shield(pending))["items"], "provider"
+
+    pending = _async_inflight[key] = asyncio.get_running_loop().create_future()
+    try:
+        with timed("http", "nutritionix"):
+            async with client.get(**provider_request(key)) as resp:
+                if resp.status != 200:
+                    raise ProviderError(resp.status)
+                entry = parse_provider(await resp.json(content_type=None))
+        with _lock:
+            _memory[key] = entry
+        if store is not None:
+            await store.update_one({"_id": key}, _store_doc(entry), upsert=True)
+        pending.set_result(entry)
+    except BaseException as e:
+        pending.set_exception(e)
+        # mark retrieved so lone failures don't log "exception never retrieved"
+        pending.exception()
+        raise
+    finally:
+        _async_inflight.pop(key, None)
+    return entry["items"], "provider"
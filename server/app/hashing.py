@@ -0,0 +1,183 @@
+import os
+import math
+import time
+import atexit
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from .metrics import timed
+from .mongo import collection
+
+# Password hashing runs in a separate process pool so bcrypt never holds a
+# request thread (or the GIL) for hundreds of milliseconds. bcrypt, the pool
+# and the cost are all set up on first use (or by the startup checks, see
+# warm_hashing), not by create_app().
+
+MIN_ROUNDS = 10
+MAX_ROUNDS = 15
+
+class HashPoolBusy(Exception):
+    """Raised when the hashing queue is full; routes answer 429."""
+
+class HashPoolTimeout(Exception):
+    """Raised when a hash isn't done within its timeout; routes answer 503."""
+
+_bcrypt = None
+_rounds = None  # resolved on first use, see current_rounds()
+_rounds_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(int(os.getenv("HASH_QUEUE_MAX", "64")))
+
+def _encode(password):
+    # bcrypt only looks at the first 72 bytes
+    return password.encode("utf-8")[:72]
+
+def _lib():
+    global _bcrypt
+    if _bcrypt is None:
+        import bcrypt
+        _bcrypt = bcrypt
+    return _bcrypt
+
+def _hash(password, rounds):
+    return _lib().hashpw(_encode(password), _lib().gensalt(rounds)).decode("utf-8")
+
+def _check(pw_hash, password):
+    try:
+        return _lib().checkpw(_encode(password), pw_hash.encode("utf-8"))
+    except ValueError:
+        return False
+
+def hash_cost(pw_hash):
+    """Cost factor of a "$2b$<cost>$..." hash, or None if unparseable."""
+    try:
+        return int(pw_hash.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def current_rounds():
+    """The cost for new hashes: BCRYPT_LOG_ROUNDS if set, else the deployment's
+    calibrated cost (see shared_rounds), looked up on first use."""
+    global _rounds
+    if _rounds is None:
+        with _rounds_lock:
+            if _rounds is None:
+                _rounds = shared_rounds(float(os.getenv("BCRYPT_TARGET_MS", "250")))
+                print(f"🔐 bcrypt cost set to {_rounds}")
+    return _rounds
+
+def needs_rehash(pw_hash):
+    # only upgrade: a worker must never lower a cost another one chose
+    cost = hash_cost(pw_hash)
+    return cost is None or cost < current_rounds()
+
+def calibrate_rounds(target_ms):
+    """
+    Pick the bcrypt cost whose hash time is closest to `target_ms` on this
+    machine. Each extra round doubles the work, so time a cheap cost once
+    and extrapolate instead of timing expensive ones.
+    """
+    probe = 8
+    start = time.perf_counter()
+    _hash("calibration-password", probe)
+    elapsed_ms = max((time.perf_counter() - start) * 1000, 0.01)
+    rounds = probe + round(math.log2(target_ms / elapsed_ms))
+    return max(MIN_ROUNDS, min(MAX_ROUNDS, rounds))
+
+def shared_rounds(target_ms):
+    """
+    Calibrate once per deployment: the first process to get here stores its
+    cost in app_settings and every worker adopts that one, whatever its own
+    machine would pick. Delete the "bcrypt" document to recalibrate. Without
+    Mongo the local calibration is used.
+    """
+    settings = collection("app_settings")
+    if settings is None:
+        return calibrate_rounds(target_ms)
+    try:
+        doc = settings.find_one({"_id": "bcrypt"})
+        if doc is None:
+            try:
+                settings.insert_one({"_id": "bcrypt", "rounds": calibrate_rounds(target_ms), "targetMs": target_ms})
+            except DuplicateKeyError:
+                pass  # another worker calibrated first; use its cost
+            doc = settings.find_one({"_id": "bcrypt"})
+        return int(doc["rounds"])
+    except PyMongoError:
+        return calibrate_rounds(target_ms)
+
+def init_hashing(app):
+    """Pin the cost from BCRYPT_LOG_ROUNDS; otherwise it is resolved on first use."""
+    global _rounds
+    if os.getenv("BCRYPT_LOG_ROUNDS"):
+        _rounds = int(os.getenv("BCRYPT_LOG_ROUNDS"))
+        app.config["BCRYPT_LOG_ROUNDS"] = _rounds
+        print(f"🔐 bcrypt cost set to {_rounds}")
+
+def warm_hashing():
+    """Resolve the cost and fork the pool ahead of the first login."""
+    current_rounds()
+    _executor().submit(hash_cost, "").result()
+
+def _executor():
+    global _pool, _pool_pid
+    # a pool inherited across fork is unusable, build one per process
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            _lib()  # loaded before the fork, so workers never import it themselves
+            _pool = ProcessPoolExecutor(
+                max_workers=int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 2))),
+                mp_context=multiprocessing.get_context("fork"),
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+def _shutdown_pool():
+    # before interpreter teardown, which would otherwise collect the pool
+    # after its (lazily imported) module is gone
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.shutdown()
+
+atexit.register(_shutdown_pool)
+
+def _submit(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise HashPoolBusy()
+    try:
+        future = _executor().submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+def _result(future, timeout):
+    try:
+        return future.result(timeout)
+    except FutureTimeout:
+        raise HashPoolTimeout() from None
+
+def hash_password(password, timeout=10):
+    with timed("bcrypt", "hash"):
+        return _result(_submit(_hash, password, current_rounds()), timeout)
+
+def check_password(pw_hash, password, timeout=10):
+    with timed("bcrypt", "check"):
+        return _result(_submit(_check, pw_hash, password), timeout)
+
+def rehash_in_background(password, on_done):
+    """Hash `password` at the current cost and pass the result to `on_done`.
+    Skipped silently when the pool is busy; the next login will retry."""
+    try:
+        future = _submit(_hash, password, current_rounds())
+    except HashPoolBusy:
+        return
+
+    def done(f):
+        if f.exception() is None:
+            on_done(f.result())
+    future.add_done_callback(done)
@@ -0,0 +1,199 @@
+"""
+Every index the app relies on, ensured at startup and checked on demand.
+
+ensure_indexes() runs in the background at startup (app/startup.py): indexes
+that are missing are built, TTL indexes whose lifetime changed (e.g.
+FOOD_CACHE_TTL_SEC) are updated in place with collMod, and anything that
+can't be reconciled automatically (duplicate emails blocking the unique index,
+an index that exists with other options) is reported rather than raised, so
+the worker still becomes ready.
+
+GET /api/diagnostics/indexes (behind OPS_TOKEN, see app/ops.py) returns that
+report plus the query plans of the app's hot queries, flagging any that would
+scan a whole collection. From the
+command line (server/):
+
+    python -m app.indexes                      # ensure + explain, print JSON
+    python -m app.indexes --drop-legacy-codes  # one-off: strip expired `verify`
+                                               # codes left in user documents
+
+Workouts stored before performedAt was stamped on every insert are
+backfilled at startup as well (backfill_performed_at), so keyset pagination
+on (performedAt, _id) reaches them.
+"""
+import os
+import sys
+import json
+import time
+from datetime import datetime, timezone
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne
+from pymongo.errors import OperationFailure
+
+def desired_indexes(refresh_token_ttl):
+    """{collection: [IndexModel]}; `refresh_token_ttl` is JWT_REFRESH_TOKEN_EXPIRES in seconds."""
+    return {
+        "users": [
+            # login/register lookups, and no two accounts per address
+            IndexModel([("email", ASCENDING)], unique=True),
+            # mail campaign recipients, paged in _id order (see app/campaigns.py)
+            IndexModel([("emailVerified", ASCENDING), ("_id", ASCENDING)]),
+        ],
+        # one profile per user; read by userId on nearly every route
+        "profiles": [IndexModel([("userId", ASCENDING)], unique=True)],
+        # pending email codes, gone once they expire (see auth.store_verification)
+        "verification_codes": [IndexModel([("expireAt", ASCENDING)], expireAfterSeconds=0)],
+        # revoked tokens only matter until they would have expired anyway
+        "token_blacklist": [
+            IndexModel([("jti", ASCENDING)], unique=True),
+            IndexModel([("revokedAt", ASCENDING)], expireAfterSeconds=int(refresh_token_ttl)),
+        ],
+        # keyset pagination for GET /api/workouts (newest first)
+        "workouts": [
+            IndexModel([("userId", ASCENDING), ("performedAt", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("performedAt", DESCENDING), ("_id", DESCENDING)]),
+        ],
+        # training rollups, read per user per period in time order
+        "workout_rollups": [IndexModel([("userId", ASCENDING), ("period", ASCENDING), ("bucketStart", ASCENDING)])],
+        # per-exercise training state, read per user in exercise order (see app/training.py)
+        "exercise_state": [IndexModel([("userId", ASCENDING), ("exercise", ASCENDING)])],
+        # food log entries are listed per user per day, in insertion order
+        "food_log": [IndexModel([("userId", ASCENDING), ("day", ASCENDING), ("_id", ASCENDING)])],
+        # shared rate-limit buckets, when RATELIMIT_STORAGE=mongo (see app/ratelimit.py)
+        "rate_limits": [IndexModel([("expireAt", ASCENDING)], expireAfterSeconds=0)],
+        # cached provider searches (see app/food_search.py)
+        "food_search_cache": [IndexModel([("cachedAt", ASCENDING)],
+                                         expireAfterSeconds=int(os.getenv("FOOD_CACHE_TTL_SEC", str(24 * 3600))))],
+    }
+
+def _key(spec):
+    return [(field, int(direction)) for field, direction in spec]
+
+def ensure_indexes(db, wanted):
+    """
+    Bring `db` in line with `wanted`. Returns {"ok": [...], "created": [...],
+    "updated": [...], "errors": [{"index", "error"}]}, entries "collection.name".
+    Connection errors propagate; per-index failures are reported.
+    """
+    report = {"ok": [], "created": [], "updated": [], "errors": []}
+    for coll_name, models in wanted.items():
+        coll = db[coll_name]
+        existing = {tuple(_key(info["key"])): (name, info) for name, info in coll.index_information().items()}
+        for model in models:
+            doc = model.document
+            found = existing.get(tuple(_key(doc["key"].items())))
+            label = f"{coll_name}.{found[0] if found else doc['name']}"
+            try:
+                if found is None:
+                    coll.create_indexes([model])
+                    report["created"].append(label)
+                    continue
+                info = found[1]
+                if bool(info.get("unique")) != bool(doc.get("unique")):
+                    raise OperationFailure(f"exists with unique={bool(info.get('unique'))}; drop it to rebuild")
+                ttl = doc.get("expireAfterSeconds")
+                if ttl is not None and info.get("expireAfterSeconds") != ttl:
+                    db.command("collMod", coll_name, index={"keyPattern": dict(doc["key"]), "expireAfterSeconds": ttl})
+                    report["updated"].append(label)
+                else:
+                    report["ok"].append(label)
+            except OperationFailure as e:
+                report["errors"].append({"index": label, "error": str(e)})
+    return report
+
+# ---- query plans -----------------------------------------------------------
+# The shapes of the app's frequent reads; the values don't affect the plan.
+_uid, _oid = "000000000000000000000000", ObjectId("000000000000000000000000")
+HOT_QUERIES = [
+    ("login / register", "users", {"email": "probe@example.invalid"}, None, 1),
+    ("user by id", "users", {"_id": _oid}, None, 1),
+    ("campaign page", "users", {"emailVerified": False, "_id": {"$gt": _oid}}, [("_id", 1)], 500),
+    ("profile", "profiles", {"userId": _uid}, None, 1),
+    ("revoked token", "token_blacklist", {"jti": "probe"}, None, 1),
+    ("workouts, own", "workouts", {"userId": _uid}, [("performedAt", -1), ("_id", -1)], 50),
+    ("workouts, all", "workouts", {}, [("performedAt", -1), ("_id", -1)], 50),
+    ("rollups", "workout_rollups", {"userId": _uid, "period": "week"}, [("bucketStart", 1)], 0),
+    ("training state", "exercise_state", {"userId": _uid}, [("exercise", 1)], 0),
+    ("food log day", "food_log", {"userId": _uid, "day": "2000-01-01"}, [("_id", 1)], 0),
+]
+
+def _stages(plan):
+    plan = plan.get("queryPlan", plan)  # slot-based engine wraps the classic plan
+    yield plan
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            yield from _stages(child)
+
+def explain_hot_queries(db):
+    """[{query, collection, stages, indexes, collscan, blocking_sort}] from queryPlanner explains."""
+    out = []
+    for name, coll, filt, sort, limit in HOT_QUERIES:
+        cmd = {"find": coll, "filter": filt}
+        if sort:
+            cmd["sort"] = dict(sort)
+        if limit:
+            cmd["limit"] = limit
+        entry = {"query": name, "collection": coll}
+        try:
+            plan = db.command("explain", cmd, verbosity="queryPlanner")["queryPlanner"]["winningPlan"]
+        except Exception as e:
+            out.append({**entry, "error": str(e)})
+            continue
+        stages = list(_stages(plan))
+        names = [s.get("stage") for s in stages]
+        out.append({
+            **entry,
+            "stages": names,
+            "indexes": [s["indexName"] for s in stages if "indexName" in s],
+            "collscan": "COLLSCAN" in names,
+            "blocking_sort": "SORT" in names,
+        })
+    return out
+
+def drop_legacy_codes(db):
+    """Strip expired codes stored in user documents before verification_codes."""
+    return db["users"].update_many({"verify.expiresAt": {"$lt": int(time.time())}}, {"$unset": {"verify": ""}}).modified_count
+
+def _legacy_time(doc):
+    # a date the old client sent, else when the document was created
+    value = doc.get("performedAt")
+    if isinstance(value, str):
+        try:
+            return int(float(value))
+        except ValueError:
+            pass
+        try:
+            dt = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+            return int((dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp())
+        except ValueError:
+            pass
+    if isinstance(doc["_id"], ObjectId):
+        return int(doc["_id"].generation_time.timestamp())
+    return int(time.time())
+
+def backfill_performed_at(db, chunk=1000):
+    """Give workouts without a numeric performedAt one; returns how many were updated."""
+    ops, updated = [], 0
+    for doc in db["workouts"].find({"performedAt": {"$not": {"$type": "number"}}}, {"performedAt": 1}):
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"performedAt": _legacy_time(doc)}}))
+        if len(ops) >= chunk:
+            updated += db["workouts"].bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        updated += db["workouts"].bulk_write(ops, ordered=False).modified_count
+    return updated
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
+    from .mongo import get_db
+    db = get_db()
+    if db is None:
+        print("❌ MONGO_URI not set")
+        sys.exit(2)
+    report = ensure_indexes(db, desired_indexes(int(os.getenv("JWT_REFRESH_DAYS", "14")) * 86400))
+    result = {"indexes": report, "backfilled": backfill_performed_at(db), "queries": explain_hot_queries(db)}
+    if "--drop-legacy-codes" in sys.argv[1:]:
+        result["legacy_codes_dropped"] = drop_legacy_codes(db)
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if report["errors"] or any(q.get("collscan") for q in result["queries"]) else 0)
@@ -0,0 +1,188 @@
+import os
+import re
+import time
+import asyncio
+import hashlib
+import secrets
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError
+from .mongo import collection
+from .analytics import record_workouts, e1rm
+from .routes import validate_workout
+from . import etags
+
+# Live workout sessions: the client keeps one WebSocket open for the whole
+# session and sends a small message per set instead of a POST per set. Sets
+# are acknowledged as soon as they are buffered and written to Mongo in
+# batches (every LIVE_FLUSH_SETS sets or LIVE_FLUSH_SEC seconds, and when
+# the session ends or drops); the server pushes rest-timer and PR events.
+#
+# Protocol (JSON text frames), served by app/aio.py at /api/sessions/live:
+#   -> {"type": "auth", "token": "<access JWT>", "session": "<id to resume>"?}
+#   <- {"type": "ready", "session": id, "saved_through": seq}
+#   -> {"type": "set", "seq": 1, "exercise": "squat", "reps": 5, "weight_kg": 100, "rest_sec": 120?}
+#   <- {"type": "ack", "seq": 1}, {"type": "rest", "seq": 1, "seconds": 120, "ends_at": ts}
+#   <- {"type": "pr", "seq": 1, "exercise": "squat", "e1rm": 116.7, "previous": 110.0}
+#   <- {"type": "saved", "through": 1}  (durable; the client can forget sets <= through)
+#   <- {"type": "rest_over", "seq": 1}
+#   -> {"type": "end"}  <- {"type": "summary", ...} and the socket closes
+# seq numbers increase per session. After a reconnect the client resumes the
+# session and resends every set above saved_through; duplicates are skipped.
+#
+# A set's _id is derived from (user, session, seq): 8 bytes of hash, then seq.
+# A resent set collides with the stored one instead of being stored twice, a
+# session's sets sort in seq order, and the highest saved seq is one _id
+# range lookup.
+
+FLUSH_SETS = int(os.getenv("LIVE_FLUSH_SETS", "20"))
+FLUSH_SEC = float(os.getenv("LIVE_FLUSH_SEC", "5"))
+DEFAULT_REST_SEC = int(os.getenv("LIVE_REST_SEC", "90"))
+MAX_REST_SEC = 3600
+SESSION_RE = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+SET_FIELDS = ("exercise", "sets", "reps", "weight_kg", "duration_min", "performedAt", "notes")
+
+workouts = lambda: collection("workouts")
+rollups = lambda: collection("workout_rollups")
+
+class SetError(ValueError):
+    pass
+
+# ---- blocking Mongo work, run in a thread once per session / per batch ----
+def best_e1rms(uid):
+    """{exercise: best estimated 1RM so far} from the user's monthly rollups."""
+    best = {}
+    for r in rollups().find({"userId": uid, "period": "month"}, {"exercise": 1, "bestE1rm": 1}):
+        best[r["exercise"]] = max(best.get(r["exercise"], 0.0), r.get("bestE1rm") or 0.0)
+    return best
+
+def session_prefix(uid, session_id):
+    return hashlib.blake2b(f"{uid}:{session_id}".encode(), digest_size=8).digest()
+
+def set_id(prefix, seq):
+    return ObjectId(prefix + seq.to_bytes(4, "big"))
+
+def saved_through(uid, session_id):
+    prefix = session_prefix(uid, session_id)
+    doc = workouts().find_one({"_id": {"$gte": set_id(prefix, 0), "$lte": set_id(prefix, 2**32 - 1)}},
+                              {"seq": 1}, sort=[("_id", -1)])
+    return doc["seq"] if doc else 0
+
+def save_sets(uid, docs):
+    """Insert a batch of sets; ones already stored (resent after a reconnect)
+    fail on their _id and are skipped."""
+    try:
+        workouts().insert_many(docs, ordered=False)
+        inserted = docs
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 for err in errors):
+            raise
+        dupes = {err["index"] for err in errors}
+        inserted = [d for i, d in enumerate(docs) if i not in dupes]
+    if inserted:
+        record_workouts(inserted)
+        etags.bump("workouts", uid, etags.GLOBAL)
+    return len(inserted)
+
+class LiveSession:
+    def __init__(self, uid, session_id, push):
+        self.uid = uid
+        self.id = session_id if session_id and SESSION_RE.match(session_id) else secrets.token_urlsafe(16)
+        self.prefix = session_prefix(uid, self.id)
+        self.push = push  # async callable taking one JSON-able event
+        self.buffer = []
+        self.best = {}
+        self.saved = 0    # highest seq known to be in Mongo
+        self.last_seq = 0
+        self.started = time.time()
+        self.totals = {"sets": 0, "volume": 0.0, "prs": 0}
+        self._flush_lock = asyncio.Lock()
+        self._rest = None
+        self._flusher = None
+
+    async def open(self):
+        self.best, self.saved = await asyncio.gather(
+            asyncio.to_thread(best_e1rms, self.uid),
+            asyncio.to_thread(saved_through, self.uid, self.id),
+        )
+        self.last_seq = self.saved
+        self._flusher = asyncio.create_task(self._flush_periodically())
+        await self.push({"type": "ready", "session": self.id, "saved_through": self.saved})
+
+    async def add_set(self, msg):
+        seq = msg.get("seq")
+        if isinstance(seq, bool) or not isinstance(seq, int) or not 0 < seq < 2**32:
+            raise SetError("seq must be a positive integer")
+        if seq <= self.last_seq:
+            return await self.push({"type": "ack", "seq": seq, "duplicate": True})
+        doc, error = validate_workout({k: msg[k] for k in SET_FIELDS if k in msg})
+        if error:
+            raise SetError(error)
+        rest = msg.get("rest_sec", DEFAULT_REST_SEC)
+        if isinstance(rest, bool) or not isinstance(rest, (int, float)) or not 0 <= rest <= MAX_REST_SEC:
+            raise SetError(f"rest_sec must be 0-{MAX_REST_SEC}")
+
+        doc.setdefault("sets", 1)
+        doc.update({"_id": set_id(self.prefix, seq), "userId": self.uid, "sessionId": self.id, "seq": seq})
+        self.buffer.append(doc)
+        self.last_seq = seq
+        self.totals["sets"] += doc["sets"]
+        self.totals["volume"] += doc["sets"] * doc.get("reps", 0) * doc.get("weight_kg", 0)
+        await self.push({"type": "ack", "seq": seq})
+
+        estimate = round(e1rm(doc.get("weight_kg", 0), doc.get("reps", 0)), 2)
+        exercise = doc["exercise"].lower()
+        previous = self.best.get(exercise, 0.0)
+        if estimate > previous:
+            self.best[exercise] = estimate
+            if previous:  # a first-ever lift is not a record worth announcing
+                self.totals["prs"] += 1
+                await self.push({"type": "pr", "seq": seq, "exercise": doc["exercise"], "e1rm": estimate,
+                                 "previous": previous})
+
+        self._start_rest(seq, rest)
+        if len(self.buffer) >= FLUSH_SETS:
+            await self.flush()
+
+    def _start_rest(self, seq, seconds):
+        if self._rest is not None:
+            self._rest.cancel()
+        self._rest = asyncio.create_task(self._rest_timer(seq, seconds)) if seconds else None
+
+    async def _rest_timer(self, seq, seconds):
+        await self.push({"type": "rest", "seq": seq, "seconds": seconds, "ends_at": time.time() + seconds})
+        await asyncio.sleep(seconds)
+        await self.push({"type": "rest_over", "seq": seq})
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(FLUSH_SEC)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ live session {self.id}: flush failed, will retry: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self.buffer:
+                return
+            docs, self.buffer = self.buffer, []
+            try:
+                await asyncio.to_thread(save_sets, self.uid, docs)
+            except Exception:
+                self.buffer = docs + self.buffer  # try again on the next flush
+                raise
+            self.saved = docs[-1]["seq"]
+        await self.push({"type": "saved", "through": self.saved})
+
+    def summary(self):
+        return {"type": "summary", "session": self.id, "sets": self.totals["sets"],
+                "volume": round(self.totals["volume"], 1), "prs": self.totals["prs"],
+                "duration_sec": round(time.time() - self.started)}
+
+    async def close(self):
+        """Stop timers and write whatever is still buffered."""
+        for task in (self._rest, self._flusher):
+            if task is not None:
+                task.cancel()
+        await self.flush()
@@ -0,0 +1,204 @@
+import os
+import time
+import random
+import cProfile
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pymongo import monitoring
+
+# In-process latency metrics, exposed in the Prometheus text format on
+# GET /metrics (behind OPS_TOKEN, see app/ops.py). Each worker process keeps
+# its own registry, so scrape every worker (or sum them) when running several.
+#
+#   http_request_duration_seconds    per route, method and status
+#   http_request_phase_seconds       per route: time inside mongo / bcrypt / http / smtp
+#   http_requests_in_flight          per route
+#   mongo_command_duration_seconds   per command (pymongo command monitoring)
+#   outbound_duration_seconds        per kind and target (Nutritionix, SMTP, bcrypt pool)
+#   outbound_in_flight               per kind
+#
+# Slow requests can be profiled: PROFILE_SAMPLE_RATE of requests run under
+# cProfile and those slower than PROFILE_SLOW_MS are dumped to PROFILE_DIR.
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "500"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, seconds, *values):
+        with self._lock:
+            row = self._series.get(values)
+            if row is None:
+                row = self._series[values] = [0] * (len(self.buckets) + 2)
+            for i, upper in enumerate(self.buckets):
+                if seconds <= upper:
+                    row[i] += 1
+                    break
+            row[-2] += seconds
+            row[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for values, row in sorted(series.items()):
+            labels = _labels(self.labels, values)
+            running = 0
+            for upper, n in zip(self.buckets, row):
+                running += n
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{upper}"}} {running}')
+            lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {row[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {row[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {row[-1]}")
+        return lines
+
+class Gauge:
+    def __init__(self, name, help, labels):
+        self.name, self.help, self.labels = name, help, labels
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def add(self, delta, *values):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + delta
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            values = dict(self._values)
+        for key, v in sorted(values.items()):
+            lines.append(f"{self.name}{{{_labels(self.labels, key)}}} {v}")
+        return lines
+
+def _labels(names, values):
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{n}="{escape(v)}"' for n, v in zip(names, values))
+
+request_seconds = Histogram("http_request_duration_seconds", "Request latency", ("route", "method", "status"))
+phase_seconds = Histogram("http_request_phase_seconds", "Time a request spent waiting on a dependency", ("route", "phase"))
+requests_in_flight = Gauge("http_requests_in_flight", "Requests being handled", ("route",))
+mongo_seconds = Histogram("mongo_command_duration_seconds", "MongoDB command latency", ("command", "outcome"))
+outbound_seconds = Histogram("outbound_duration_seconds", "Outbound call latency", ("kind", "target", "outcome"))
+outbound_in_flight = Gauge("outbound_in_flight", "Outbound calls in progress", ("kind",))
+
+REGISTRY = [request_seconds, phase_seconds, requests_in_flight, mongo_seconds, outbound_seconds, outbound_in_flight]
+
+# phase -> seconds for the request running in this thread / task
+_phases = ContextVar("request_phases", default=None)
+
+def _add_phase(phase, seconds):
+    phases = _phases.get()
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+@contextmanager
+def timed(kind, target):
+    """Time an outbound call and charge it to the current request's `kind` phase."""
+    outbound_in_flight.add(1, kind)
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        outbound_in_flight.add(-1, kind)
+        outbound_seconds.observe(elapsed, kind, target, outcome)
+        _add_phase(kind, elapsed)
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Feeds mongo_command_duration_seconds; events fire on the calling thread."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, "ok")
+
+    def failed(self, event):
+        self._record(event, "error")
+
+    def _record(self, event, outcome):
+        seconds = event.duration_micros / 1e6
+        mongo_seconds.observe(seconds, event.command_name, outcome)
+        _add_phase("mongo", seconds)
+
+mongo_listener = MongoCommandTimer()
+
+# ---- per request ---------------------------------------------------------
+def start_request(route):
+    """Begin timing a request; returns the token finish_request needs."""
+    requests_in_flight.add(1, route)
+    profiler = None
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler is already active
+            profiler = None
+    return route, time.perf_counter(), _phases.set({}), profiler
+
+def finish_request(token, method, status):
+    route, start, phases_token, profiler = token
+    elapsed = time.perf_counter() - start
+    if profiler is not None:
+        profiler.disable()
+    requests_in_flight.add(-1, route)
+    request_seconds.observe(elapsed, route, method, str(status))
+    for phase, seconds in (_phases.get() or {}).items():
+        phase_seconds.observe(seconds, route, phase)
+    try:
+        _phases.reset(phases_token)
+    except ValueError:  # finished from a different context
+        _phases.set(None)
+    if profiler is not None and elapsed * 1000 >= PROFILE_SLOW_MS:
+        dump_profile(profiler, route, elapsed)
+
+def dump_profile(profiler, route, elapsed):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = route.strip("/").replace("/", "_").replace("<", "").replace(">", "") or "root"
+    path = os.path.join(PROFILE_DIR, f"{int(time.time() * 1000)}-{slug}-{int(elapsed * 1000)}ms.prof")
+    profiler.dump_stats(path)
+    return path
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def init_metrics(app):
+    """Time every request the Flask app handles and serve GET /metrics."""
+    from flask import Response, g, request
+    from .ops import ops_only
+
+    @app.before_request
+    def _start_timer():
+        rule = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        g.metrics_token = start_request(rule)
+
+    @app.after_request
+    def _record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _stop_timer(exception=None):
+        token = g.pop("metrics_token", None)
+        if token is not None:
+            finish_request(token, request.method, g.pop("metrics_status", 500))
+
+    @app.route("/metrics")
+    @ops_only
+    def metrics():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
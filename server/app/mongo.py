@@ -0,0 +1,154 @@
+import os
+import time
+import atexit
+import threading
+from pymongo import MongoClient, monitoring
+from .metrics import mongo_listener
+
+# One MongoClient (and so one connection pool) per process, shared by every
+# request. The client is created on first use rather than at import, and is
+# recreated in a forked child (gunicorn workers, --preload) instead of
+# reusing sockets inherited from the parent.
+
+DB_NAME = "fitnessApp"
+POOL_SIZE = int(os.getenv("MONGO_POOL_SIZE", "100"))
+MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MAX_IDLE_MS = int(os.getenv("MONGO_MAX_IDLE_MS", "300000"))
+TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", "5000"))
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Counters fed by pymongo's connection pool events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.open = 0
+        self.in_use = 0
+        self.created = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.cleared = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _add(self, **deltas):
+        with self._lock:
+            for k, v in deltas.items():
+                setattr(self, k, getattr(self, k) + v)
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+    def pool_cleared(self, event):
+        self._add(cleared=1)
+
+    def connection_created(self, event):
+        self._add(open=1, created=1)
+
+    def connection_closed(self, event):
+        self._add(open=-1)
+
+    def connection_checked_out(self, event):
+        wait = getattr(event, "duration", 0.0) or 0.0
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def connection_checked_in(self, event):
+        self._add(in_use=-1)
+
+    def connection_check_out_failed(self, event):
+        self._add(checkout_failures=1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "max_size": POOL_SIZE,
+                "open": self.open,
+                "in_use": self.in_use,
+                "created": self.created,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "cleared": self.cleared,
+                "avg_wait_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.wait_max * 1000, 3),
+            }
+
+_lock = threading.Lock()
+_client = None
+_pid = None
+_stats = PoolStats()
+
+def mongo_uri():
+    return os.getenv("MONGO_URI")
+
+def get_client():
+    """This process's MongoClient, or None when MONGO_URI is not set."""
+    global _client, _pid
+    if _client is not None and _pid == os.getpid():
+        return _client
+    uri = mongo_uri()
+    if not uri:
+        return None
+    with _lock:
+        if _client is None or _pid != os.getpid():
+            _stats.reset()
+            # connect=False: no sockets until the first operation
+            _client = MongoClient(
+                uri,
+                connect=False,
+                maxPoolSize=POOL_SIZE,
+                minPoolSize=MIN_POOL_SIZE,
+                maxIdleTimeMS=MAX_IDLE_MS,
+                serverSelectionTimeoutMS=TIMEOUT_MS,
+                event_listeners=[_stats, mongo_listener],
+            )
+            _pid = os.getpid()
+    return _client
+
+def get_db():
+    client = get_client()
+    return client[DB_NAME] if client is not None else None
+
+def collection(name):
+    db = get_db()
+    return db[name] if db is not None else None
+
+def health():
+    """Round-trip a ping; never raises."""
+    if not mongo_uri():
+        return {"ok": False, "error": "MONGO_URI not set"}
+    start = time.perf_counter()
+    try:
+        get_db().command("ping")
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+    return {"ok": True, "latency_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+def pool_stats():
+    return _stats.snapshot()
+
+def _forget_after_fork():
+    # The parent's sockets are not ours to use or close; start over lazily
+    global _client, _pid, _lock
+    _client, _pid = None, None
+    _lock = threading.Lock()
+    _stats._lock = threading.Lock()
+    _stats.reset()
+
+def close():
+    global _client, _pid
+    with _lock:
+        if _client is not None and _pid == os.getpid():
+            _client.close()
+        _client, _pid = None, None
+
+os.register_at_fork(after_in_child=_forget_after_fork)
+atexit.register(close)
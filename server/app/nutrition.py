@@ -1,12 +1,20 @@
-import os, requests
+import os
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app import db
-from utils.calc import tdee, goal_calories, macro_targets
+from utils.calc import targets_batch
+from .mongo import collection
+from . import etags
+from .ratelimit import rate_limit
+from .targets_cache import compute_targets, profile_for, remember_profile
+from .food_search import search_foods, search_local, ProviderBusy, ProviderError, ProviderUnreachable
 
 nutrition_bp = Blueprint("nutrition", __name__)
 
-profiles = lambda: db["profiles"] if db else None
+profiles = lambda: collection("profiles")
+
+BATCH_FIELDS = ["sex", "age", "height_cm", "weight_kg", "activity_level", "body_fat_percent", "goal", "pace_lbs_per_week"]
+BATCH_REQUIRED = ["sex", "age", "height_cm", "weight_kg"]
+MAX_BATCH = 50000
 
 @nutrition_bp.route("/nutrition/targets", methods=["POST"])
 @jwt_required()
@@ -15,7 +23,7 @@ def targets():
     data = request.get_json() or {}
 
     # allow using stored profile as defaults
-    prof = profiles().find_one({"userId": uid}, {"_id": 0}) or {}
+    prof = profile_for(uid)
 
     sex = data.get("sex", prof.get("sex"))
     age = float(data.get("age", prof.get("age") or 0))
@@ -30,12 +38,16 @@ def targets():
         if not v:
             return jsonify({"error": f"Missing field: {k}"}), 400
 
-    tdee_kcal = tdee(sex, age, height_cm, weight_kg, activity_level, body_fat_percent)
-    cals = goal_calories(tdee_kcal, goal, pace_lbs_per_week)
-    macros = macro_targets(cals, weight_kg, goal)
+    tdee_kcal, macros = compute_targets(sex, age, height_cm, weight_kg, activity_level, body_fat_percent, goal, pace_lbs_per_week)
 
-    # optional: remember last computed targets
-    profiles().update_one({"userId": uid}, {"$set": {"goals.lastTargets": macros, "goals.lastGoal": goal}}, upsert=True)
+    # optional: remember last computed targets (skip the write when unchanged)
+    goals = prof.get("goals") or {}
+    if goals.get("lastTargets") != macros or goals.get("lastGoal") != goal:
+        profiles().update_one({"userId": uid}, {"$set": {"goals.lastTargets": macros, "goals.lastGoal": goal}}, upsert=True)
+        prof["goals"] = {**goals, "lastTargets": macros, "lastGoal": goal}
+        prof.setdefault("userId", uid)
+        remember_profile(uid, prof)
+        etags.bump("me", uid)
 
     return jsonify({
         "tdee_kcal": round(tdee_kcal),
@@ -47,40 +59,69 @@ def targets():
         }
     })
 
+@nutrition_bp.route("/nutrition/targets/batch", methods=["POST"])
+@jwt_required()
+def targets_batch_route():
+    """
+    Targets for many profiles at once. Send either {"profiles": [{...}, ...]}
+    or columnar {"columns": {"sex": [...], "age": [...], ...}}; the result is
+    columnar, index-aligned with the input.
+    """
+    data = request.get_json() or {}
+    if isinstance(data.get("profiles"), list):
+        rows = data["profiles"]
+        columns = {k: [r.get(k) if isinstance(r, dict) else None for r in rows] for k in BATCH_FIELDS}
+    elif isinstance(data.get("columns"), dict):
+        columns = {k: data["columns"].get(k) for k in BATCH_FIELDS}
+    else:
+        return jsonify({"error": "Provide 'profiles' (list) or 'columns' (object of lists)"}), 400
+
+    n = len(columns["weight_kg"] or [])
+    if n > MAX_BATCH:
+        return jsonify({"error": f"At most {MAX_BATCH} profiles per call"}), 413
+    for k, col in columns.items():
+        if col is None and k not in BATCH_REQUIRED:
+            continue
+        if not isinstance(col, list) or len(col) != n:
+            return jsonify({"error": f"Column {k} must be a list of length {n}"}), 400
+    for k in BATCH_REQUIRED:
+        missing = [i for i, v in enumerate(columns[k]) if not v]
+        if missing:
+            return jsonify({"error": f"Missing field: {k}", "indexes": missing[:100]}), 400
+
+    try:
+        results = targets_batch(columns)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Non-numeric value in a numeric column"}), 400
+    return jsonify({"count": n, "results": results})
+
 @nutrition_bp.route("/foods/search", methods=["GET"])
 @jwt_required()
+@rate_limit("foods_search")
 def foods_search():
     q = request.args.get("q", "").strip()
     if not q:
         return jsonify({"error": "Missing q"}), 400
 
-    # Example with Nutritionix instant endpoint
+    # Offline index first; the provider only sees local misses
+    local = search_local(q)
+    if local:
+        return jsonify({"query": q, "items": local, "source": "local"})
+
     app_id = os.getenv("NUTRITIONIX_APP_ID")
     api_key = os.getenv("NUTRITIONIX_API_KEY")
     if not (app_id and api_key):
         return jsonify({"error": "Nutrition API keys not configured"}), 500
 
-    url = "https://trackapi.nutritionix.com/v2/search/instant"
-    headers = {"x-app-id": app_id, "x-app-key": api_key}
-    resp = requests.get(url, headers=headers, params={"query": q, "detailed": True}, timeout=10)
-
-    if resp.status_code != 200:
-        return jsonify({"error": "nutrition provider error", "status": resp.status_code}), 502
-
-    data = resp.json()
-    # return a minimal shape (foods + macros per serving)
-    items = []
-    for item in data.get("common", []) + data.get("branded", []):
-        nf = {
-            "name": item.get("food_name") or item.get("brand_name_item_name"),
-            "brand": item.get("brand_name"),
-            "serving_qty": item.get("serving_qty"),
-            "serving_unit": item.get("serving_unit"),
-            "calories": item.get("nf_calories"),
-            "protein_g": item.get("nf_protein"),
-            "carbs_g": item.get("nf_total_carbohydrate"),
-            "fat_g": item.get("nf_total_fat")
-        }
-        items.append({k:v for k,v in nf.items() if v is not None})
+    try:
+        items, source = search_foods(q)
+    except ProviderError as e:
+        return jsonify({"error": "nutrition provider error", "status": e.status}), 502
+    except ProviderUnreachable:
+        return jsonify({"error": "nutrition provider unreachable"}), 502
+    except ProviderBusy:
+        resp = jsonify({"error": "nutrition provider busy, please retry shortly"})
+        resp.headers["Retry-After"] = "1"
+        return resp, 503
 
-    return jsonify({"query": q, "items": items[:25]})
+    return jsonify({"query": q, "items": items[:25], "source": source})
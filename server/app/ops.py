@@ -0,0 +1,25 @@
+import os
+import hmac
+from functools import wraps
+from flask import jsonify, request
+
+# Operator endpoints (GET /metrics, /api/diagnostics/indexes,
+# /api/email-queue) expose internals, and some cost database work, so they
+# only answer requests that carry the OPS_TOKEN secret:
+#
+#     Authorization: Bearer <OPS_TOKEN>
+#
+# (for Prometheus, `authorization: {credentials: <OPS_TOKEN>}` in the scrape
+# config). While OPS_TOKEN is unset they are switched off.
+
+def ops_only(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = os.getenv("OPS_TOKEN")
+        if not token:
+            return jsonify({"error": "Operator endpoints are disabled (OPS_TOKEN not set)"}), 404
+        sent = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(sent.encode(), f"Bearer {token}".encode()):
+            return jsonify({"error": "Operator token required"}), 401
+        return view(*args, **kwargs)
+    return wrapper
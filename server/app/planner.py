@@ -1,11 +1,56 @@
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app import db
-from utils.calc import tdee, goal_calories, macro_targets
+from .mongo import collection
+from .targets_cache import compute_targets, profile_for
+from utils.calc import solve_servings
 
 planner_bp = Blueprint("planner", __name__)
 
-profiles = lambda: db["profiles"]
+profiles = lambda: collection("profiles")
+food_log = lambda: collection("food_log")            # one document per logged item
+food_log_days = lambda: collection("food_log_days")  # running totals per user per day
+
+MACROS = ["calories", "protein_g", "carbs_g", "fat_g"]
+DAY_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+MAX_DAYS = 31
+MAX_FOODS = 50
+
+def resolve_targets(uid, data):
+    """Targets passed in the body, or derived from the stored profile + goal inputs.
+    Returns (targets, None) or (None, error response)."""
+    targets = data.get("targets")
+    if targets:
+        return targets, None
+    # derive from profile (maintain by default)
+    prof = profile_for(uid)
+    required = ["sex","age","height_cm","weight_kg","activity_level"]
+    if not all(k in prof and prof[k] for k in required):
+        return None, (jsonify({"error":"Missing profile fields to compute targets. Provide 'targets' or complete profile."}), 400)
+    _, targets = compute_targets(prof["sex"], prof["age"], prof["height_cm"], prof["weight_kg"], prof.get("activity_level", "moderate"), prof.get("body_fat_percent"), data.get("goal","maintain"), data.get("pace_lbs_per_week"))
+    return targets, None
+
+def summarize(targets, total):
+    remaining = {k: round(max(0.0, targets[k] - total[k])) for k in total.keys() if k in targets}
+    over = {k: round(max(0.0, total[k] - targets[k])) for k in total.keys() if k in targets}
+    return {
+        "targets": {k:int(v) for k,v in targets.items()},
+        "consumed": {k:int(round(v)) for k,v in total.items()},
+        "remaining": remaining,
+        "over_by": over
+    }
+
+def log_day(value):
+    if value:
+        if not DAY_RE.match(str(value)):
+            raise ValueError("day must be YYYY-MM-DD")
+        return str(value)
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
 
 @planner_bp.route("/planner/day-summary", methods=["POST"])
 @jwt_required()
@@ -15,16 +60,9 @@ def day_summary():
     items = data.get("items") or []  # [{name, servings, calories, protein_g, carbs_g, fat_g}, ...]
 
     # targets can be passed or derived from stored profile + goal inputs
-    targets = data.get("targets")
-    if not targets:
-        # derive from profile (maintain by default)
-        prof = profiles().find_one({"userId": uid}, {"_id":0}) or {}
-        required = ["sex","age","height_cm","weight_kg","activity_level"]
-        if not all(k in prof and prof[k] for k in required):
-            return jsonify({"error":"Missing profile fields to compute targets. Provide 'targets' or complete profile."}), 400
-        td = tdee(prof["sex"], float(prof["age"]), float(prof["height_cm"]), float(prof["weight_kg"]), prof.get("activity_level", "moderate"), prof.get("body_fat_percent"))
-        cals = goal_calories(td, data.get("goal","maintain"), float(data.get("pace_lbs_per_week") or 0))
-        targets = macro_targets(cals, float(prof["weight_kg"]), data.get("goal","maintain"))
+    targets, error = resolve_targets(uid, data)
+    if error:
+        return error
 
     total = {"calories":0, "protein_g":0, "carbs_g":0, "fat_g":0}
     clean_items = []
@@ -42,16 +80,91 @@ def day_summary():
         for k in total:
             total[k] += entry[k]
 
-    remaining = {k: round(max(0.0, targets[k] - total[k])) for k in total.keys() if k in targets}
-    over = {k: round(max(0.0, total[k] - targets[k])) for k in total.keys() if k in targets}
+    return jsonify({**summarize(targets, total), "items": clean_items})
 
-    return jsonify({
-        "targets": {k:int(v) for k,v in targets.items()},
-        "consumed": {k:int(round(v)) for k,v in total.items()},
-        "remaining": remaining,
-        "over_by": over,
-        "items": clean_items
-    })
+@planner_bp.route("/planner/log", methods=["POST"])
+@jwt_required()
+def log_add():
+    """
+    Append one item to the user's food log for `day` (default: today, UTC)
+    and bump that day's running totals with $inc.
+    """
+    uid = get_jwt_identity()
+    it = request.get_json() or {}
+    try:
+        day = log_day(it.get("day"))
+        s = float(it.get("servings", 1))
+        entry = {
+            "userId": uid,
+            "day": day,
+            "name": it.get("name","item"),
+            "servings": s,
+            **{k: float(it.get(k,0))*s for k in MACROS},
+            "loggedAt": int(time.time())
+        }
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    res = food_log().insert_one(entry)
+    totals = food_log_days().find_one_and_update(
+        {"_id": f"{uid}:{day}"},
+        {"$inc": {**{k: entry[k] for k in MACROS}, "items": 1}, "$setOnInsert": {"userId": uid, "day": day}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return jsonify({"id": str(res.inserted_id), "day": day, "consumed": {k: round(totals[k]) for k in MACROS}}), 201
+
+@planner_bp.route("/planner/log/<entry_id>", methods=["DELETE"])
+@jwt_required()
+def log_remove(entry_id):
+    uid = get_jwt_identity()
+    try:
+        entry = food_log().find_one_and_delete({"_id": ObjectId(entry_id), "userId": uid})
+    except InvalidId:
+        entry = None
+    if not entry:
+        return jsonify({"error": "No such log entry"}), 404
+
+    totals = food_log_days().find_one_and_update(
+        {"_id": f"{uid}:{entry['day']}"},
+        {"$inc": {**{k: -entry[k] for k in MACROS}, "items": -1}},
+        return_document=ReturnDocument.AFTER
+    )
+    consumed = {k: round(max(0.0, totals[k])) for k in MACROS} if totals else {k: 0 for k in MACROS}
+    return jsonify({"day": entry["day"], "consumed": consumed})
+
+@planner_bp.route("/planner/log", methods=["GET"])
+@jwt_required()
+def log_list():
+    uid = get_jwt_identity()
+    try:
+        day = log_day(request.args.get("day"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    entries = []
+    for e in food_log().find({"userId": uid, "day": day}).sort("_id", 1):
+        entries.append({"id": str(e.pop("_id")), **{k: v for k, v in e.items() if k != "userId"}})
+    return jsonify({"day": day, "items": entries})
+
+@planner_bp.route("/planner/log/summary", methods=["GET"])
+@jwt_required()
+def log_summary():
+    """Day summary from the stored running totals: one small read, no item list."""
+    uid = get_jwt_identity()
+    args = request.args
+    try:
+        day = log_day(args.get("day"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    targets, error = resolve_targets(uid, {"goal": args.get("goal", "maintain"), "pace_lbs_per_week": args.get("pace_lbs_per_week")})
+    if error:
+        return error
+
+    doc = food_log_days().find_one({"_id": f"{uid}:{day}"}) or {}
+    # clamp float drift from repeated +/- increments
+    total = {k: max(0.0, float(doc.get(k, 0))) for k in MACROS}
+    return jsonify({**summarize(targets, total), "day": day, "item_count": int(doc.get("items", 0))})
 
 @planner_bp.route("/planner/split", methods=["POST"])
 @jwt_required()
@@ -64,3 +177,91 @@ def split():
 
     per = {k: round(float(targets[k])/meals) for k in ["calories","protein_g","carbs_g","fat_g"] if k in targets}
     return jsonify({"per_meal": per, "meals": meals})
+
+def day_range(start, end):
+    """Every YYYY-MM-DD from `start` to `end` inclusive."""
+    first, last = (datetime.strptime(log_day(d), "%Y-%m-%d") for d in (start, end))
+    n = (last - first).days + 1
+    if n < 1 or n > MAX_DAYS:
+        raise ValueError(f"range must cover 1-{MAX_DAYS} days")
+    return [(first + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(n)]
+
+def macro_rows(items):
+    """(len(items), 4) array of servings * per-serving macros."""
+    import numpy as np
+    rows = np.array([[float(it.get(k, 0)) for k in MACROS] for it in items], dtype=np.float64).reshape(-1, len(MACROS))
+    servings = np.array([float(it.get("servings", 1)) for it in items], dtype=np.float64)
+    return rows * servings[:, None]
+
+@planner_bp.route("/planner/week", methods=["POST"])
+@jwt_required()
+def week():
+    """
+    Per-day and whole-range summaries in one call, for either
+      - planned items: {"days": {"2024-05-06": [{name, servings, calories, ...}], ...}}
+      - the user's log: {"from": "2024-05-06", "to": "2024-05-12"} (one read)
+    Optional {"foods": [{name, calories, protein_g, carbs_g, fat_g, max_servings?}],
+    "round_to": 0.25} also returns, per day, the servings of those foods that
+    best cover what's left of the targets.
+    """
+    import numpy as np
+    uid = get_jwt_identity()
+    data = request.get_json() or {}
+    targets, error = resolve_targets(uid, data)
+    if error:
+        return error
+
+    try:
+        if data.get("days"):
+            planned = data["days"]
+            if not isinstance(planned, dict) or len(planned) > MAX_DAYS:
+                raise ValueError(f"days must map up to {MAX_DAYS} YYYY-MM-DD keys to item lists")
+            days = sorted(log_day(d) for d in planned)
+            consumed = np.array([macro_rows(planned[d] or []).sum(axis=0) for d in days]).reshape(-1, len(MACROS))
+            counts = [len(planned[d] or []) for d in days]
+        elif data.get("from"):
+            days = day_range(data["from"], data.get("to") or data["from"])
+            docs = {d["day"]: d for d in food_log_days().find({"_id": {"$in": [f"{uid}:{d}" for d in days]}})}
+            # clamp float drift from repeated +/- increments
+            consumed = np.array([[max(0.0, float(docs.get(d, {}).get(k, 0))) for k in MACROS] for d in days])
+            counts = [int(docs.get(d, {}).get("items", 0)) for d in days]
+        else:
+            return jsonify({"error": "Provide 'days' (planned items) or 'from'/'to' (logged days)"}), 400
+
+        foods = data.get("foods") or []
+        if len(foods) > MAX_FOODS:
+            raise ValueError(f"at most {MAX_FOODS} foods")
+        if foods:
+            per_serving = np.array([[float(f.get(k, 0)) for k in MACROS] for f in foods])
+            caps = np.array([float(f.get("max_servings") or np.inf) for f in foods])
+            step = float(data.get("round_to") or 0)
+    except (TypeError, ValueError, AttributeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    goal = np.array([float(targets.get(k, 0)) for k in MACROS])
+    out = []
+    for day, total, n in zip(days, consumed, counts):
+        out.append({**summarize(targets, dict(zip(MACROS, total))), "day": day, "item_count": n})
+
+    if foods:
+        remaining = np.maximum(goal - consumed, 0.0)
+        servings = solve_servings(per_serving, remaining, caps)
+        if step > 0:
+            servings = np.minimum(np.round(servings / step) * step, caps)
+        achieved = servings @ per_serving
+        for entry, row, got in zip(out, servings, achieved):
+            entry["fill"] = {
+                "servings": [{"name": f.get("name", "food"), "servings": round(float(s), 2)} for f, s in zip(foods, row) if s > 0],
+                "adds": {k: int(round(v)) for k, v in zip(MACROS, got)},
+            }
+
+    n = len(days)
+    return jsonify({
+        "days": out,
+        "week": {
+            "days": n,
+            "targets": {k: int(round(v * n)) for k, v in zip(MACROS, goal)},
+            "consumed": {k: int(round(v)) for k, v in zip(MACROS, consumed.sum(axis=0))},
+            "daily_average": {k: int(round(v)) for k, v in zip(MACROS, consumed.mean(axis=0) if n else np.zeros(len(MACROS)))},
+        },
+    })
@@ -0,0 +1,155 @@
+import os
+import time
+import math
+import threading
+from functools import wraps
+from datetime import datetime, timedelta, timezone
+from flask import request, jsonify
+from flask_jwt_extended import get_jwt_identity
+from pymongo import ReturnDocument
+from .mongo import collection
+
+# Token-bucket rate limits for the endpoints that cost real resources
+# (bcrypt, SMTP, Nutritionix quota). Each policy is a list of buckets keyed
+# by client IP, JWT user or the account (email) a request names; a request
+# must take a token from every one of them.
+#
+# Buckets live in this process by default. RATELIMIT_STORAGE=mongo keeps
+# them in the rate_limits collection instead, so all workers share one
+# budget at the cost of a round trip per check. If that store is
+# unreachable, requests are let through rather than failing.
+#
+# Override a policy with e.g. RATELIMIT_LOGIN="ip:20/60,account:5/60"
+# (tokens per seconds), or turn limiting off with RATELIMIT_ENABLED=0.
+
+ENABLED = os.getenv("RATELIMIT_ENABLED", "1") != "0"
+STORAGE = os.getenv("RATELIMIT_STORAGE", "memory")
+PROXY_HOPS = int(os.getenv("RATELIMIT_PROXY_HOPS", "0"))  # trusted X-Forwarded-For hops
+
+DEFAULT_POLICIES = {
+    "login": "ip:20/60,account:5/60",
+    "register": "ip:5/3600",
+    "send_verification": "user:3/600,ip:10/600",
+    "foods_search": "user:60/60,ip:120/60",
+}
+
+def parse_policy(spec):
+    """"ip:20/60,account:5/60" -> [("ip", 20.0, 60.0), ("account", 5.0, 60.0)]"""
+    buckets = []
+    for part in spec.split(","):
+        scope, rate = part.strip().split(":")
+        capacity, per = rate.split("/")
+        buckets.append((scope, float(capacity), float(per)))
+    return buckets
+
+POLICIES = {name: parse_policy(os.getenv(f"RATELIMIT_{name.upper()}", spec)) for name, spec in DEFAULT_POLICIES.items()}
+
+class MemoryBuckets:
+    """Buckets in a plain dict, updated in place: one lookup per check."""
+
+    def __init__(self, maxsize=200_000):
+        self._lock = threading.Lock()
+        self._maxsize = maxsize
+        self._buckets = {}  # key -> [tokens, stamp, per]
+
+    def take(self, key, capacity, per):
+        """Seconds until a token is available (0.0 means one was taken)."""
+        rate = capacity / per
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self._maxsize:
+                    self._evict(now)
+                bucket = self._buckets[key] = [capacity, now, per]
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0.0
+            bucket[0] = tokens
+            return (1 - tokens) / rate
+
+    def _evict(self, now):
+        # a bucket idle for its whole period is full again; forgetting it changes nothing
+        for key in [k for k, b in self._buckets.items() if now - b[1] >= b[2]]:
+            del self._buckets[key]
+        # still full of active keys: drop the oldest quarter (insertion order)
+        if len(self._buckets) >= self._maxsize:
+            for key in list(self._buckets)[: self._maxsize // 4]:
+                del self._buckets[key]
+
+class MongoBuckets:
+    """The same bucket arithmetic as one atomic pipeline update per check."""
+
+    def take(self, key, capacity, per):
+        coll = collection("rate_limits")
+        if coll is None:
+            return 0.0
+        rate = capacity / per
+        now = time.time()
+        refilled = {"$min": [capacity, {"$add": [
+            {"$ifNull": ["$tokens", capacity]},
+            {"$multiply": [{"$subtract": [now, {"$ifNull": ["$stamp", now]}]}, rate]},
+        ]}]}
+        try:
+            doc = coll.find_one_and_update(
+                {"_id": key},
+                [
+                    {"$set": {"tokens": refilled, "stamp": now,
+                              "expireAt": datetime.now(timezone.utc) + timedelta(seconds=per)}},
+                    {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                    {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}},
+                ],
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except Exception as e:
+            print(f"⚠️ rate limit store unavailable, allowing request: {e}")
+            return 0.0
+        return 0.0 if doc["allowed"] else (1 - doc["tokens"]) / rate
+
+store = MongoBuckets() if STORAGE == "mongo" else MemoryBuckets()
+
+def client_ip(remote_addr=None, forwarded_for=None):
+    if PROXY_HOPS and forwarded_for:
+        hops = [h.strip() for h in forwarded_for.split(",")]
+        return hops[-min(PROXY_HOPS, len(hops))]
+    return remote_addr or "unknown"
+
+def check(name, **keys):
+    """Take one token from each of policy `name`'s buckets whose key is given.
+    Returns 0.0 if allowed, else the seconds to wait."""
+    if not ENABLED:
+        return 0.0
+    wait = 0.0
+    for scope, capacity, per in POLICIES[name]:
+        key = keys.get(scope)
+        if key:
+            wait = max(wait, store.take(f"{name}:{scope}:{key}", capacity, per))
+    return wait
+
+def too_many(wait):
+    resp = jsonify({"error": "Too many requests, please slow down."})
+    resp.headers["Retry-After"] = str(max(1, math.ceil(wait)))
+    return resp, 429
+
+def rate_limit(name):
+    """Apply policy `name` to a Flask view (put it below @jwt_required for user keys)."""
+    scopes = {scope for scope, _, _ in POLICIES[name]}
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            keys = {"ip": client_ip(request.remote_addr, request.headers.get("X-Forwarded-For"))}
+            if "user" in scopes:
+                keys["user"] = get_jwt_identity()
+            if "account" in scopes:
+                body = request.get_json(silent=True) or {}
+                keys["account"] = str(body.get("email") or "").strip().lower()
+            wait = check(name, **keys)
+            if wait:
+                return too_many(wait)
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
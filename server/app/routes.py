@@ -1,32 +1,328 @@
 import os
-from flask import current_app, Blueprint, jsonify, request, send_from_directory
-from app import db, workouts
+import json
+import time
+from datetime import datetime, timezone
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from flask import current_app, Blueprint, Response, jsonify, request, stream_with_context
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from pymongo.errors import BulkWriteError
+from .mongo import collection, get_db, health, pool_stats
+from .indexes import explain_hot_queries
+from .startup import readiness
+from .emailer import mail_queue
+from .analytics import record_workouts
+from . import etags
+from .assets import send_asset
+from .ops import ops_only
 
 api = Blueprint("api", __name__)  # Changed from "routes" to "api"
 
+workouts = lambda: collection("workouts")
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Bulk ingestion limits
+BULK_MAX_BYTES = int(os.getenv("WORKOUT_BULK_MAX_BYTES", str(8 * 1024 * 1024)))
+BULK_MAX_RECORDS = int(os.getenv("WORKOUT_BULK_MAX_RECORDS", "20000"))
+BULK_CHUNK_SIZE = 500
+
+# field -> (accepted types, required)
+WORKOUT_SCHEMA = {
+    "exercise": ((str,), True),
+    "sets": ((int,), False),
+    "reps": ((int,), False),
+    "weight_kg": ((int, float), False),
+    "duration_min": ((int, float), False),
+    "performedAt": ((int, float, str), False),
+    "notes": ((str,), False),
+}
+
 @api.route("/")
 def serve_react_app():
-    index_path = os.path.join(current_app.static_folder, "index.html")
-    if os.path.exists(index_path):
-        return send_from_directory(current_app.static_folder, "index.html")
-    else:
-        return "⚠️ React build not found. Run 'npm run build' inside the client folder.", 404
-    
+    return send_asset(current_app.extensions["assets"], "index.html")
+
 @api.route("/api")
 def api_home():
     return jsonify({"message": "Flask backend is running!"})
 
+# Optional auth: workouts posted with a token are owned by that user, and
+# workouts posted without one by nobody
+def current_uid():
+    verify_jwt_in_request(optional=True)
+    return get_jwt_identity()
+
+# Accepts unix seconds or an ISO date/datetime, returns unix seconds
+def parse_time(value):
+    value = str(value).strip()
+    try:
+        ts = int(float(value))
+    except OverflowError:
+        raise ValueError(f"time out of range: {value}")
+    except ValueError:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return int(dt.timestamp())
+    # only times a datetime can hold (rollup buckets, exports)
+    try:
+        datetime.fromtimestamp(ts, timezone.utc)
+    except (OverflowError, OSError, ValueError):
+        raise ValueError(f"time out of range: {value}")
+    return ts
+
+# Keyset cursor: "<performedAt>_<ObjectId>" of the last document on a page
+def encode_cursor(doc):
+    return f"{doc.get('performedAt', 0)}_{doc['_id']}"
+
+def decode_cursor(cursor):
+    ts, oid = cursor.split("_", 1)
+    return int(ts), ObjectId(oid)
+
+def public_workout(doc):
+    out = {k: v for k, v in doc.items() if k != "_id"}
+    out["id"] = str(doc["_id"])
+    return out
+
+def workout_query(args, uid):
+    # the owner filter only ever comes from the token; routes refuse ?user=
+    # from anonymous callers and ignore it from signed-in ones
+    query = {}
+    if uid:
+        query["userId"] = uid
+
+    window = {}
+    if args.get("from"):
+        window["$gte"] = parse_time(args["from"])
+    if args.get("to"):
+        window["$lt"] = parse_time(args["to"])
+    if window:
+        query["performedAt"] = window
+
+    # newest first, so the next page is everything strictly "before" the cursor
+    if args.get("cursor"):
+        ts, oid = decode_cursor(args["cursor"])
+        query = {"$and": [query, {"$or": [
+            {"performedAt": {"$lt": ts}},
+            {"performedAt": ts, "_id": {"$lt": oid}},
+        ]}]}
+    return query
+
+def validate_workout(rec, strict=True):
+    """Return (clean document, None) or (None, error message). Fields outside
+    WORKOUT_SCHEMA are an error, or dropped when not `strict`."""
+    if not isinstance(rec, dict):
+        return None, "Expected a JSON object"
+    unknown = set(rec) - set(WORKOUT_SCHEMA)
+    if unknown and strict:
+        return None, f"Unknown field(s): {', '.join(sorted(unknown))}"
+
+    clean = {}
+    for field, (types, required) in WORKOUT_SCHEMA.items():
+        value = rec.get(field)
+        if value is None:
+            if required:
+                return None, f"Missing field: {field}"
+            continue
+        # bool is an int subclass, never a valid count or weight
+        if isinstance(value, bool) or not isinstance(value, types):
+            return None, f"Invalid type for {field}"
+        if isinstance(value, (int, float)) and value < 0:
+            return None, f"{field} must be >= 0"
+        clean[field] = value
+
+    if not clean["exercise"].strip():
+        return None, "Missing field: exercise"
+    clean["exercise"] = clean["exercise"].strip()
+    try:
+        clean["performedAt"] = parse_time(clean["performedAt"]) if "performedAt" in clean else int(time.time())
+    except ValueError:
+        return None, "Invalid performedAt"
+    return clean, None
+
+# Yields parsed records (or a ValueError for a malformed line) from the body
+def read_bulk_records():
+    if request.mimetype == "application/x-ndjson":
+        size = 0
+        for line in request.stream:
+            size += len(line)
+            if size > BULK_MAX_BYTES:
+                raise OverflowError
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield e
+        return
+
+    raw = request.stream.read(BULK_MAX_BYTES + 1)
+    if len(raw) > BULK_MAX_BYTES:
+        raise OverflowError
+    body = json.loads(raw or b"null")
+    if isinstance(body, dict):
+        body = body.get("workouts")
+    if not isinstance(body, list):
+        raise ValueError("Expected a JSON array of workouts")
+    yield from body
+
+@api.route("/api/health")
+def health_check():
+    """Mongo reachability plus this worker's connection pool counters."""
+    mongo = health()
+    return jsonify({"ok": mongo["ok"], "mongo": mongo, "pool": pool_stats()}), 200 if mongo["ok"] else 503
+
+@api.route("/api/health/live")
+def liveness_check():
+    """The worker is up and serving; says nothing about Mongo."""
+    return jsonify({"ok": True, "pid": os.getpid()})
+
+@api.route("/api/health/ready")
+def readiness_check():
+    """503 until this worker's startup checks (Mongo reachable, indexes ensured) pass."""
+    state = readiness.snapshot()
+    return jsonify(state), 200 if state["ok"] else 503
+
+@api.route("/api/diagnostics/indexes")
+@ops_only
+def index_diagnostics():
+    """Startup index report plus query plans; `collscans` lists hot queries without an index."""
+    db = get_db()
+    if db is None:
+        return jsonify({"error": "MongoDB not connected"}), 500
+    queries = explain_hot_queries(db)
+    return jsonify({
+        "indexes": current_app.extensions.get("indexes"),
+        "queries": queries,
+        "collscans": [q["query"] for q in queries if q.get("collscan")],
+    })
+
+@api.route("/api/email-queue")
+@ops_only
+def email_queue_stats():
+    return jsonify(mail_queue.stats())
+
 @api.route("/api/workouts", methods=["POST"])
 def add_workout():
-    if not workouts:
+    if workouts() is None:
         return jsonify({"error": "MongoDB not connected"}), 500
-    data = request.get_json()
-    workouts.insert_one(data)
+    # existing clients send extra keys, so fields outside the schema
+    # (userId included: the owner only ever comes from the token) are dropped
+    doc, err = validate_workout(request.get_json(silent=True), strict=False)
+    if err:
+        return jsonify({"error": err}), 400
+
+    uid = current_uid()
+    if uid:
+        doc["userId"] = uid
+    workouts().insert_one(doc)
+    record_workouts([doc])
+    etags.bump("workouts", doc.get("userId"), etags.GLOBAL)
     return jsonify({"message": "Workout added!"}), 201
 
+@api.route("/api/workouts/bulk", methods=["POST"])
+def add_workouts_bulk():
+    """
+    Insert many workouts from a JSON array (or {"workouts": [...]}) or an
+    NDJSON stream. Valid records are written unordered in fixed-size chunks;
+    invalid ones are reported by their index in the input.
+    """
+    if workouts() is None:
+        return jsonify({"error": "MongoDB not connected"}), 500
+    if (request.content_length or 0) > BULK_MAX_BYTES:
+        return jsonify({"error": f"Payload exceeds {BULK_MAX_BYTES} bytes"}), 413
+
+    uid = current_uid()
+    inserted = 0
+    errors = []
+    chunk, chunk_index = [], []
+
+    def flush():
+        nonlocal inserted
+        failed = set()
+        try:
+            inserted += len(workouts().insert_many(chunk, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            inserted += e.details.get("nInserted", 0)
+            for err in e.details.get("writeErrors", []):
+                failed.add(err["index"])
+                errors.append({"index": chunk_index[err["index"]], "error": err.get("errmsg", "write error")})
+        record_workouts(doc for j, doc in enumerate(chunk) if j not in failed)
+        if len(failed) < len(chunk):
+            etags.bump("workouts", uid, etags.GLOBAL)
+        chunk.clear()
+        chunk_index.clear()
+
+    try:
+        for i, rec in enumerate(read_bulk_records()):
+            if i >= BULK_MAX_RECORDS:
+                return jsonify({"error": f"More than {BULK_MAX_RECORDS} records", "inserted": inserted}), 413
+            doc, err = (None, "Invalid JSON") if isinstance(rec, ValueError) else validate_workout(rec)
+            if err:
+                errors.append({"index": i, "error": err})
+                continue
+            if uid:
+                doc["userId"] = uid
+            chunk.append(doc)
+            chunk_index.append(i)
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                flush()
+    except OverflowError:
+        return jsonify({"error": f"Payload exceeds {BULK_MAX_BYTES} bytes", "inserted": inserted}), 413
+    except ValueError as e:
+        return jsonify({"error": str(e) or "Invalid JSON", "inserted": inserted}), 400
+
+    if chunk:
+        flush()
+    return jsonify({"inserted": inserted, "failed": len(errors), "errors": errors}), 200
+
 @api.route("/api/workouts", methods=["GET"])
 def get_workouts():
-    if not workouts:
+    """
+    List workouts newest first.
+
+    Query params: cursor (from a previous page's "next"), limit, from/to
+    (unix seconds or ISO dates on performedAt) and format=ndjson to stream
+    one document per line. With a token only the caller's workouts are
+    listed; filtering by ?user= without one answers 401.
+
+    Responses carry an ETag from the owner's workouts version, so an
+    unchanged list is answered with 304 before the query runs.
+    """
+    if workouts() is None:
         return jsonify({"error": "MongoDB not connected"}), 500
-    data = list(workouts.find({}, {"_id": 0}))
-    return jsonify(data)
+
+    uid = current_uid()
+    if not uid and request.args.get("user"):
+        return jsonify({"error": "Sign in to list a user's workouts"}), 401
+    etag, last_modified = etags.validators("workouts", uid or etags.GLOBAL, request.query_string)
+    cached = etags.not_modified(etag, last_modified)
+    if cached is not None:
+        return cached
+
+    try:
+        query = workout_query(request.args, uid)
+        limit = int(request.args.get("limit", 0 if request.args.get("format") == "ndjson" else DEFAULT_PAGE_SIZE))
+    except (ValueError, InvalidId):
+        return jsonify({"error": "Invalid cursor, limit or date range"}), 400
+
+    cursor = workouts().find(query).sort([("performedAt", -1), ("_id", -1)])
+
+    if request.args.get("format") == "ndjson":
+        if limit > 0:
+            cursor = cursor.limit(limit)
+
+        def generate():
+            for doc in cursor:
+                yield json.dumps(public_workout(doc), default=str) + "\n"
+
+        return etags.tag(Response(stream_with_context(generate()), mimetype="application/x-ndjson"), etag, last_modified)
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    # fetch one extra document to know whether another page exists
+    docs = list(cursor.limit(limit + 1))
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return etags.tag(Response(
+        json.dumps({"items": [public_workout(d) for d in docs[:limit]], "next": next_cursor}, default=str),
+        mimetype="application/json",
+    ), etag, last_modified)
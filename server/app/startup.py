@@ -0,0 +1,104 @@
+import os
+import time
+import threading
+from .mongo import get_db, mongo_uri
+
+# Startup checks that create_app() no longer waits for. The worker serves
+# requests at once; a background thread reaches Mongo, ensures indexes,
+# backfills old workouts (see app/indexes.py) and readies password hashing
+# (bcrypt cost and process pool, see app/hashing.py), retrying with backoff
+# until that succeeds. GET /api/health/ready answers 503 until then, so a load
+# balancer only sends traffic to workers that can use it. GET /api/health/live only says the process is up.
+
+RETRY_MAX_SEC = float(os.getenv("STARTUP_RETRY_MAX_SEC", "30"))
+
+class Readiness:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._app = None
+        self._pid = None
+        self.started = time.time()
+        self.checks = {"mongo": False, "indexes": False}
+        self.attempts = 0
+        self.error = None
+        self.ready_after = None  # seconds from start() to ready
+
+    def start(self, app):
+        """Run the checks for `app` in a background thread of this process."""
+        with self._lock:
+            if self._app is app and self._pid == os.getpid():
+                return
+            self._app, self._pid = app, os.getpid()
+            self._done.clear()
+            self.started = time.time()
+            self.checks = {"mongo": False, "indexes": False}
+            self.attempts, self.error, self.ready_after = 0, None, None
+        threading.Thread(target=self._run, args=(app,), name="startup-checks", daemon=True).start()
+
+    def _run(self, app):
+        if not mongo_uri():
+            self.error = "MONGO_URI not set"
+            print("⚠️ MongoDB URI not found")
+            return
+        from .indexes import desired_indexes, ensure_indexes, backfill_performed_at
+        from .hashing import warm_hashing
+        from .mongo import POOL_SIZE
+
+        delay = 1.0
+        while self._app is app:
+            self.attempts += 1
+            try:
+                # Missing indexes are built and changed TTLs applied (see app/indexes.py)
+                report = ensure_indexes(get_db(), desired_indexes(app.config["JWT_REFRESH_TOKEN_EXPIRES"]))
+                backfilled = backfill_performed_at(get_db())
+                warm_hashing()
+            except Exception as e:
+                # Requests keep retrying through the same client meanwhile
+                if self.attempts == 1:
+                    print(f"⚠️ MongoDB not reachable yet, retrying in the background: {e}")
+                self.error = str(e)
+                time.sleep(delay)
+                delay = min(delay * 2, RETRY_MAX_SEC)
+                continue
+            app.extensions["indexes"] = report
+            print(f"✅ Connected to MongoDB! (pool size {POOL_SIZE})")
+            if report["created"] or report["updated"]:
+                print(f"🗂️ Indexes built: {', '.join(report['created'] + report['updated'])}")
+            if backfilled:
+                print(f"🗂️ Backfilled performedAt on {backfilled} workouts")
+            for err in report["errors"]:
+                print(f"⚠️ Index {err['index']} not ensured: {err['error']}")
+            self.checks = {"mongo": True, "indexes": True}
+            self.error = None
+            self.ready_after = round(time.time() - self.started, 3)
+            self._done.set()
+            return
+
+    def ready(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Block until ready or `timeout` seconds; returns ready()."""
+        return self._done.wait(timeout)
+
+    def snapshot(self):
+        # the checking thread stays in the parent when it forks (gunicorn
+        # --preload); a worker forked before it finished runs its own
+        if not self.ready() and self._app is not None and self._pid != os.getpid():
+            self.start(self._app)
+        return {
+            "ok": self.ready(),
+            "checks": dict(self.checks),
+            "attempts": self.attempts,
+            "error": self.error,
+            "ready_after_sec": self.ready_after,
+            "uptime_sec": round(time.time() - self.started, 3),
+        }
+
+readiness = Readiness()
+
+def _forget_lock_after_fork():
+    readiness._lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_forget_lock_after_fork)
@@ -0,0 +1,58 @@
+import os
+import copy
+import threading
+from cachetools import LRUCache, TTLCache
+from .mongo import collection
+from utils.calc import tdee, goal_calories, macro_targets
+
+# Shared by the nutrition and planner blueprints.
+#   - computed targets memoized on the inputs that determine them
+#   - profiles cached per user; PATCH /auth/me invalidates (other workers
+#     see the change after PROFILE_CACHE_SEC)
+
+PROFILE_CACHE_SEC = int(os.getenv("PROFILE_CACHE_SEC", "60"))
+
+_lock = threading.Lock()
+_computed = LRUCache(maxsize=50_000)
+_profiles = TTLCache(maxsize=50_000, ttl=PROFILE_CACHE_SEC)
+
+def targets_key(sex, age, height_cm, weight_kg, activity_level, body_fat_percent, goal, pace_lbs_per_week):
+    bf = None if body_fat_percent is None else float(body_fat_percent)
+    return (
+        (sex or "").lower(), float(age), float(height_cm), float(weight_kg),
+        (activity_level or "moderate").lower(), bf, (goal or "maintain").lower(), float(pace_lbs_per_week or 0)
+    )
+
+def compute_targets(sex, age, height_cm, weight_kg, activity_level, body_fat_percent, goal, pace_lbs_per_week):
+    """Return (tdee_kcal, macros), computing only the first time a given input set is seen."""
+    key = targets_key(sex, age, height_cm, weight_kg, activity_level, body_fat_percent, goal, pace_lbs_per_week)
+    with _lock:
+        hit = _computed.get(key)
+    if hit is not None:
+        return hit[0], dict(hit[1])
+
+    goal = (goal or "maintain").lower()
+    td = tdee(sex, float(age), float(height_cm), float(weight_kg), activity_level, body_fat_percent)
+    cals = goal_calories(td, goal, float(pace_lbs_per_week or 0))
+    macros = macro_targets(cals, float(weight_kg), goal)
+    with _lock:
+        _computed[key] = (td, macros)
+    return td, dict(macros)
+
+def profile_for(uid):
+    """The user's profile (without _id), read from Mongo at most once per TTL."""
+    with _lock:
+        prof = _profiles.get(uid)
+    if prof is None:
+        prof = collection("profiles").find_one({"userId": uid}, {"_id": 0}) or {}
+        with _lock:
+            _profiles[uid] = prof
+    return copy.deepcopy(prof)
+
+def remember_profile(uid, prof):
+    with _lock:
+        _profiles[uid] = copy.deepcopy(prof)
+
+def invalidate_profile(uid):
+    with _lock:
+        _profiles.pop(uid, None)
@@ -0,0 +1,240 @@
+import os
+import re
+import sys
+import math
+import time
+import argparse
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from .mongo import collection
+from utils.calc import TRAINING_FIELDS, fold_training, training_states_batch, recommend_next
+
+training_bp = Blueprint("training", __name__)
+
+# Progressive-overload recommendations. Each (user, exercise) has one
+# document in exercise_state holding the state from utils.calc (volume
+# loads, e1RM trend sums, last top set). analytics.record_workouts folds new
+# workouts into it, so a recommendation reads a few small documents instead
+# of the user's history. A workout older than its exercise's last session
+# (an import, a backdated log) can't be folded in; the state is marked stale
+# and rebuilt from history on the next read. Every user can be rebuilt in
+# one vectorized pass:
+#
+#     python -m app.training rebuild [--user ID ...]
+
+states = lambda: collection("exercise_state")
+workouts = lambda: collection("workouts")
+
+STATE_RETRIES = 3
+WORKOUT_FIELDS = {"userId": 1, "exercise": 1, "performedAt": 1, "sets": 1, "reps": 1, "weight_kg": 1}
+
+def state_id(uid, exercise):
+    return f"{uid}|{exercise}"
+
+def workout_row(doc):
+    """(userId, exercise, ts, weight, reps, sets) of a workout, or None if it can't count."""
+    ts, exercise = doc.get("performedAt"), doc.get("exercise")
+    if not doc.get("userId") or not isinstance(exercise, str) or not isinstance(ts, (int, float)) \
+            or not math.isfinite(ts):
+        return None
+    try:
+        # a missing count is one set, an explicit 0 is none (as in analytics.rollup_pipeline)
+        sets = 1 if doc.get("sets") is None else int(doc["sets"])
+        reps = int(doc.get("reps") or 0)
+        weight = float(doc.get("weight_kg") or 0)
+    except (TypeError, ValueError):
+        return None
+    return doc["userId"], exercise.lower(), ts, weight, reps, sets
+
+def _untracked_history(new):
+    """
+    Keys of `new` ({state key: (userId, exercise, ids of the batch's workouts)}),
+    exercises without a state yet, whose user has other workouts of them
+    (any spelling) that a state built from the batch alone would miss. One
+    aggregation for the whole batch.
+    """
+    if not new:
+        return set()
+    match = {"$or": [{"userId": uid, "exercise": {"$regex": f"^{re.escape(exercise)}$", "$options": "i"},
+                      "_id": {"$nin": ids}}
+                     for uid, exercise, ids in new.values()]}
+    found = workouts().aggregate([
+        {"$match": match},
+        {"$group": {"_id": {"userId": "$userId", "exercise": {"$toLower": "$exercise"}}}},
+    ])
+    return {state_id(row["_id"]["userId"], row["_id"]["exercise"]) for row in found} & set(new)
+
+def update_states(docs):
+    """
+    Fold newly recorded workouts into their exercises' states: one read and
+    one write per batch, plus one aggregation when the batch starts
+    exercises that have no state yet.
+    """
+    rows, ids = {}, {}
+    for doc in docs:
+        row = workout_row(doc)
+        if row is not None:
+            key = state_id(row[0], row[1])
+            rows.setdefault(key, []).append(row)
+            if "_id" in doc:
+                ids.setdefault(key, []).append(doc["_id"])
+    for _ in range(STATE_RETRIES):
+        if not rows:
+            return
+        current = {s.pop("_id"): s for s in states().find({"_id": {"$in": list(rows)}})}
+        for batch in rows.values():
+            batch.sort(key=lambda r: r[2])
+        untracked = _untracked_history({key: (batch[0][0], batch[0][1], ids.get(key, []))
+                                        for key, batch in rows.items() if key not in current})
+        ops, keys = [], []
+        for key, batch in rows.items():
+            uid, exercise = batch[0][0], batch[0][1]
+            doc = current.get(key)
+            version = doc.get("v", 0) if doc else 0
+            stale = bool(doc and doc.get("stale")) or (doc is None and key in untracked)
+            state = {k: doc[k] for k in TRAINING_FIELDS if k in doc} if doc and not stale else None
+            for _, _, ts, weight, reps, sets in batch:
+                if stale:
+                    break
+                state = fold_training(state, int(ts // 86400), weight, reps, sets)
+                stale = state is None
+            if stale and doc and doc.get("stale"):
+                continue  # already waiting for a rebuild
+            update = {"userId": uid, "exercise": exercise, "stale": stale, "updatedAt": time.time()}
+            if not stale:
+                update.update(state)
+            # the version guards against a concurrent writer folding the same state
+            ops.append(UpdateOne({"_id": key, "v": version}, {"$set": update, "$inc": {"v": 1}}, upsert=True))
+            keys.append(key)
+        if not ops:
+            return
+        try:
+            states().bulk_write(ops, ordered=False)
+            return
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in errors):
+                raise
+            # lost the race: re-read those states and fold again
+            rows = {keys[err["index"]]: rows[keys[err["index"]]] for err in errors}
+    print(f"⚠️ training state for {', '.join(rows)} not updated after {STATE_RETRIES} tries")
+    states().update_many({"_id": {"$in": list(rows)}}, {"$set": {"stale": True}})
+
+def rebuild_states(uids=None, chunk=1000):
+    """
+    Recompute the states of `uids` (every user when None) from their
+    workouts: one read, one vectorized pass, then writes in chunks. States
+    of exercises no longer in the history are removed. Returns
+    {"states", "workouts", "seconds"}.
+    """
+    started = time.time()
+    query = {"performedAt": {"$type": "number"}, "exercise": {"$type": "string"}}
+    if uids is not None:
+        query["userId"] = {"$in": list(uids)}
+
+    keys, group, columns = {}, [], [[] for _ in range(4)]
+    for doc in workouts().find(query, WORKOUT_FIELDS):
+        row = workout_row(doc)
+        if row is None:
+            continue
+        group.append(keys.setdefault((row[0], row[1]), len(keys)))
+        for column, value in zip(columns, row[2:]):
+            column.append(value)
+    built = training_states_batch(group, *columns, n_groups=len(keys))
+
+    fields = {k: built[k].tolist() for k in TRAINING_FIELDS}
+    now = time.time()
+    ops = []
+    for (uid, exercise), i in keys.items():
+        ops.append(UpdateOne(
+            {"_id": state_id(uid, exercise)},
+            {"$set": {"userId": uid, "exercise": exercise, "stale": False, "updatedAt": now,
+                      **{k: fields[k][i] for k in TRAINING_FIELDS}},
+             "$inc": {"v": 1}},
+            upsert=True,
+        ))
+        if len(ops) >= chunk:
+            states().bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        states().bulk_write(ops, ordered=False)
+    gone = {"updatedAt": {"$lt": started}}
+    if uids is not None:
+        gone["userId"] = {"$in": list(uids)}
+    states().delete_many(gone)
+    return {"states": len(keys), "workouts": len(group), "seconds": round(time.time() - started, 3)}
+
+def public_recommendation(doc, rec, i):
+    action = str(rec["action"][i])
+    return {
+        "exercise": doc["exercise"],
+        "action": action,
+        "next": None if action == "none" else {
+            "weight_kg": round(float(rec["weight_kg"][i]), 2),
+            "reps": int(rec["reps"][i]),
+            "sets": int(rec["sets"][i]),
+            "e1rm": round(float(rec["target_e1rm"][i]), 1),
+        },
+        "e1rm": round(float(rec["e1rm"][i]), 1),
+        "trend_kg_per_week": round(float(rec["trend_per_day"][i]) * 7, 2),
+        "acute_load": round(float(rec["acute"][i]), 1),
+        "chronic_load": round(float(rec["chronic"][i]), 1),
+        "acwr": round(float(rec["acwr"][i]), 2),
+        "days_since": int(rec["days_since"][i]),
+        "sessions": int(doc.get("sessions", 0)),
+        "best_e1rm": round(doc.get("best_e1rm", 0.0), 1),
+    }
+
+@training_bp.route("/recommendations", methods=["GET"])
+@jwt_required()
+def recommendations():
+    """Next session's weight, reps and sets per exercise (?exercise=, ?increment= kg, default 2.5)."""
+    if states() is None:
+        return jsonify({"error": "MongoDB not connected"}), 500
+    try:
+        increment = float(request.args.get("increment", 2.5))
+    except ValueError:
+        increment = 0
+    if not 0.25 <= increment <= 20:
+        return jsonify({"error": "increment must be 0.25-20 kg"}), 400
+
+    uid = get_jwt_identity()
+    query = {"userId": uid}
+    if request.args.get("exercise"):
+        query["exercise"] = request.args["exercise"].strip().lower()
+    docs = list(states().find(query).sort("exercise", 1))
+    if any(d.get("stale") for d in docs):
+        rebuild_states([uid])
+        docs = list(states().find(query).sort("exercise", 1))
+    if not docs:
+        return jsonify({"exercises": []})
+
+    today = int(time.time() // 86400)
+    rec = recommend_next({k: [d.get(k, 0.0) for d in docs] for k in TRAINING_FIELDS}, today, increment)
+    return jsonify({"exercises": [public_recommendation(d, rec, i) for i, d in enumerate(docs)]})
+
+@training_bp.route("/rebuild", methods=["POST"])
+@jwt_required()
+def rebuild():
+    return jsonify(rebuild_states([get_jwt_identity()]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.training", description="Rebuild training states.")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--user", action="append", dest="users", help="only this user id (repeatable)")
+    parser.add_argument("--chunk", type=int, default=1000, help="states per bulk write")
+    args = parser.parse_args(argv)
+    if workouts() is None:
+        print("❌ MONGO_URI not set")
+        return 2
+    result = rebuild_states(args.users, args.chunk)
+    print(f"🏋️ Rebuilt {result['states']} exercise states from {result['workouts']} workouts "
+          f"in {result['seconds']} s")
+    return 0
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
+    sys.exit(main())
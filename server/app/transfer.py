@@ -0,0 +1,389 @@
+import os
+import json
+import zlib
+import hashlib
+import tempfile
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from flask import Blueprint, Response, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from .mongo import collection
+from .routes import WORKOUT_SCHEMA, validate_workout
+from .planner import MACROS, log_day
+from .analytics import record_workouts
+from .targets_cache import invalidate_profile
+from . import etags
+
+pa = pq = None  # pyarrow, imported by the first columnar export or import
+
+def load_arrow():
+    """Import pyarrow on first use. False when it isn't installed; gzip NDJSON still works."""
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow.parquet
+            import pyarrow
+        except ImportError:
+            return False
+        pq, pa = pyarrow.parquet, pyarrow
+    return True
+
+transfer_bp = Blueprint("transfer", __name__)
+
+# Export / import of one user's whole history (profile, workouts, food log),
+# streamed in fixed-size chunks so memory stays flat however long it is.
+#
+#   ndjson   gzip'd NDJSON, one {"kind": ..., ...} record per line
+#   arrow    Arrow IPC stream  \  one row per workout or food log item
+#   parquet  Parquet file      /  ("kind" column); profile in schema metadata
+#
+# Imports keep each record's id and only insert ids the user doesn't have
+# yet, so restoring the same backup twice is a no-op (an id that belongs to
+# another account is replaced by one derived from it and the importing user,
+# the same on every import). Rollups and day totals are updated for the new
+# records only.
+
+CHUNK = 5000
+IMPORT_MAX_BYTES = int(os.getenv("HISTORY_IMPORT_MAX_BYTES", str(512 * 1024 * 1024)))
+SPOOL_BYTES = 16 * 1024 * 1024  # parquet uploads are buffered to disk beyond this
+# gzip NDJSON: decompressed size and line length caps, so a small upload that
+# inflates enormously (a gzip bomb) is refused instead of held in memory
+IMPORT_MAX_INFLATED = int(os.getenv("HISTORY_IMPORT_MAX_INFLATED_BYTES", str(4 * 1024 * 1024 * 1024)))
+IMPORT_MAX_LINE = int(os.getenv("HISTORY_IMPORT_MAX_LINE_BYTES", str(1024 * 1024)))
+INFLATE_BLOCK = 1024 * 1024
+
+PROFILE_FIELDS = {"sex", "age", "height_cm", "weight_kg", "body_fat_percent", "activity_level", "goals"}
+
+MIMETYPES = {
+    "ndjson": "application/gzip",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+EXTENSIONS = {"ndjson": "ndjson.gz", "arrow": "arrows", "parquet": "parquet"}
+
+workouts = lambda: collection("workouts")
+food_log = lambda: collection("food_log")
+food_log_days = lambda: collection("food_log_days")
+profiles = lambda: collection("profiles")
+
+# column -> (arrow type name, python coercion); shared by both record kinds
+COLUMNS = {
+    "kind": ("string", str), "id": ("string", str),
+    "exercise": ("string", str), "sets": ("int64", int), "reps": ("int64", int),
+    "weight_kg": ("float64", float), "duration_min": ("float64", float),
+    "performedAt": ("int64", int), "notes": ("string", str),
+    "day": ("string", str), "name": ("string", str), "servings": ("float64", float),
+    **{k: ("float64", float) for k in MACROS}, "loggedAt": ("int64", int),
+}
+
+# ---- reading a user's history -------------------------------------------
+def user_profile(uid):
+    prof = profiles().find_one({"userId": uid}, {"_id": 0, "userId": 0}) or {}
+    return {k: v for k, v in prof.items() if k in PROFILE_FIELDS}
+
+def history(uid):
+    """Every workout then every food log item, as flat records with "kind" and "id"."""
+    # only fields an import accepts: no live-session sessionId/seq, nothing legacy
+    fields = {k: 1 for k in WORKOUT_SCHEMA}
+    for doc in workouts().find({"userId": uid}, fields).sort("performedAt", 1).batch_size(CHUNK):
+        yield {"kind": "workout", "id": str(doc.pop("_id")), **doc}
+    for doc in food_log().find({"userId": uid}, {"userId": 0}).sort([("day", 1), ("_id", 1)]).batch_size(CHUNK):
+        yield {"kind": "food_log", "id": str(doc.pop("_id")), **doc}
+
+def chunked(records, size=CHUNK):
+    chunk = []
+    for rec in records:
+        chunk.append(rec)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# ---- export --------------------------------------------------------------
+def export_ndjson(uid):
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)  # gzip container
+    yield gz.compress((json.dumps({"kind": "profile", **user_profile(uid)}, default=str) + "\n").encode())
+    for chunk in chunked(history(uid)):
+        data = "".join(json.dumps(rec, default=str) + "\n" for rec in chunk).encode()
+        out = gz.compress(data)
+        if out:
+            yield out
+    yield gz.flush()
+
+class _Drain:
+    """Write-only file for pyarrow whose bytes the generator hands out as they come."""
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+def arrow_schema(profile):
+    return pa.schema([(name, getattr(pa, t)()) for name, (t, _) in COLUMNS.items()],
+                     metadata={"profile": json.dumps(profile, default=str)})
+
+def _coerce(value, cast):
+    if value is None:
+        return None
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+def record_batch(schema, chunk):
+    columns = [[_coerce(rec.get(name), cast) for rec in chunk] for name, (_, cast) in COLUMNS.items()]
+    return pa.RecordBatch.from_arrays([pa.array(col, type=field.type) for col, field in zip(columns, schema)],
+                                      schema=schema)
+
+def export_columnar(uid, fmt):
+    schema = arrow_schema(user_profile(uid))
+    sink = _Drain()
+    if fmt == "arrow":
+        writer = pa.ipc.new_stream(sink, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+    else:
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    for chunk in chunked(history(uid)):
+        batch = record_batch(schema, chunk)
+        if fmt == "arrow":
+            writer.write_batch(batch)
+        else:
+            writer.write_table(pa.Table.from_batches([batch]))  # one row group per chunk
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+@transfer_bp.route("/export", methods=["GET"])
+@jwt_required()
+def export_history():
+    """Stream the caller's profile, workouts and food log (?format=ndjson|arrow|parquet)."""
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in MIMETYPES:
+        return jsonify({"error": "format must be ndjson, arrow or parquet"}), 400
+    if fmt != "ndjson" and not load_arrow():
+        return jsonify({"error": f"{fmt} export needs pyarrow installed on the server"}), 501
+    if workouts() is None:
+        return jsonify({"error": "MongoDB not connected"}), 500
+
+    uid = get_jwt_identity()
+    body = export_ndjson(uid) if fmt == "ndjson" else export_columnar(uid, fmt)
+    return Response(body, mimetype=MIMETYPES[fmt], headers={
+        "Content-Disposition": f'attachment; filename="workout-history.{EXTENSIONS[fmt]}"',
+    })
+
+# ---- import --------------------------------------------------------------
+class _Limited:
+    """Request body reader that refuses to go past IMPORT_MAX_BYTES."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+        self.closed = False
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            return b"".join(iter(lambda: self.read(1024 * 1024), b""))
+        data = self.stream.read(n)
+        self.size += len(data)
+        if self.size > IMPORT_MAX_BYTES:
+            raise OverflowError
+        return data
+
+def inflate(stream):
+    """Decompressed blocks of at most INFLATE_BLOCK bytes: input that doesn't
+    fit is left in unconsumed_tail and drained before reading more."""
+    gz = zlib.decompressobj(47)  # gzip or zlib header, auto-detected
+    total = 0
+    while True:
+        block = gz.unconsumed_tail or stream.read(1024 * 1024)
+        if not block:
+            break
+        data = gz.decompress(block, INFLATE_BLOCK)
+        total += len(data)
+        if total > IMPORT_MAX_INFLATED:
+            raise OverflowError(f"Decompressed data exceeds {IMPORT_MAX_INFLATED} bytes")
+        yield data
+    yield gz.flush()
+
+def read_ndjson(stream):
+    pending = b""
+    for data in inflate(stream):
+        pending += data
+        *lines, pending = pending.split(b"\n")
+        if len(pending) > IMPORT_MAX_LINE or any(len(line) > IMPORT_MAX_LINE for line in lines):
+            raise OverflowError(f"A line exceeds {IMPORT_MAX_LINE} bytes")
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if pending.strip():
+        yield json.loads(pending)
+
+def read_arrow(stream):
+    reader = pa.ipc.open_stream(stream)
+    profile = (reader.schema.metadata or {}).get(b"profile")
+    if profile:
+        yield {"kind": "profile", **json.loads(profile)}
+    for batch in reader:
+        yield from batch.to_pylist()
+
+def read_parquet(stream):
+    # the footer is at the end, so the upload has to land somewhere seekable
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as spool:
+        while True:
+            block = stream.read(1024 * 1024)
+            if not block:
+                break
+            spool.write(block)
+        spool.seek(0)
+        parquet = pq.ParquetFile(spool)
+        profile = (parquet.schema_arrow.metadata or {}).get(b"profile")
+        if profile:
+            yield {"kind": "profile", **json.loads(profile)}
+        for batch in parquet.iter_batches(batch_size=CHUNK):
+            yield from batch.to_pylist()
+
+def _object_id(value):
+    try:
+        return ObjectId(value) if value else ObjectId()
+    except (InvalidId, TypeError):
+        return ObjectId()
+
+def clean_food(rec):
+    entry = {"day": log_day(rec.get("day")), "name": str(rec.get("name") or "item"),
+             "servings": float(rec.get("servings") or 1)}
+    for k in MACROS:
+        entry[k] = float(rec.get(k) or 0)
+    entry["loggedAt"] = int(rec.get("loggedAt") or 0)
+    return entry
+
+def _remapped_id(uid, oid):
+    return ObjectId(hashlib.blake2b(f"{uid}:{oid}".encode(), digest_size=12).digest())
+
+def _upsert(coll, uid, docs):
+    """Upsert (id, doc) pairs for `uid`; returns ({index: id} inserted, [index] whose id another user owns)."""
+    ops = [UpdateOne({"_id": oid, "userId": uid}, {"$setOnInsert": doc}, upsert=True) for oid, doc in docs]
+    try:
+        return coll.bulk_write(ops, ordered=False).upserted_ids, []
+    except BulkWriteError as e:
+        upserted = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
+        return upserted, [err["index"] for err in e.details.get("writeErrors", []) if err.get("code") == 11000]
+
+def insert_new(coll, uid, docs):
+    """Insert the (id, doc) pairs whose id the user doesn't have yet; returns the new docs."""
+    if not docs:
+        return []
+    upserted, collided = _upsert(coll, uid, docs)
+    new = [{"_id": docs[i][0], **docs[i][1], "userId": uid} for i in upserted]
+    if collided:
+        # ids owned by another user: derive a stable one, so a re-import finds it
+        moved = [(_remapped_id(uid, docs[i][0]), docs[i][1]) for i in collided]
+        upserted, _ = _upsert(coll, uid, moved)
+        new += [{"_id": moved[i][0], **moved[i][1], "userId": uid} for i in upserted]
+    return new
+
+def add_day_totals(uid, items):
+    totals = {}
+    for it in items:
+        day = totals.setdefault(it["day"], {**{k: 0.0 for k in MACROS}, "items": 0})
+        for k in MACROS:
+            day[k] += it[k]
+        day["items"] += 1
+    if totals:
+        food_log_days().bulk_write([
+            UpdateOne({"_id": f"{uid}:{day}"}, {"$inc": inc, "$setOnInsert": {"userId": uid, "day": day}}, upsert=True)
+            for day, inc in totals.items()
+        ], ordered=False)
+
+@transfer_bp.route("/import", methods=["POST"])
+@jwt_required()
+def import_history():
+    """
+    Load an export into the caller's account (?format=ndjson|arrow|parquet,
+    defaulting to the request's Content-Type). Records already present are
+    skipped; invalid ones are reported by position.
+    """
+    fmt = request.args.get("format") or next((f for f, m in MIMETYPES.items() if m == request.mimetype), "ndjson")
+    if fmt not in MIMETYPES:
+        return jsonify({"error": "format must be ndjson, arrow or parquet"}), 400
+    if fmt != "ndjson" and not load_arrow():
+        return jsonify({"error": f"{fmt} import needs pyarrow installed on the server"}), 501
+    if workouts() is None:
+        return jsonify({"error": "MongoDB not connected"}), 500
+    if (request.content_length or 0) > IMPORT_MAX_BYTES:
+        return jsonify({"error": f"Payload exceeds {IMPORT_MAX_BYTES} bytes"}), 413
+
+    uid = get_jwt_identity()
+    reader = {"ndjson": read_ndjson, "arrow": read_arrow, "parquet": read_parquet}[fmt]
+    counts = {"workouts": 0, "food_log": 0, "skipped": 0, "profile": False}
+    errors = []
+    pending_workouts, pending_food = [], []
+
+    def flush():
+        new = insert_new(workouts(), uid, pending_workouts)
+        record_workouts(new)
+        counts["workouts"] += len(new)
+        counts["skipped"] += len(pending_workouts) - len(new)
+        new = insert_new(food_log(), uid, pending_food)
+        add_day_totals(uid, new)
+        counts["food_log"] += len(new)
+        counts["skipped"] += len(pending_food) - len(new)
+        pending_workouts.clear()
+        pending_food.clear()
+
+    try:
+        for i, rec in enumerate(reader(_Limited(request.stream))):
+            if not isinstance(rec, dict):
+                errors.append({"index": i, "error": "Expected a JSON object"})
+                continue
+            rec = {k: v for k, v in rec.items() if v is not None}
+            kind, oid = rec.pop("kind", "workout"), _object_id(rec.pop("id", None))
+            if kind == "profile":
+                fields = {k: v for k, v in rec.items() if k in PROFILE_FIELDS}
+                if fields:
+                    profiles().update_one({"userId": uid}, {"$set": fields}, upsert=True)
+                    invalidate_profile(uid)
+                    counts["profile"] = True
+                continue
+            if kind == "workout":
+                doc, err = validate_workout(rec)
+                if err:
+                    errors.append({"index": i, "error": err})
+                    continue
+                pending_workouts.append((oid, doc))
+            elif kind == "food_log":
+                try:
+                    pending_food.append((oid, clean_food(rec)))
+                except (TypeError, ValueError) as e:
+                    errors.append({"index": i, "error": str(e)})
+                    continue
+            else:
+                errors.append({"index": i, "error": f"Unknown kind: {kind}"})
+                continue
+            if len(pending_workouts) + len(pending_food) >= CHUNK:
+                flush()
+        flush()
+    except OverflowError as e:
+        return jsonify({"error": str(e) or f"Payload exceeds {IMPORT_MAX_BYTES} bytes", **counts}), 413
+    except (ValueError, zlib.error) as e:
+        return jsonify({"error": f"Unreadable {fmt} data: {e}", **counts}), 400
+    finally:
+        if counts["workouts"]:
+            etags.bump("workouts", uid, etags.GLOBAL)
+        if counts["profile"]:
+            etags.bump("me", uid)
+
+    return jsonify({**counts, "failed": len(errors), "errors": errors[:100]})
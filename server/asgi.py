@@ -0,0 +1,10 @@
+import os
+from dotenv import load_dotenv
+
+# before any app import: app.mongo, app.metrics and app.etags read settings at import
+load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+
+from app.aio import create_asgi_app
+
+# Async serving mode:  uvicorn asgi:app --port 5000
+app = create_asgi_app()
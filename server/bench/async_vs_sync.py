@@ -0,0 +1,168 @@
+"""
+Concurrency under a slow upstream: /nutrition/foods/search served by the sync
+Flask app (fixed thread pool, like one gthread worker) vs. the ASGI app.
+
+Every request uses a distinct query, so each one misses the cache and waits
+on a local fake Nutritionix that sleeps --delay seconds.
+
+    python bench/async_vs_sync.py [--requests 600] [--concurrency 100] [--threads 8] [--delay 0.1]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import threading
+import subprocess
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, SERVER_DIR)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_fake_provider(port, delay):
+    """Nutritionix stand-in on its own event loop, so it never becomes the bottleneck."""
+    body = json.dumps({"common": [{"food_name": "apple", "serving_qty": 1, "serving_unit": "medium",
+                                   "nf_calories": 95}], "branded": []}).encode()
+    response = (b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                if not head:
+                    break
+                await asyncio.sleep(delay)
+                writer.write(response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(asyncio.start_server(handle, "127.0.0.1", port, backlog=1024))
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+
+def serve_sync(port, threads):
+    from concurrent.futures import ThreadPoolExecutor
+    from werkzeug.serving import BaseWSGIServer
+    from app import create_app
+
+    pool = ThreadPoolExecutor(threads)
+
+    class PooledServer(BaseWSGIServer):
+        request_queue_size = 1024
+
+        def process_request(self, request, client_address):
+            pool.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    PooledServer("127.0.0.1", port, create_app()).serve_forever()
+
+def wait_for(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on :{port} did not start")
+
+async def drive(port, token, total, concurrency, tag):
+    import aiohttp
+
+    latencies, errors = [], 0
+    sem = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(f"http://127.0.0.1:{port}", connector=connector) as client:
+        async def one(i):
+            nonlocal errors
+            async with sem:
+                start = time.perf_counter()
+                async with client.get("/nutrition/foods/search", params={"q": f"{tag}-{i}"},
+                                      headers={"Authorization": f"Bearer {token}"}) as r:
+                    await r.read()
+                latencies.append(time.perf_counter() - start)
+                errors += r.status != 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    pct = lambda p: round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1)
+    return {"requests": total, "errors": errors, "seconds": round(elapsed, 3),
+            "rps": round(total / elapsed, 1), "p50_ms": pct(0.50), "p99_ms": pct(0.99)}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=600)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--delay", type=float, default=0.1)
+    args = parser.parse_args()
+
+    provider_port = free_port()
+    start_fake_provider(provider_port, args.delay)
+    env = dict(os.environ, NUTRITIONIX_URL=f"http://127.0.0.1:{provider_port}/",
+               NUTRITIONIX_APP_ID="bench", NUTRITIONIX_API_KEY="bench",
+               JWT_SECRET_KEY="bench-secret-key-with-enough-bytes-32", BCRYPT_LOG_ROUNDS="10",
+               RATELIMIT_ENABLED="0")
+    env.pop("MONGO_URI", None)
+    env.pop("FOOD_INDEX_PATH", None)
+    os.environ.update(env)
+    os.environ.pop("MONGO_URI", None)
+    os.environ.pop("FOOD_INDEX_PATH", None)
+
+    from flask_jwt_extended import create_access_token
+    from app import create_app
+    with create_app().app_context():
+        token = create_access_token(identity="bench-user", additional_claims={"tv": 0})
+
+    results = {}
+    modes = {
+        "sync": [sys.executable, os.path.abspath(__file__), "serve-sync", "{port}", str(args.threads)],
+        "asgi": [sys.executable, "-m", "uvicorn", "asgi:app", "--port", "{port}", "--log-level", "warning"],
+    }
+    for mode, cmd in modes.items():
+        port = free_port()
+        proc = subprocess.Popen([c.format(port=port) for c in cmd], cwd=SERVER_DIR, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(port)
+            results[mode] = asyncio.run(drive(port, token, args.requests, args.concurrency, mode))
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    print(json.dumps({"config": vars(args), "results": results}, indent=2))
+    print(f"asgi/sync throughput: {results['asgi']['rps'] / results['sync']['rps']:.1f}x")
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "serve-sync":
+        serve_sync(int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        main()
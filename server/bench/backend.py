@@ -0,0 +1,19 @@
+"""
+The in-memory backend the bench scripts run against when no --mongo-uri is
+given: one mongomock client shared by every app.mongo caller. Needs
+`pip install mongomock`.
+"""
+
+def use_mongomock():
+    """Point app.mongo at a shared mongomock client and return it."""
+    import mongomock
+    from mongomock.collection import BulkOperationBuilder
+    import app.mongo
+
+    # pymongo >= 4.11 passes sort= to bulk update builders; mongomock 4.x doesn't accept it
+    add_update, add_replace = BulkOperationBuilder.add_update, BulkOperationBuilder.add_replace
+    BulkOperationBuilder.add_update = lambda self, *a, sort=None, **kw: add_update(self, *a, **kw)
+    BulkOperationBuilder.add_replace = lambda self, *a, sort=None, **kw: add_replace(self, *a, **kw)
+    shared = mongomock.MongoClient()
+    app.mongo.MongoClient = lambda *a, **kw: shared
+    return shared
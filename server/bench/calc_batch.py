@@ -0,0 +1,59 @@
+"""
+Scalar loop vs. vectorized targets over synthetic profiles.
+
+    python bench/calc_batch.py [n_profiles]
+"""
+import os
+import sys
+import time
+import random
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from utils.calc import tdee, goal_calories, macro_targets, targets_batch
+
+def synthetic_profiles(n, seed=42):
+    rnd = random.Random(seed)
+    return {
+        "sex": [rnd.choice(["male", "female"]) for _ in range(n)],
+        "age": [rnd.randint(18, 80) for _ in range(n)],
+        "height_cm": [round(rnd.uniform(145, 205), 1) for _ in range(n)],
+        "weight_kg": [round(rnd.uniform(45, 140), 1) for _ in range(n)],
+        "activity_level": [rnd.choice(["sedentary", "light", "moderate", "active", "very_active"]) for _ in range(n)],
+        "body_fat_percent": [rnd.choice([None, round(rnd.uniform(8, 40), 1)]) for _ in range(n)],
+        "goal": [rnd.choice(["cut", "maintain", "bulk"]) for _ in range(n)],
+        "pace_lbs_per_week": [rnd.choice([0, 0.5, 1, 2]) for _ in range(n)],
+    }
+
+def scalar_loop(cols):
+    out = {"tdee_kcal": [], "calories": [], "protein_g": [], "fat_g": [], "carbs_g": []}
+    for i in range(len(cols["weight_kg"])):
+        td = tdee(cols["sex"][i], cols["age"][i], cols["height_cm"][i], cols["weight_kg"][i],
+                  cols["activity_level"][i], cols["body_fat_percent"][i])
+        cals = goal_calories(td, cols["goal"][i], cols["pace_lbs_per_week"][i])
+        out["tdee_kcal"].append(round(td))
+        for k, v in macro_targets(cals, cols["weight_kg"][i], cols["goal"][i]).items():
+            out[k].append(v)
+    return out
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    cols = synthetic_profiles(n)
+    expected, t_scalar = timed(scalar_loop, cols)
+    got, t_batch = timed(targets_batch, cols)
+
+    # same call with numeric columns already in NumPy (e.g. read from Arrow/Parquet)
+    arrays = {k: (np.asarray(v, dtype=float) if k not in ("sex", "activity_level", "goal") else v) for k, v in cols.items()}
+    _, t_arrays = timed(targets_batch, arrays)
+
+    assert all(expected[k] == got[k] for k in expected), "batch results differ from scalar path"
+    print(f"profiles: {n}")
+    print(f"scalar loop: {t_scalar:.3f}s  ({n / t_scalar:,.0f} profiles/s)")
+    print(f"batch:       {t_batch:.3f}s  ({n / t_batch:,.0f} profiles/s)")
+    print(f"batch (numpy input): {t_arrays:.3f}s  ({n / t_arrays:,.0f} profiles/s)")
+    print(f"speedup:     {t_scalar / t_batch:.1f}x (lists), {t_scalar / t_arrays:.1f}x (numpy input)")
@@ -0,0 +1,127 @@
+"""
+Background mail queue (app/emailer.py EmailQueue) against a local SMTP
+stand-in: connection reuse across batches, retries of transient failures,
+refused recipients failing once without a retry or a reconnect, and the
+counters stats() reports.
+
+    python bench/email_queue.py [--messages 500] [--workers 2] [--smtp-delay 0.002]
+
+The stand-in refuses RCPT for refused-* addresses (550), answers DATA for
+flaky-* addresses with a 451 the first time, and always does for down-*
+addresses. Exits 1 if a check fails.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+from collections import Counter
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, SERVER_DIR)
+
+from async_vs_sync import free_port
+from load import start_fake_smtp
+
+MAX_RETRIES = 2
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--smtp-delay", type=float, default=0.002)
+    args = parser.parse_args()
+
+    received, connections, deferred = [], [], set()
+
+    def reject(cmd, rcpts):
+        if cmd == "RCPT" and rcpts[-1].startswith("refused"):
+            return "550 5.1.1 No such user"
+        if cmd == "DATA" and rcpts and rcpts[0].startswith("down"):
+            return "451 4.3.0 Try again later"
+        if cmd == "DATA" and rcpts and rcpts[0].startswith("flaky") and rcpts[0] not in deferred:
+            deferred.add(rcpts[0])
+            return "451 4.3.0 Try again later"
+        return None
+
+    port = free_port()
+    start_fake_smtp(port, received, args.smtp_delay, reject, connections)
+    os.environ.update({
+        "SMTP_HOST": "127.0.0.1", "SMTP_PORT": str(port), "SMTP_STARTTLS": "0",
+        "SMTP_USER": "bench", "SMTP_PASSWORD": "bench", "FROM_EMAIL": "bench@localhost",
+    })
+
+    from app.emailer import EmailQueue
+    mail = EmailQueue(workers=args.workers, batch_size=20, max_retries=MAX_RETRIES, backoff=0.05, idle_timeout=30)
+    results, problems = {}, []
+
+    def check(ok, message):
+        if not ok:
+            problems.append(message)
+
+    def send(addresses, until, timeout=30):
+        for to in addresses:
+            mail.enqueue(to, "bench", "<p>bench</p>")
+        deadline = time.monotonic() + timeout
+        while not until(mail.stats()) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return mail.stats()
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        # reuse: one session per worker carries every message, and refused
+        # recipients neither retry nor reconnect
+        good = [f"user{i}@example.com" for i in range(args.messages)]
+        refused = [f"refused{i}@example.com" for i in range(5)]
+        mixed = [to for pair in zip(good, refused + [None] * len(good)) for to in pair if to]
+        start = time.perf_counter()
+        stats = send(mixed, lambda s: s["sent"] + s["failed"] >= len(mixed))
+        elapsed = time.perf_counter() - start
+        check(stats["sent"] == len(good), f"reuse: {stats['sent']} of {len(good)} sent")
+        check(stats["failed"] == len(refused), f"reuse: {stats['failed']} failed, expected {len(refused)} refused")
+        check(stats["retried"] == 0, f"reuse: {stats['retried']} retries of refused recipients")
+        check(stats["connections_opened"] <= args.workers,
+              f"reuse: {stats['connections_opened']} connections for {args.workers} workers")
+        check(len(connections) == stats["connections_opened"],
+              f"reuse: the stand-in saw {len(connections)} connections, stats say {stats['connections_opened']}")
+        check(Counter(received) == Counter(good), "reuse: recipients missing or sent twice")
+        results["reuse"] = {"messages": len(mixed), "connections": len(connections),
+                            "messages_per_s": round(len(mixed) / elapsed, 1)}
+
+        # retry: a 451 is retried after the backoff and delivered once
+        flaky = [f"flaky{i}@example.com" for i in range(5)]
+        before = dict(stats)
+        stats = send(flaky, lambda s: s["sent"] >= before["sent"] + len(flaky))
+        check(stats["sent"] - before["sent"] == len(flaky), f"retry: {stats['sent'] - before['sent']} of {len(flaky)} sent")
+        check(stats["retried"] - before["retried"] == len(flaky), f"retry: {stats['retried'] - before['retried']} retries")
+        check(stats["failed"] == before["failed"], "retry: a deferred message was counted as failed")
+        check(all(received.count(to) == 1 for to in flaky), "retry: a deferred message was lost or sent twice")
+        results["retry"] = {"deferred": len(flaky), "retried": stats["retried"] - before["retried"]}
+
+        # give up: a message that keeps getting a 451 fails after max_retries
+        down = [f"down{i}@example.com" for i in range(3)]
+        before = dict(stats)
+        stats = send(down, lambda s: s["failed"] >= before["failed"] + len(down))
+        check(stats["failed"] - before["failed"] == len(down), f"give up: {stats['failed'] - before['failed']} failed")
+        check(stats["retried"] - before["retried"] == len(down) * MAX_RETRIES,
+              f"give up: {stats['retried'] - before['retried']} retries, expected {len(down) * MAX_RETRIES}")
+        results["give_up"] = {"messages": len(down), "retried": stats["retried"] - before["retried"]}
+
+        mail.stop()
+
+    total = len(mixed) + len(flaky) + len(down)
+    check(stats["enqueued"] == total, f"stats: {stats['enqueued']} enqueued of {total}")
+    check(stats["queue_depth"] == 0 and stats["dropped"] == 0, f"stats: depth {stats['queue_depth']}, dropped {stats['dropped']}")
+    check(stats["avg_latency_ms"] is not None and stats["last_latency_ms"] is not None, "stats: no latency recorded")
+    check(log.getvalue().count("Failed to send") == len(refused) + len(down), "stats: failures and failure log disagree")
+    results["stats"] = stats
+
+    print(json.dumps({"workers": args.workers, "smtp_delay": args.smtp_delay, "results": results}, indent=2))
+    for p in problems:
+        print(f"FAIL {p}", file=sys.stderr)
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
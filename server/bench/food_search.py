@@ -0,0 +1,211 @@
+"""
+Food search cache tiers (app/food_search.py) against a local fake Nutritionix:
+single-flight coalescing of concurrent identical misses, memory, prefix and
+Mongo store hits, local index hits and misses (utils/food_index.py), the
+503 for callers that give up waiting on a slow call, and the 502s when the
+provider fails or can't be reached.
+
+    python bench/food_search.py [--concurrency 16] [--delay 0.2] [--repeats 500] [--mongo-uri URI]
+
+Requests go through GET /nutrition/foods/search on the Flask test client.
+Exits 1 if a check fails. Needs `pip install mongomock` unless --mongo-uri
+is given; the run then deletes its user but leaves food_search_cache
+entries for its queries.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, SERVER_DIR)
+
+from backend import use_mongomock
+from async_vs_sync import free_port
+
+FOODS = ["chicken breast", "chicken thigh", "chicken soup", "chickpeas", "cheddar cheese", "brown rice"]
+
+def start_fake_provider(port, delay, calls):
+    """Nutritionix stand-in: foods containing the query, after `delay`
+    seconds; a query starting with "fail" gets a 503, and one starting with
+    "slow" trickles its body over two seconds. Queries are appended to
+    `calls`."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            q = parse_qs(urlparse(self.path).query)["query"][0]
+            calls.append(q)
+            time.sleep(delay)
+            if q.startswith("fail"):
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            common = [{"food_name": f, "serving_qty": 100, "serving_unit": "g", "nf_calories": 150}
+                      for f in FOODS if q in f]
+            body = json.dumps({"common": common, "branded": []}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if q.startswith("slow"):
+                # every read is quick, the whole body is not
+                for i in range(len(body)):
+                    self.wfile.write(body[i:i + 1])
+                    self.wfile.flush()
+                    time.sleep(2.0 / len(body))
+                return
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--delay", type=float, default=0.2)
+    parser.add_argument("--repeats", type=int, default=500)
+    parser.add_argument("--mongo-uri")
+    args = parser.parse_args()
+
+    calls = []
+    port = free_port()
+    start_fake_provider(port, args.delay, calls)
+    os.environ.update({
+        "NUTRITIONIX_URL": f"http://127.0.0.1:{port}/",
+        "NUTRITIONIX_APP_ID": "bench", "NUTRITIONIX_API_KEY": "bench",
+        "JWT_SECRET_KEY": os.getenv("JWT_SECRET_KEY", "bench-secret-key-with-enough-bytes-32"),
+        "MONGO_URI": args.mongo_uri or "mongodb://mongomock",
+        "RATELIMIT_ENABLED": "0",
+    })
+    os.environ.pop("FOOD_INDEX_PATH", None)
+    if not args.mongo_uri:
+        use_mongomock()
+
+    from bson.objectid import ObjectId
+    from flask_jwt_extended import create_access_token
+    from app import create_app
+    from app import food_search
+    from app.mongo import collection
+    flask_app = create_app()
+    uid = ObjectId()
+    collection("users").insert_one({"_id": uid, "email": f"bench-food-{uid}@example.invalid", "token_version": 0})
+    with flask_app.app_context():
+        headers = {"Authorization": f"Bearer {create_access_token(identity=str(uid))}"}
+
+    def search(q):
+        start = time.perf_counter()
+        resp = flask_app.test_client().get("/nutrition/foods/search", query_string={"q": q}, headers=headers)
+        return resp.status_code, resp.get_json(), time.perf_counter() - start
+
+    tag = f"{int(time.time())}"  # fresh queries for a shared --mongo-uri cache
+    chick, missing = "chick", f"zz{tag}"
+    food_search.search_cache().delete_many({"_id": {"$in": [chick, "chicken so"]}})
+    results, problems = {}, []
+
+    def check(ok, message):
+        if not ok:
+            problems.append(message)
+
+    # coalescing: every concurrent miss for one query shares one provider call
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        burst = list(pool.map(search, [chick] * args.concurrency))
+    check(all(s == 200 for s, _, _ in burst), f"coalesced burst had errors: {[b for s, b, _ in burst if s != 200][:1]}")
+    check(calls.count(chick) == 1, f"{args.concurrency} concurrent misses made {calls.count(chick)} provider calls")
+    check(len({json.dumps(b.get("items")) for _, b, _ in burst}) == 1, "coalesced callers got different items")
+    results["coalesced"] = {"callers": args.concurrency, "provider_calls": calls.count(chick),
+                            "max_ms": round(max(t for _, _, t in burst) * 1000, 1)}
+
+    def repeat(q, source):
+        before = len(calls)
+        times = []
+        for _ in range(args.repeats):
+            status, body, t = search(q)
+            check(status == 200 and body.get("source") == source, f"{q!r}: {status} {body.get('source')}, expected {source}")
+            times.append(t)
+        check(len(calls) == before, f"{q!r} reached the provider")
+        times.sort()
+        return {"query": q, "source": source, "p50_ms": round(times[len(times) // 2] * 1000, 3),
+                "p99_ms": round(times[int(len(times) * 0.99)] * 1000, 3), "body": body}
+
+    # memory: normalization makes these the cached key
+    results["memory"] = repeat("  Chick ", "memory")
+    # prefix: "chick" came back complete, so "chicken so" filters it
+    results["prefix"] = repeat("chicken so", "prefix")
+    check([i["name"] for i in results["prefix"].pop("body").get("items", [])] == ["chicken soup"],
+          "prefix hit returned the wrong foods")
+    results["memory"].pop("body")
+
+    # store: a worker with an empty memory tier reads Mongo, not the provider
+    food_search._memory.clear()
+    status, body, t = search(chick)
+    check(status == 200 and body.get("source") == "store", f"after clearing memory: {status} {body.get('source')}")
+    check(calls.count(chick) == 1, "store hit reached the provider")
+    results["store"] = {"source": body.get("source"), "ms": round(t * 1000, 3)}
+
+    # a miss everywhere goes to the provider exactly once
+    status, body, _ = search(missing)
+    check(status == 200 and body.get("source") == "provider" and body["items"] == [], f"empty result: {status} {body}")
+    again = search(missing)
+    check(again[1].get("source") == "memory", f"empty result was not cached: {again[0]} {again[1]}")
+
+    # local index: hits never leave the box; a query sharing a single trigram
+    # with a food ("pjpce" and "rice" share "ce ") is a miss and falls back
+    from utils.food_index import build, FoodIndex
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "foods.ndjson"), "w") as f:
+            f.write(json.dumps({"name": "rice", "serving_qty": 100, "serving_unit": "g", "calories": 130}))
+        build(os.path.join(tmp, "foods.ndjson"), os.path.join(tmp, "index"))
+        food_search._local = FoodIndex(os.path.join(tmp, "index"))
+        check(food_search._local.search("pjpce") == [], "one shared trigram matched a food")
+        hit, junk = search("rice"), search("pjpce")
+        food_search._local = None
+    check(hit[1].get("source") == "local", f"local hit: {hit[1]}")
+    check(junk[0] == 200 and junk[1].get("source") == "provider" and "pjpce" in calls,
+          f"local miss did not fall back to the provider: {junk[1]}")
+    results["local"] = {"hit_ms": round(hit[2] * 1000, 3), "miss_source": junk[1].get("source")}
+
+    # waiters give up on a call that outlasts the provider timeout with a 503;
+    # the caller making it still gets the result
+    timeout = food_search.PROVIDER_TIMEOUT
+    food_search.PROVIDER_TIMEOUT = 0.3
+    with ThreadPoolExecutor(4) as pool:
+        slow = list(pool.map(search, [f"slow{tag}"] * 4))
+    food_search.PROVIDER_TIMEOUT = timeout
+    statuses = sorted(s for s, _, _ in slow)
+    check(statuses == [200, 503, 503, 503], f"slow call: statuses {statuses}")
+    check(all(b.get("error") == "nutrition provider busy, please retry shortly" for s, b, _ in slow if s == 503),
+          "slow call: waiters did not get the busy error")
+    results["slow"] = {"statuses": statuses, "max_ms": round(max(t for _, _, t in slow) * 1000, 1)}
+
+    # provider errors are passed on as 502 and never cached
+    failing = f"fail{tag}"
+    first, second = search(failing), search(failing)
+    check(first[0] == 502 and first[1].get("status") == 503, f"provider 503: {first[0]} {first[1]}")
+    check(second[0] == 502 and calls.count(failing) == 2, "a provider error was cached")
+
+    # unreachable: nothing listens on the provider port
+    food_search.PROVIDER_URL = f"http://127.0.0.1:{free_port()}/"
+    status, body, _ = search(f"unreachable{tag}")
+    check(status == 502 and body.get("error") == "nutrition provider unreachable", f"unreachable: {status} {body}")
+    results["errors"] = {"provider_503": first[0], "unreachable": status}
+
+    results["provider_calls"] = len(calls)
+    collection("users").delete_one({"_id": uid})
+    print(json.dumps({"delay_s": args.delay, "repeats": args.repeats,
+                      "backend": "mongod" if args.mongo_uri else "mongomock", "results": results}, indent=2))
+    for p in problems:
+        print(f"FAIL {p}", file=sys.stderr)
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
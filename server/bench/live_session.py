@@ -0,0 +1,186 @@
+"""
+Per-set cost of logging a workout: one POST /api/workouts per set vs. one
+message per set on a live session WebSocket (app/live.py), both served by
+the ASGI app under uvicorn on localhost.
+
+    python bench/live_session.py [--sets 500] [--mongo-uri mongodb://localhost:27017]
+
+Reports per-set latency (p50/p99) and bytes sent per set for:
+  - POST with a new connection per set (what a phone on a flaky network does),
+  - WebSocket `set` -> `ack`.
+Then drops a live session mid-way, resumes it, resends the unsaved sets and
+checks that every set is stored exactly once, and that unknown message types
+share one metrics label. Exits 1 if a check fails.
+
+The default backend is mongomock, which Motor can't talk to, so token
+revocation checks (Motor) are skipped there; --mongo-uri keeps them.
+POSTs over a keep-alive connection aren't measured: asgiref's WsgiToAsgi
+(3.12) fails the second request on a uvicorn keep-alive connection.
+Needs `pip install websockets mongomock`.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import http.client
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, SERVER_DIR)
+
+from backend import use_mongomock
+from async_vs_sync import free_port, wait_for
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+def post_sets(port, token, n):
+    body = json.dumps({"exercise": "squat", "reps": 5, "weight_kg": 100}).encode()
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {token}"}
+    sent_bytes = len(body) + sum(len(k) + len(v) + 4 for k, v in headers.items()) + 80  # + request line, Host, etc.
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        conn.request("POST", "/api/workouts", body, headers)
+        resp = conn.getresponse()
+        resp.read()
+        assert resp.status == 201, resp.status
+        conn.close()
+        latencies.append(time.perf_counter() - start)
+    return latencies, sent_bytes
+
+async def live_sets(port, token, seqs, session=None, end=True, weight=100):
+    import websockets
+    latencies, frame_bytes = [], 0
+    async with websockets.connect(f"ws://127.0.0.1:{port}/api/sessions/live", max_queue=None) as ws:
+        await ws.send(json.dumps({"type": "auth", "token": token, **({"session": session} if session else {})}))
+        ready = json.loads(await ws.recv())
+        events = []
+        for seq in seqs:
+            msg = json.dumps({"type": "set", "seq": seq, "exercise": "squat", "reps": 5, "weight_kg": weight + seq,
+                              "rest_sec": 0})
+            frame_bytes = len(msg) + 8  # + masked frame header
+            start = time.perf_counter()
+            await ws.send(msg)
+            while True:
+                event = json.loads(await ws.recv())
+                events.append(event)
+                if event["type"] == "ack" and event["seq"] == seq:
+                    break
+            latencies.append(time.perf_counter() - start)
+        if end:
+            await ws.send(json.dumps({"type": "end"}))
+            async for raw in ws:
+                events.append(json.loads(raw))
+    return ready, events, latencies, frame_bytes
+
+async def send_types(port, token, kinds):
+    import websockets
+    async with websockets.connect(f"ws://127.0.0.1:{port}/api/sessions/live") as ws:
+        await ws.send(json.dumps({"type": "auth", "token": token}))
+        await ws.recv()
+        for kind in kinds:
+            await ws.send(json.dumps({"type": kind}))
+            await ws.recv()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sets", type=int, default=500)
+    parser.add_argument("--mongo-uri")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    os.environ.update({
+        "MONGO_URI": args.mongo_uri or "mongodb://mongomock",
+        "JWT_SECRET_KEY": os.getenv("JWT_SECRET_KEY", "bench-secret-key-with-enough-bytes-32"),
+        "BCRYPT_LOG_ROUNDS": os.getenv("BCRYPT_LOG_ROUNDS", "4"),
+        "RATELIMIT_ENABLED": "0",
+        "LIVE_FLUSH_SETS": "50",
+    })
+    import email_validator
+    email_validator.CHECK_DELIVERABILITY = False
+    if not args.mongo_uri:
+        use_mongomock()
+
+    import logging
+    import uvicorn
+    from app.aio import create_asgi_app
+    from app.mongo import collection
+    asgi = create_asgi_app()
+    if not args.mongo_uri:
+        startup = asgi.startup
+
+        async def startup_without_motor():
+            await startup()
+            asgi.db = None
+        asgi.startup = startup_without_motor
+
+    port = free_port()
+    logging.getLogger("uvicorn.error").setLevel(logging.WARNING)
+    server = uvicorn.Server(uvicorn.Config(asgi, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    threading.Thread(target=server.run, daemon=True).start()
+    wait_for(port)
+
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    email = f"live-{os.getpid()}-{int(time.time())}@example.com"
+    conn.request("POST", "/auth/register", json.dumps({"email": email, "password": "benchpass1"}),
+                 {"Content-Type": "application/json"})
+    resp = json.loads(conn.getresponse().read())
+    token, uid = resp["access"], resp["user"]["id"]
+
+    n, results, problems = args.sets, [], []
+
+    def record(name, latencies, sent):
+        results.append({"scenario": name, "sets": len(latencies), "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+                        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3), "bytes_per_set": sent})
+        r = results[-1]
+        print(f"{name:<30} p50 {r['p50_ms']:>8.3f} ms  p99 {r['p99_ms']:>8.3f} ms  {sent:>4} B/set", file=sys.stderr)
+
+    record("POST, new connection", *post_sets(port, token, n))
+    ready, events, latencies, frame = asyncio.run(live_sets(port, token, range(1, n + 1)))
+    record("WebSocket set -> ack", latencies, frame)
+    stored = collection("workouts").count_documents({"userId": uid, "sessionId": ready["session"]})
+    summary = next((e for e in events if e["type"] == "summary"), None)
+    prs = sum(e["type"] == "pr" for e in events)
+    if stored != n or not summary or summary["sets"] != n:
+        problems.append(f"live: {stored} of {n} sets stored, summary={summary}")
+    if prs != n:  # every set beats the last, and the first beats the 100 kg POSTed above
+        problems.append(f"live: {prs} PR events for {n} heavier sets")
+
+    # drop the connection with sets still buffered, then resume and resend what wasn't saved
+    half = n // 2
+    ready, events, _, _ = asyncio.run(live_sets(port, token, range(1, half + 1), end=False, weight=1000))
+    saved = max([e["through"] for e in events if e["type"] == "saved"] or [0])
+    time.sleep(0.5)  # the server flushes what it had buffered when the socket drops
+    resumed, events, _, _ = asyncio.run(live_sets(port, token, range(resumed_from := max(saved, 0) + 1, n + 1),
+                                                  session=ready["session"], weight=1000))
+    stored = collection("workouts").count_documents({"userId": uid, "sessionId": ready["session"]})
+    dupes = sum(1 for e in events if e.get("duplicate"))
+    results.append({"scenario": "resume", "saved_before_drop": saved, "server_saved_through": resumed["saved_through"],
+                    "resent_from": resumed_from, "duplicates_skipped": dupes, "stored": stored})
+    print(f"{'resume':<30} saved {saved} before drop, server had {resumed['saved_through']}, "
+          f"{dupes} resent sets skipped, {stored}/{n} stored", file=sys.stderr)
+    if stored != n:
+        problems.append(f"resume: {stored} of {n} sets stored")
+
+    # client-chosen message types must not become metric labels
+    from app import metrics
+    junk = [f"junk-{i}" for i in range(20)]
+    asyncio.run(send_types(port, token, junk))
+    rendered = metrics.render()
+    if any(k in rendered for k in junk) or "/api/sessions/live:unknown" not in rendered:
+        problems.append("metrics: unknown live message types were not folded into one label")
+
+    server.should_exit = True
+    print(json.dumps({"sets": n, "backend": "mongod" if args.mongo_uri else "mongomock", "results": results}, indent=2),
+          file=open(args.out, "w") if args.out else sys.stdout)
+    for p in problems:
+        print(f"FAIL {p}", file=sys.stderr)
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+Load test for the API: create_app() against mongomock (default) or a local
+mongod, with local stand-ins for SMTP and Nutritionix. Requests go through
+the Flask test client, or over HTTP to a threaded dev server with --http.
+
+Scenarios: register/login bursts, workout inserts and bulk seeding, workout
+listing (first page, deep cursor pages, NDJSON export) at each --docs size,
+targets, food log + day summaries and food search (mostly repeat queries).
+
+    python bench/load.py [--docs 10000,100000,1000000] [--requests 500] [--concurrency 8]
+                         [--mongo-uri mongodb://localhost:27017] [--http] [--only list,targets]
+                         [--out results.json] [--baseline previous.json --max-regression 0.25]
+
+The default backend needs `pip install mongomock`; it keeps everything in
+memory and sorts in Python, so use --mongo-uri for the 100k/1M sizes.
+Against a real mongod the run only touches its own bench-<run>-* users and
+their documents, and deletes them at the end.
+
+Output is JSON (stdout or --out). With --baseline, the run exits 1 when any
+scenario's throughput falls, or its p99 rises, by more than --max-regression.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, SERVER_DIR)
+
+from backend import use_mongomock
+from async_vs_sync import free_port, start_fake_provider, wait_for
+
+SEED_CHUNK = 5000
+EXERCISES = ["squat", "bench", "deadlift", "overhead press", "row", "pull up", "lunge", "curl"]
+HOT_FOODS = ["chicken breast", "rice", "egg", "oats", "banana", "greek yogurt", "salmon", "broccoli"]
+
+# ---- stand-ins -----------------------------------------------------------
+def start_fake_smtp(port, received=None, delay=0.0, reject=None, connections=None):
+    """Accepts AUTH PLAIN and any message; no TLS (run with SMTP_STARTTLS=0).
+    Recipients of accepted messages are appended to `received` if given, and
+    each message takes `delay` seconds to accept, like a real relay.
+    `reject(cmd, recipients)` may return a reply line to send instead of the
+    OK for RCPT or the end of DATA; each new connection appends to
+    `connections` if given."""
+    async def handle(reader, writer):
+        reply = lambda line: writer.write(line.encode() + b"\r\n")
+        if connections is not None:
+            connections.append(writer.get_extra_info("peername"))
+        reply("220 bench ESMTP")
+        rcpts = []
+        refused = lambda cmd: reject and reject(cmd, rcpts)
+        try:
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                cmd = line.split(" ", 1)[0].upper()
+                if cmd in ("EHLO", "HELO"):
+                    reply("250-bench")
+                    reply("250 AUTH PLAIN LOGIN")
+                elif cmd == "AUTH":
+                    reply("235 2.7.0 Authentication successful")
+                elif cmd in ("MAIL", "RSET"):
+                    rcpts.clear()
+                    reply("250 2.1.0 Ok")
+                elif cmd == "RCPT":
+                    rcpts.append(line.split(":", 1)[1].strip(" <>"))
+                    error = refused("RCPT")
+                    if error:
+                        rcpts.pop()
+                    reply(error or "250 2.1.5 Ok")
+                elif cmd == "DATA":
+                    reply("354 End data with <CR><LF>.<CR><LF>")
+                    await writer.drain()
+                    await reader.readuntil(b"\r\n.\r\n")
+                    if delay:
+                        await asyncio.sleep(delay)
+                    error = refused("DATA")
+                    if received is not None and not error:
+                        received.extend(rcpts)
+                    rcpts.clear()
+                    reply(error or "250 2.0.0 Ok: queued")
+                elif cmd == "QUIT":
+                    reply("221 2.0.0 Bye")
+                    await writer.drain()
+                    break
+                else:
+                    reply("250 2.0.0 Ok")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(asyncio.start_server(handle, "127.0.0.1", port))
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+
+# ---- clients -------------------------------------------------------------
+class InProcessClient:
+    def __init__(self, app):
+        self._app = app
+        self._local = threading.local()
+
+    def request(self, method, path, token=None, json_body=None, params=None, raw=None, content_type=None):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self._app.test_client()
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        r = client.open(path, method=method, json=json_body, query_string=params, headers=headers,
+                        data=raw, content_type=content_type)
+        return r.status_code, (r.get_json(silent=True) if r.is_json else r.get_data())
+
+class HTTPClient:
+    def __init__(self, base_url):
+        self._base = base_url
+        self._local = threading.local()
+
+    def request(self, method, path, token=None, json_body=None, params=None, raw=None, content_type=None):
+        import requests
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        if content_type:
+            headers["Content-Type"] = content_type
+        r = session.request(method, self._base + path, json=json_body, params=params, data=raw, headers=headers)
+        is_json = r.headers.get("Content-Type", "").startswith("application/json")
+        return r.status_code, (r.json() if is_json else r.content)
+
+def serve_http(app):
+    import logging
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # no access log
+    port = free_port()
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    wait_for(port)
+    return f"http://127.0.0.1:{port}"
+
+# ---- measurement ---------------------------------------------------------
+def measure(name, fn, total, concurrency, **labels):
+    """Run fn(i) for i in range(total) on `concurrency` threads; fn returns True on success."""
+    def one(i):
+        start = time.perf_counter()
+        try:
+            ok = fn(i)
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        samples = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(s for s, _ in samples)
+    pct = lambda p: round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2)
+    result = {
+        "scenario": name, **labels, "requests": total, "errors": sum(1 for _, ok in samples if not ok),
+        "seconds": round(elapsed, 3), "rps": round(total / elapsed, 1),
+        "p50_ms": pct(0.50), "p90_ms": pct(0.90), "p99_ms": pct(0.99), "max_ms": round(latencies[-1] * 1000, 2),
+    }
+    print(f"  {name:<22} {json.dumps(labels) if labels else '':<16} {result['rps']:>9} rps  "
+          f"p50 {result['p50_ms']:>8} ms  p99 {result['p99_ms']:>8} ms  errors {result['errors']}", file=sys.stderr)
+    return result
+
+def random_workout(rng, now):
+    return {
+        "exercise": rng.choice(EXERCISES),
+        "sets": rng.randint(1, 5),
+        "reps": rng.randint(1, 12),
+        "weight_kg": round(rng.uniform(20, 200), 1),
+        "performedAt": now - rng.randint(0, 3 * 365 * 86400),
+    }
+
+def compare(results, baseline_path, max_regression):
+    """Lines describing scenarios that regressed against a previous run."""
+    with open(baseline_path) as f:
+        baseline = {(r["scenario"], r.get("docs")): r for r in json.load(f)["results"]}
+    problems = []
+    for r in results:
+        base = baseline.get((r["scenario"], r.get("docs")))
+        if not base:
+            continue
+        if r["rps"] < base["rps"] * (1 - max_regression):
+            problems.append(f"{r['scenario']} docs={r.get('docs')}: rps {base['rps']} -> {r['rps']}")
+        if r["p99_ms"] > base["p99_ms"] * (1 + max_regression):
+            problems.append(f"{r['scenario']} docs={r.get('docs')}: p99 {base['p99_ms']} -> {r['p99_ms']} ms")
+    return problems
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=SERVER_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# ---- main ----------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", default="10000", help="comma-separated workout counts to list at")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=50, help="accounts created by the register burst")
+    parser.add_argument("--mongo-uri", help="real MongoDB instead of mongomock")
+    parser.add_argument("--http", action="store_true", help="go through a threaded HTTP server")
+    parser.add_argument("--only", help="comma-separated scenario name prefixes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out")
+    parser.add_argument("--baseline")
+    parser.add_argument("--max-regression", type=float, default=0.25)
+    args = parser.parse_args()
+    sizes = sorted(int(float(s.lower().replace("k", "e3").replace("m", "e6"))) for s in args.docs.split(","))
+    wanted = lambda name: not args.only or any(name.startswith(p) for p in args.only.split(","))
+    rng = random.Random(args.seed)
+    run_id = f"{int(time.time())}{os.getpid()}"
+
+    smtp_port, provider_port = free_port(), free_port()
+    start_fake_smtp(smtp_port)
+    start_fake_provider(provider_port, 0.02)
+    os.environ.update({
+        "SMTP_HOST": "127.0.0.1", "SMTP_PORT": str(smtp_port), "SMTP_STARTTLS": "0",
+        "SMTP_USER": "bench", "SMTP_PASSWORD": "bench", "FROM_EMAIL": "bench@localhost",
+        "NUTRITIONIX_URL": f"http://127.0.0.1:{provider_port}/",
+        "NUTRITIONIX_APP_ID": "bench", "NUTRITIONIX_API_KEY": "bench",
+        "JWT_SECRET_KEY": os.getenv("JWT_SECRET_KEY", "bench-secret-key-with-enough-bytes-32"),
+        "BCRYPT_LOG_ROUNDS": os.getenv("BCRYPT_LOG_ROUNDS", "10"),
+        "MONGO_URI": args.mongo_uri or "mongodb://mongomock",
+        "RATELIMIT_ENABLED": "0",  # every request comes from one IP
+    })
+    os.environ.pop("FOOD_INDEX_PATH", None)
+
+    # no DNS lookups for the synthetic addresses
+    import email_validator
+    email_validator.CHECK_DELIVERABILITY = False
+
+    if not args.mongo_uri:
+        use_mongomock()
+
+    from app import create_app
+    from app.mongo import collection
+    flask_app = create_app()
+    client = HTTPClient(serve_http(flask_app)) if args.http else InProcessClient(flask_app)
+    call = client.request
+    n, c = args.requests, args.concurrency
+    results = []
+    print(f"load test: backend={'mongod' if args.mongo_uri else 'mongomock'} "
+          f"transport={'http' if args.http else 'in-process'} requests={n} concurrency={c}", file=sys.stderr)
+
+    # accounts: a register burst, then logins against them
+    email = lambda i: f"bench-{run_id}-{i}@loadtest.dev"
+    tokens = {}
+
+    def register(i):
+        status, body = call("POST", "/auth/register", json_body={"email": email(i), "password": "benchpass1"})
+        if status == 201:
+            tokens[i] = body["access"]
+        return status == 201
+
+    results.append(measure("auth_register", register, args.users, c))
+    if not tokens:
+        sys.exit("registration failed; nothing else can run")
+    ids = sorted(tokens)
+    if wanted("auth_login"):
+        results.append(measure("auth_login", lambda i: call(
+            "POST", "/auth/login", json_body={"email": email(ids[i % len(ids)]), "password": "benchpass1"})[0] == 200, n, c))
+
+    profile = {"sex": "male", "age": 30, "height_cm": 180, "weight_kg": 80, "activity_level": "moderate"}
+    for i in ids:
+        call("PATCH", "/auth/me", token=tokens[i], json_body=profile)
+    user_token = lambda i: tokens[ids[i % len(ids)]]
+
+    if wanted("targets"):
+        results.append(measure("targets", lambda i: call(
+            "POST", "/nutrition/nutrition/targets", token=user_token(i),
+            json_body={"weight_kg": 60 + i % 40, "goal": ("cut", "maintain", "bulk")[i % 3]})[0] == 200, n, c))
+    if wanted("food_log"):
+        results.append(measure("food_log_add", lambda i: call(
+            "POST", "/planner/planner/log", token=user_token(i),
+            json_body={"name": "egg", "servings": 2, "calories": 70, "protein_g": 6, "fat_g": 5})[0] == 201, n, c))
+    if wanted("day_summary"):
+        results.append(measure("day_summary_stored", lambda i: call(
+            "GET", "/planner/planner/log/summary", token=user_token(i))[0] == 200, n, c))
+        items = [{"name": f, "servings": 1, "calories": 150, "protein_g": 10, "carbs_g": 15, "fat_g": 5} for f in HOT_FOODS]
+        results.append(measure("day_summary_posted", lambda i: call(
+            "POST", "/planner/planner/day-summary", token=user_token(i), json_body={"items": items})[0] == 200, n, c))
+    if wanted("foods_search"):
+        # mostly repeat queries (cache hits), one in five new (provider round trip)
+        queries = [rng.choice(HOT_FOODS) if rng.random() < 0.8 else f"food {run_id} {i}" for i in range(n)]
+        results.append(measure("foods_search", lambda i: call(
+            "GET", "/nutrition/foods/search", token=user_token(i), params={"q": queries[i]})[0] == 200, n, c))
+    if wanted("workout_insert"):
+        now = int(time.time())
+        results.append(measure("workout_insert", lambda i: call(
+            "POST", "/api/workouts", token=user_token(i), json_body=random_workout(random.Random(i), now))[0] == 201, n, c))
+
+    # one user's history grows through each size; listing is measured at each
+    lister = user_token(len(ids) - 1)
+    seeded, now = 0, int(time.time())
+    for size in sizes if wanted("workouts") else []:
+        chunks = []
+        while seeded < size:
+            count = min(SEED_CHUNK, size - seeded)
+            chunks.append("\n".join(json.dumps(random_workout(rng, now)) for _ in range(count)))
+            seeded += count
+        if chunks:
+            results.append(measure("workouts_bulk_seed", lambda i: call(
+                "POST", "/api/workouts/bulk", token=lister, raw=chunks[i],
+                content_type="application/x-ndjson")[0] == 200, len(chunks), 1, docs=size))
+
+        cursors, cursor = [], None
+        for _ in range(20):
+            status, body = call("GET", "/api/workouts", token=lister, params={"limit": 500, **({"cursor": cursor} if cursor else {})})
+            cursor = body.get("next") if status == 200 else None
+            if not cursor:
+                break
+            cursors.append(cursor)
+
+        results.append(measure("workouts_list_first", lambda i: call(
+            "GET", "/api/workouts", token=lister, params={"limit": 50})[0] == 200, n, c, docs=size))
+        if cursors:
+            results.append(measure("workouts_list_deep", lambda i: call(
+                "GET", "/api/workouts", token=lister, params={"limit": 50, "cursor": cursors[i % len(cursors)]})[0] == 200,
+                n, c, docs=size))
+        results.append(measure("workouts_export_ndjson", lambda i: call(
+            "GET", "/api/workouts", token=lister, params={"format": "ndjson", "limit": 1000})[0] == 200,
+            max(1, n // 10), c, docs=size))
+
+    if args.mongo_uri:
+        from bson.objectid import ObjectId
+        users = collection("users")
+        uids = [str(u["_id"]) for u in users.find({"email": {"$regex": f"^bench-{run_id}-"}}, {"_id": 1})]
+        for name in ("workouts", "profiles", "food_log", "food_log_days", "workout_rollups"):
+            collection(name).delete_many({"userId": {"$in": uids}})
+        users.delete_many({"_id": {"$in": [ObjectId(u) for u in uids]}})
+
+    report = {
+        "meta": {
+            "commit": git_commit(), "python": platform.python_version(), "cpus": os.cpu_count(),
+            "backend": "mongod" if args.mongo_uri else "mongomock", "transport": "http" if args.http else "in-process",
+            "requests": n, "concurrency": c, "docs": sizes, "timestamp": int(time.time()),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        problems = compare(results, args.baseline, args.max_regression)
+        for p in problems:
+            print(f"REGRESSION {p}", file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Bulk mail campaign benchmark (app/campaigns.py) against mongomock and a
+local SMTP sink that records every recipient and takes --smtp-delay seconds
+to accept each message.
+
+    python bench/mail_campaign.py [--users 2000] [--sessions 1,4,8] [--smtp-delay 0.02] [--out r.json]
+
+Measures messages/second for:
+  - one SMTP connection per message (emailer.send_email), the old way to mail
+    a list of users;
+  - `verify` campaigns at each --sessions count;
+  - a `verify` campaign stopped after two pages and resumed, checking that
+    every user got mail and that only the page in flight was sent twice;
+  - a `digest` campaign, which also reads rollups and food logs per page.
+
+Needs `pip install mongomock`. Exits 1 if a check fails.
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import contextlib
+from collections import Counter
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, SERVER_DIR)
+
+from backend import use_mongomock
+from async_vs_sync import free_port
+from load import start_fake_smtp
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--sessions", default="1,4,8")
+    parser.add_argument("--page", type=int, default=250)
+    parser.add_argument("--smtp-delay", type=float, default=0.02)
+    parser.add_argument("--baseline-messages", type=int, default=200)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    if args.users < 4 * args.page:
+        parser.error("--users must be at least 4 x --page (half the users are unverified)")
+
+    received = []
+    port = free_port()
+    start_fake_smtp(port, received, args.smtp_delay)
+    os.environ.update({
+        "SMTP_HOST": "127.0.0.1", "SMTP_PORT": str(port), "SMTP_STARTTLS": "0",
+        "SMTP_USER": "bench", "SMTP_PASSWORD": "bench", "FROM_EMAIL": "bench@localhost",
+        "MONGO_URI": "mongodb://mongomock",
+    })
+
+    use_mongomock()
+
+    from app import campaigns
+    from app.emailer import send_email, VERIFY_EMAIL
+    from app.analytics import record_workouts
+    from app.mongo import collection
+
+    rng = random.Random(1)
+    now = time.time()
+    users = [{"email": f"user{i}@bench.test", "name": f"User <{i}>", "emailVerified": i % 2 == 1} for i in range(args.users)]
+    collection("users").insert_many(users)
+    record_workouts([{"userId": str(u["_id"]), "exercise": rng.choice(["squat", "bench", "row"]), "sets": 3,
+                      "reps": 5, "weight_kg": rng.randint(40, 140), "performedAt": now - 7 * 86400}
+                     for u in users if u["emailVerified"] for _ in range(3)])
+    unverified = {u["email"] for u in users if not u["emailVerified"]}
+    results, problems = [], []
+    quiet = lambda *a, **kw: None
+
+    def record(scenario, messages, seconds, **extra):
+        results.append({"scenario": scenario, "messages": messages, "seconds": round(seconds, 3),
+                        "msg_per_s": round(messages / seconds, 1), **extra})
+        print(f"{scenario:<28} {messages:>6} msgs {messages / seconds:>9.1f} msg/s", file=sys.stderr)
+
+    # one connection per message
+    sample = sorted(unverified)[:args.baseline_messages]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for to in sample:
+            send_email(to, *VERIFY_EMAIL.render(code="123456"))
+    record("send_email (connection/msg)", len(sample), time.perf_counter() - start)
+
+    for sessions in [int(s) for s in args.sessions.split(",")]:
+        received.clear()
+        start = time.perf_counter()
+        state = campaigns.run("verify", f"bench-s{sessions}", sessions=sessions, page_size=args.page, log=quiet)
+        record(f"verify campaign sessions={sessions}", state["sent"], time.perf_counter() - start, sessions=sessions)
+        if set(received) != unverified or len(received) != len(unverified):
+            problems.append(f"sessions={sessions}: {len(received)} delivered to {len(set(received))} of {len(unverified)}")
+
+    # stop after two pages, then resume
+    received.clear()
+    paused = campaigns.run("verify", "bench-resume", sessions=4, page_size=args.page, max_pages=2, log=quiet)
+    # pretend the second page was in flight when the process died: roll its checkpoint back
+    in_flight = min(args.page, len(unverified) - args.page)
+    first_page_end = sorted(u["_id"] for u in users if not u["emailVerified"])[args.page - 1]
+    collection("mail_campaigns").update_one({"_id": "bench-resume"},
+                                            {"$set": {"lastId": first_page_end}, "$inc": {"sent": -in_flight}})
+    done = campaigns.run("verify", "bench-resume", sessions=4, page_size=args.page, log=quiet)
+    dupes = sum(n - 1 for n in Counter(received).values())
+    results.append({"scenario": "verify resume", "paused_sent": paused["sent"], "sent": done["sent"],
+                    "status": done["status"], "duplicates": dupes})
+    print(f"{'verify resume':<28} {done['status']}, {dupes} sent twice", file=sys.stderr)
+    if set(received) != unverified or dupes != in_flight or done["sent"] != len(unverified):
+        problems.append(f"resume: {len(set(received))} of {len(unverified)} reached, {dupes} duplicates, sent={done['sent']}")
+    again = campaigns.run("verify", "bench-resume", log=quiet)
+    if again["sent"] != done["sent"]:
+        problems.append("finished campaign ran again")
+
+    received.clear()
+    start = time.perf_counter()
+    state = campaigns.run("digest", "bench-digest", sessions=4, page_size=args.page, log=quiet)
+    record("digest campaign sessions=4", state["sent"], time.perf_counter() - start, sessions=4)
+
+    print(json.dumps({"users": args.users, "smtp_delay": args.smtp_delay, "results": results}, indent=2),
+          file=open(args.out, "w") if args.out else sys.stdout)
+    for p in problems:
+        print(f"FAIL {p}", file=sys.stderr)
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Cold start of a worker: time to import the app and run create_app(), with
+an -X importtime summary of where the import time goes.
+
+    python bench/startup.py [--runs 5] [--budget-ms 500] [--top 15] [--mongo-uri URI]
+
+Each run is a fresh interpreter. By default MONGO_URI points at a port with
+nothing listening, so a create_app() that waited on Mongo would blow the
+budget; with --mongo-uri the time until GET /api/health/ready would pass is
+reported as well. Exits 1 when the median import + create_app() time is over
+--budget-ms (STARTUP_BUDGET_MS) or when create_app() loaded a module that is
+meant to be imported on first use (DEFERRED).
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# imported by the routes that need them, never at startup
+DEFERRED = ("requests", "pyarrow", "email_validator", "numpy", "smtplib", "bcrypt", "multiprocessing")
+
+CHILD = """
+import sys, json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+loaded = [m for m in {deferred!r} if m in sys.modules]
+from app.startup import readiness
+ready = readiness.wait({wait})
+print("STARTUP " + json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "ready_ms": (time.perf_counter() - start) * 1000 if ready else None,
+    "deferred_loaded": loaded,
+}}))
+"""
+
+def run_once(env, wait):
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD.format(deferred=DEFERRED, wait=wait)],
+                          cwd=SERVER_DIR, env=env, capture_output=True, text=True, timeout=120)
+    line = next((l for l in proc.stdout.splitlines() if l.startswith("STARTUP ")), None)
+    if line is None:
+        raise RuntimeError(f"startup run failed:\n{proc.stdout}\n{proc.stderr}")
+    result = json.loads(line[len("STARTUP "):])
+    # "import time: self [us] | cumulative | imported package", indented by depth
+    by_package = defaultdict(float)
+    for row in proc.stderr.splitlines():
+        if not row.startswith("import time:") or "self [us]" in row:
+            continue
+        self_us, _, name = row[len("import time:"):].split("|")
+        by_package[name.strip().split(".")[0]] += int(self_us) / 1000
+    result["by_package"] = by_package
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "500")))
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--mongo-uri")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    env = {**os.environ, "MONGO_URI": args.mongo_uri or "mongodb://127.0.0.1:9"}
+    runs = [run_once(env, wait=15 if args.mongo_uri else 0) for _ in range(args.runs)]
+
+    median = lambda key: round(statistics.median(r[key] for r in runs), 1)
+    startup = [r["import_ms"] + r["create_app_ms"] for r in runs]
+    packages = defaultdict(float)
+    for r in runs:
+        for name, ms in r["by_package"].items():
+            packages[name] += ms / len(runs)
+    top = sorted(packages.items(), key=lambda kv: -kv[1])[:args.top]
+    ready = [r["ready_ms"] for r in runs if r["ready_ms"] is not None]
+    loaded = sorted({m for r in runs for m in r["deferred_loaded"]})
+    report = {
+        "runs": args.runs,
+        "import_ms": median("import_ms"),
+        "create_app_ms": median("create_app_ms"),
+        "startup_ms": round(statistics.median(startup), 1),
+        "startup_max_ms": round(max(startup), 1),
+        "ready_ms": round(statistics.median(ready), 1) if ready else None,
+        "budget_ms": args.budget_ms,
+        "deferred_loaded": loaded,
+        "import_self_ms_by_package": {name: round(ms, 1) for name, ms in top},
+    }
+
+    print(f"import app      {report['import_ms']:>8.1f} ms", file=sys.stderr)
+    print(f"create_app()    {report['create_app_ms']:>8.1f} ms", file=sys.stderr)
+    print(f"total (median)  {report['startup_ms']:>8.1f} ms  (max {report['startup_max_ms']}, budget {args.budget_ms:g})",
+          file=sys.stderr)
+    if args.mongo_uri:
+        print(f"ready           {report['ready_ms'] or float('nan'):>8.1f} ms", file=sys.stderr)
+    print("import time by package (self, mean per run):", file=sys.stderr)
+    for name, ms in top:
+        print(f"  {name:<24}{ms:>8.1f} ms", file=sys.stderr)
+    print(json.dumps(report, indent=2), file=open(args.out, "w") if args.out else sys.stdout)
+
+    problems = []
+    if report["startup_ms"] > args.budget_ms:
+        problems.append(f"startup {report['startup_ms']} ms is over the {args.budget_ms:g} ms budget")
+    if loaded:
+        problems.append(f"create_app() imported {', '.join(loaded)}, which should load on first use")
+    if args.mongo_uri and len(ready) < len(runs):
+        problems.append(f"{len(runs) - len(ready)} of {len(runs)} runs never became ready")
+    for p in problems:
+        print(f"FAIL {p}", file=sys.stderr)
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
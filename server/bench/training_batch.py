@@ -0,0 +1,92 @@
+"""
+Training-state recompute for every user: folding each workout in turn (the
+incremental path) vs. the vectorized batch, plus recommendations for all
+exercises, over synthetic histories.
+
+    python bench/training_batch.py [n_users] [workouts_per_user]
+
+The batch is what `python -m app.training rebuild` runs after reading the
+workouts; "rows" times turning workout documents into its columns.
+"""
+import os
+import sys
+import time
+import random
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from utils.calc import TRAINING_FIELDS, fold_training, training_states_batch, recommend_next
+from app.training import workout_row
+
+EXERCISES = ["squat", "bench", "deadlift", "press", "row", "pullup", "curl", "run"]
+
+def synthetic_workouts(n_users, per_user, seed=42):
+    # each user's history ends in the last few days, as for active users
+    rnd = random.Random(seed)
+    docs = []
+    for u in range(n_users):
+        uid, t = f"user{u}", 0.0
+        lifts = rnd.sample(EXERCISES, 4)
+        base = {e: rnd.uniform(20, 120) for e in lifts}
+        first = len(docs)
+        while len(docs) < (u + 1) * per_user:
+            t += rnd.choice([1, 2, 2, 3, 7]) * 86400
+            for e in lifts:
+                base[e] *= rnd.uniform(0.99, 1.02)
+                for _ in range(rnd.randint(1, 3)):
+                    docs.append({"userId": uid, "exercise": e, "performedAt": t + rnd.random() * 3600,
+                                 "sets": rnd.randint(1, 5), "reps": rnd.choice([3, 5, 5, 8, 10]),
+                                 "weight_kg": 0 if e == "run" else round(base[e] / 2.5) * 2.5})
+        del docs[(u + 1) * per_user:]
+        shift = time.time() - rnd.uniform(1, 4) * 86400 - docs[-1]["performedAt"]
+        for doc in docs[first:]:
+            doc["performedAt"] += shift
+    return docs
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def to_columns(docs):
+    keys, group, columns = {}, [], [[] for _ in range(4)]
+    for doc in docs:
+        row = workout_row(doc)
+        group.append(keys.setdefault((row[0], row[1]), len(keys)))
+        for column, value in zip(columns, row[2:]):
+            column.append(value)
+    return keys, group, columns
+
+def fold_all(keys, group, columns):
+    states = [None] * len(keys)
+    for g, ts, weight, reps, sets in sorted(zip(group, *columns), key=lambda r: r[1]):
+        states[g] = fold_training(states[g], int(ts // 86400), weight, reps, sets)
+    return states
+
+if __name__ == "__main__":
+    n_users = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 150
+    docs = synthetic_workouts(n_users, per_user)
+    n = len(docs)
+
+    (keys, group, columns), t_rows = timed(to_columns, docs)
+    built, t_batch = timed(training_states_batch, group, *columns, len(keys))
+    today = int(time.time() // 86400)
+    rec, t_rec = timed(recommend_next, built, today)
+
+    sample = max(1, len(keys) // 20)  # the scalar fold is slow; time a slice of users
+    mask = np.asarray(group) < sample
+    sub_columns = [np.asarray(c)[mask].tolist() for c in columns]
+    folded, t_fold = timed(fold_all, dict(list(keys.items())[:sample]), np.asarray(group)[mask].tolist(), sub_columns)
+    t_fold_all = t_fold * n / max(int(mask.sum()), 1)
+    for g, state in enumerate(folded):
+        for k in TRAINING_FIELDS:
+            assert np.isclose(state[k], built[k][g], rtol=1e-9, atol=1e-6), f"batch differs from fold: {k} of group {g}"
+
+    actions = {str(a): int(c) for a, c in zip(*np.unique(rec["action"], return_counts=True))}
+    print(f"users: {n_users}  workouts: {n:,}  exercise states: {len(keys):,}")
+    print(f"rows from documents: {t_rows:.3f}s  ({n / t_rows:,.0f} workouts/s)")
+    print(f"fold one at a time:  {t_fold_all:.3f}s  (estimated from {sample} users; {n / t_fold_all:,.0f} workouts/s)")
+    print(f"vectorized batch:    {t_batch:.3f}s  ({n / t_batch:,.0f} workouts/s)")
+    print(f"recommendations:     {t_rec:.3f}s  ({len(keys) / t_rec:,.0f} exercises/s)  {actions}")
+    print(f"speedup:             {t_fold_all / t_batch:.1f}x")
@@ -1,3 +1,8 @@
+import math
+
+# numpy is imported by the functions that use it, so the scalar helpers
+# (every targets request) don't load it at startup.
+
 def mifflin_bmr(sex: str, age: float, height_cm: float, weight_kg: float) -> float:
     # sex: "male"/"female"; height in cm, weight in kg
     s = 5 if (sex or "").lower().startswith("m") else -161
@@ -63,3 +68,352 @@ def macro_targets(calories: float, weight_kg: float, goal: str, protein_g_per_kg
         "fat_g": round(fat_g),
         "carbs_g": round(carbs_g)
     }
+
+# ---- Batch (vectorized) versions -------------------------------------------
+# Same formulas as above over NumPy arrays, for nightly recomputes and
+# scenario sweeps. Results match the scalar functions element for element.
+
+def _per_item(values, n, fn, dtype):
+    # categorical string columns: classify each distinct value once
+    import numpy as np
+    if isinstance(values, str) or values is None:
+        return np.full(n, fn(values), dtype=dtype)
+    memo = {}
+    return np.fromiter((memo[v] if v in memo else memo.setdefault(v, fn(v)) for v in values), dtype=dtype, count=n)
+
+def _floats(values, n):
+    # None -> NaN so "not provided" survives the conversion
+    import numpy as np
+    return np.broadcast_to(np.asarray(values, dtype=np.float64), (n,))
+
+def activity_factor_batch(levels, n):
+    import numpy as np
+    return _per_item(levels, n, activity_factor, np.float64)
+
+def tdee_batch(sex, age, height_cm, weight_kg, activity, body_fat_percent=None):
+    import numpy as np
+    age, height_cm, weight_kg = np.asarray(age, float), np.asarray(height_cm, float), np.asarray(weight_kg, float)
+    n = len(weight_kg)
+    male = _per_item(sex, n, lambda s: (s or "").lower().startswith("m"), bool)
+    mifflin = 10*weight_kg + 6.25*height_cm - 5*age + np.where(male, 5, -161)
+
+    bf = _floats(body_fat_percent, n)
+    katch = 370 + 21.6 * (weight_kg * (1 - np.nan_to_num(bf)/100.0))
+    bmr = np.where(np.isnan(bf), mifflin, katch)
+    return bmr * activity_factor_batch(activity, n)
+
+# 1 = cut/lose, 2 = bulk/gain, 0 = maintain
+def _goal_kind(goal, lower=True):
+    g = (goal or "maintain")
+    g = g.lower() if lower else g
+    return 1 if g.startswith(("cut", "lose")) else 2 if g.startswith(("bulk", "gain")) else 0
+
+def goal_calories_batch(tdee_kcal, goal, pace_lbs_per_week=0.0):
+    import numpy as np
+    tdee_kcal = np.asarray(tdee_kcal, float)
+    n = len(tdee_kcal)
+    adj = 500.0 * np.abs(np.nan_to_num(_floats(pace_lbs_per_week, n)))
+    kind = _per_item(goal, n, _goal_kind, np.int8)
+    return np.where(kind == 1, np.maximum(1200, tdee_kcal - adj), np.where(kind == 2, tdee_kcal + adj, tdee_kcal))
+
+def macro_targets_batch(calories, weight_kg, goal, protein_g_per_kg=None):
+    import numpy as np
+    calories, weight_kg = np.asarray(calories, float), np.asarray(weight_kg, float)
+    n = len(calories)
+    if protein_g_per_kg is None:
+        # macro_targets matches the goal prefix case-sensitively
+        cut = _per_item(goal, n, lambda g: _goal_kind(g, lower=False) == 1, bool)
+        protein_g_per_kg = np.where(cut, 2.0, 1.8)
+
+    protein_g = protein_g_per_kg * weight_kg
+    fat_kcal = calories * 0.25
+    carbs_kcal = np.maximum(0.0, calories - protein_g * 4 - fat_kcal)
+
+    # np.rint rounds half to even, like round()
+    return {
+        "calories": np.rint(calories).astype(np.int64),
+        "protein_g": np.rint(protein_g).astype(np.int64),
+        "fat_g": np.rint(fat_kcal / 9.0).astype(np.int64),
+        "carbs_g": np.rint(carbs_kcal / 4.0).astype(np.int64)
+    }
+
+def targets_batch(columns: dict) -> dict:
+    """
+    Columnar targets for many profiles. `columns` maps field name to a list
+    (sex, age, height_cm, weight_kg, activity_level, body_fat_percent, goal,
+    pace_lbs_per_week); returns lists for tdee_kcal and each macro.
+    """
+    import numpy as np
+    n = len(columns["weight_kg"])
+    goal = columns.get("goal")
+    td = tdee_batch(columns["sex"], columns["age"], columns["height_cm"], columns["weight_kg"],
+                    columns.get("activity_level"), columns.get("body_fat_percent"))
+    pace = columns.get("pace_lbs_per_week")
+    cals = goal_calories_batch(td, goal, 0.0 if pace is None else pace)
+    # the goal is lower-cased before choosing protein, as in nutrition.targets
+    cut = _per_item(goal, n, lambda g: _goal_kind(g) == 1, bool)
+    macros = macro_targets_batch(cals, columns["weight_kg"], goal, np.where(cut, 2.0, 1.8))
+    out = {"tdee_kcal": np.rint(td).astype(np.int64).tolist()}
+    out.update({k: v.tolist() for k, v in macros.items()})
+    return out
+
+# ---- Serving solver ----------------------------------------------------------
+# Servings of candidate foods whose macros best match a target, in the
+# least-squares sense with each macro scaled by its target (so 10 kcal and
+# 10 g of fat don't count the same). Servings are >= 0 and <= an optional
+# per-food cap.
+
+def nnls(A, b, max_iter=None):
+    """Lawson-Hanson non-negative least squares: argmin ||Ax - b|| subject to x >= 0."""
+    import numpy as np
+    m, n = A.shape
+    x = np.zeros(n)
+    passive = np.zeros(n, dtype=bool)
+    tol = 10 * np.finfo(float).eps * np.abs(A).sum(axis=0).max(initial=0) * max(m, n)
+    w = A.T @ (b - A @ x)
+    for _ in range(max_iter or 3 * n):
+        if passive.all() or w[~passive].max() <= tol:
+            break
+        passive[np.argmax(np.where(passive, -np.inf, w))] = True
+        while True:
+            z = np.zeros(n)
+            z[passive] = np.linalg.lstsq(A[:, passive], b, rcond=None)[0]
+            if (z[passive] > tol).all():
+                break
+            # step back to the boundary and drop the variables that hit zero
+            neg = passive & (z <= tol)
+            alpha = np.min(x[neg] / (x[neg] - z[neg]))
+            x = x + alpha * (z - x)
+            passive &= x > tol
+        x = z
+        w = A.T @ (b - A @ x)
+    return x
+
+def _bounded_nnls(A, b, upper):
+    # cap the largest violators at their bound and re-solve for the rest
+    import numpy as np
+    x = np.zeros(A.shape[1])
+    free = np.ones(A.shape[1], dtype=bool)
+    for _ in range(A.shape[1]):
+        x[free] = nnls(A[:, free], b - A[:, ~free] @ x[~free])
+        over = free & (x > upper)
+        if not over.any():
+            break
+        x[over] = upper[over]
+        free &= ~over
+    return x
+
+def solve_servings(food_macros, targets, max_servings=None):
+    """
+    food_macros: (foods, macros) per serving; targets: (days, macros).
+    Returns (days, foods) servings. All days are first solved at once as
+    one unconstrained least-squares problem; only days whose solution falls
+    outside [0, max_servings] are re-solved with the bounded NNLS.
+    """
+    import numpy as np
+    food_macros = np.asarray(food_macros, dtype=np.float64)
+    targets = np.atleast_2d(np.asarray(targets, dtype=np.float64))
+    upper = np.full(food_macros.shape[0], np.inf) if max_servings is None else np.asarray(max_servings, dtype=np.float64)
+
+    scale = np.maximum(targets.mean(axis=0), 1.0)
+    A = food_macros.T / scale[:, None]           # (macros, foods)
+    B = targets.T / scale[:, None]               # (macros, days)
+    X = np.linalg.lstsq(A, B, rcond=None)[0].T   # (days, foods), minimum-norm
+    bad = ((X < 0) | (X > upper)).any(axis=1)
+    for d in np.flatnonzero(bad):
+        X[d] = _bounded_nnls(A, B[:, d], upper)
+    return X
+
+# ---- Training load and progression --------------------------------------------
+# Per-exercise state, folded forward one workout at a time so a new workout
+# updates it in O(1) instead of rescanning history. Days are whole UTC days
+# since the epoch; state values are as of the last session day ("day").
+#   acute, chronic    exponentially weighted daily volume load (kg), time
+#                     constants ACUTE_DAYS / CHRONIC_DAYS; their ratio (ACWR)
+#                     climbs when load rises faster than the lifter adapts
+#   n, st, stt, sy, sty  exponentially weighted least-squares sums of each
+#                     session's best e1RM against its day (relative to "day"),
+#                     giving the current e1RM level and its trend
+#   best, top_*       best e1RM of the last session, and the last weighted
+#                     session's top set
+# training_states_batch() builds the same states for many exercises at once.
+
+ACUTE_DAYS = 7.0
+CHRONIC_DAYS = 28.0
+TREND_DAYS = 42.0
+TRAINING_FIELDS = ("day", "first_day", "sessions", "acute", "chronic", "n", "st", "stt", "sy", "sty",
+                   "best", "best_e1rm", "top_weight", "top_reps", "top_sets")
+
+ACWR_HIGH = 1.5       # deload above this
+ACWR_CAUTION = 1.3    # repeat the last top set above this
+DETRAIN_DAYS = 21     # a longer break restarts lighter
+MIN_STEP, MAX_STEP = 0.01, 0.025  # e1RM rise asked of the next session
+MAX_REPS = 12
+
+def epley(weight_kg, reps):
+    # same estimate as app.analytics.e1rm: a single is its own 1RM
+    if isinstance(weight_kg, (int, float)) and isinstance(reps, (int, float)):
+        return 0.0 if weight_kg <= 0 or reps <= 0 else weight_kg if reps == 1 else weight_kg * (1 + reps / 30.0)
+    import numpy as np
+    w, r = np.asarray(weight_kg, dtype=np.float64), np.asarray(reps, dtype=np.float64)
+    return np.where((w > 0) & (r > 0), np.where(r == 1, w, w * (1 + r / 30.0)), 0.0)
+
+def _daily(tau):
+    # weight of one day's load in an EWMA with time constant tau days
+    return 1.0 - math.exp(-1.0 / tau)
+
+def fold_training(state, day, weight, reps, sets):
+    """
+    Fold one workout (its session day and the set) into `state`, a dict of
+    TRAINING_FIELDS or None to start one, and return it. Workouts must come
+    in time order; one from before the state's last session day can't be
+    folded in and returns None.
+    """
+    load, e1rm = sets * reps * weight, epley(weight, reps)
+    if state is None:
+        state = dict.fromkeys(TRAINING_FIELDS, 0.0)
+        state.update(day=day, first_day=day, sessions=1)
+    elif day < state["day"]:
+        return None
+    elif day > state["day"]:
+        dt = day - state["day"]
+        n, st, stt, sy, sty = (state[k] for k in ("n", "st", "stt", "sy", "sty"))
+        decay = math.exp(-dt / TREND_DAYS)
+        # move the time origin to the new day, then age the older sessions
+        state.update(
+            n=n * decay,
+            st=(st - dt * n) * decay,
+            stt=(stt - 2 * dt * st + dt * dt * n) * decay,
+            sy=sy * decay,
+            sty=(sty - dt * sy) * decay,
+            acute=state["acute"] * math.exp(-dt / ACUTE_DAYS),
+            chronic=state["chronic"] * math.exp(-dt / CHRONIC_DAYS),
+            day=day,
+            sessions=state["sessions"] + 1,
+            best=0.0,
+        )
+    state["acute"] += load * _daily(ACUTE_DAYS)
+    state["chronic"] += load * _daily(CHRONIC_DAYS)
+    if e1rm > state["best"]:
+        # the session's point sits at t = 0, so only n and sy see it
+        if not state["best"]:
+            state["n"] += 1.0
+        state["sy"] += e1rm - state["best"]
+        state.update(best=e1rm, top_weight=weight, top_reps=reps, top_sets=sets)
+    state["best_e1rm"] = max(state["best_e1rm"], e1rm)
+    return state
+
+def training_states_batch(group, ts, weight, reps, sets, n_groups=None):
+    """
+    TRAINING_FIELDS as arrays indexed by group, from all workouts at once.
+    `group` numbers the (user, exercise) pairs 0..n_groups-1; the rest are
+    per-workout columns, `ts` in unix seconds. Matches folding each group's
+    workouts in time order with fold_training(), to rounding.
+    """
+    import numpy as np
+    group = np.asarray(group, dtype=np.int64)
+    ts, weight, reps, sets = (np.asarray(a, dtype=np.float64) for a in (ts, weight, reps, sets))
+    load, e1rm = sets * reps * weight, epley(weight, reps)
+    G = int(group.max()) + 1 if n_groups is None else n_groups
+    out = {k: np.zeros(G) for k in TRAINING_FIELDS}
+    if not len(group):
+        return out
+    day = np.floor(ts / 86400).astype(np.int64)
+
+    # by group, then day, best e1RM first (earliest on ties, as when folding);
+    # group and day share one key, which halves the sort
+    session = group * (int(day.max() - day.min()) + 1) + (day - day.min())
+    order = np.lexsort((ts, -e1rm, session))
+    g, d = group[order], day[order]
+    new_group = np.r_[True, g[1:] != g[:-1]]
+    starts = np.flatnonzero(new_group | np.r_[True, d[1:] != d[:-1]])   # one row per session: its top set
+    s_group, s_day, s_best = g[starts], d[starts], e1rm[order][starts]
+    first = np.r_[True, s_group[1:] != s_group[:-1]]
+    last = np.r_[s_group[1:] != s_group[:-1], True]
+    present = s_group[last]
+
+    out["day"][present] = s_day[last]
+    out["first_day"][present] = s_day[first]
+    out["sessions"] = np.bincount(s_group, minlength=G).astype(np.float64)
+    out["best"][present] = s_best[last]
+    out["best_e1rm"][present] = np.maximum.reduceat(s_best, np.flatnonzero(first))
+
+    age = out["day"][group] - day
+    out["acute"] = np.bincount(group, load * _daily(ACUTE_DAYS) * np.exp(-age / ACUTE_DAYS), minlength=G)
+    out["chronic"] = np.bincount(group, load * _daily(CHRONIC_DAYS) * np.exp(-age / CHRONIC_DAYS), minlength=G)
+
+    weighted = s_best > 0
+    wg, y = s_group[weighted], s_best[weighted]
+    t = (s_day[weighted] - out["day"][wg]).astype(np.float64)
+    w = np.exp(t / TREND_DAYS)
+    for key, values in (("n", w), ("st", w * t), ("stt", w * t * t), ("sy", w * y), ("sty", w * t * y)):
+        out[key] = np.bincount(wg, values, minlength=G)
+
+    top = starts[weighted][np.r_[wg[1:] != wg[:-1], True]] if len(wg) else starts[:0]
+    rows = order[top]
+    for key, column in (("top_weight", weight), ("top_reps", reps), ("top_sets", sets)):
+        out[key][group[rows]] = column[rows]
+    return out
+
+def training_metrics(cols, today):
+    """e1RM level and daily trend, loads and ACWR as of day `today` from TRAINING_FIELDS columns."""
+    import numpy as np
+    c = {k: np.asarray(cols[k], dtype=np.float64) for k in TRAINING_FIELDS}
+    since = np.maximum(today - c["day"], 0)
+    acute = c["acute"] * np.exp(-since / ACUTE_DAYS)
+    chronic = c["chronic"] * np.exp(-since / CHRONIC_DAYS)
+    n, st, stt, sy, sty = (c[k] for k in ("n", "st", "stt", "sy", "sty"))
+    det = n * stt - st * st
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(det > 1e-9, (n * sty - st * sy) / det, 0.0)
+        level = np.where(n > 0, (sy - slope * st) / n, 0.0)
+        acwr = np.where(chronic > 0, acute / chronic, 0.0)
+    return {"e1rm": level, "trend_per_day": slope, "acute": acute, "chronic": chronic, "acwr": acwr,
+            "days_since": since}
+
+def recommend_next(cols, today, increment=2.5):
+    """
+    Next session's top set per exercise from TRAINING_FIELDS columns, with
+    the metrics behind it. Actions:
+      progress  raise the target e1RM by the recent trend (MIN_STEP..MAX_STEP
+                per session); when the plates don't allow a heavier set at the
+                same reps, add a rep instead (up to MAX_REPS, then add weight)
+      hold      repeat the last top set: ACWR above ACWR_CAUTION, or e1RM
+                trending down
+      deload    90% of the current e1RM: ACWR above ACWR_HIGH
+      return    90% after more than DETRAIN_DAYS off
+      none      no weighted sets to go on
+    ACWR only counts once there is CHRONIC_DAYS of history.
+    """
+    import numpy as np
+    m = training_metrics(cols, today)
+    c = {k: np.asarray(cols[k], dtype=np.float64) for k in TRAINING_FIELDS}
+    level, slope, acwr = m["e1rm"], m["trend_per_day"], m["acwr"]
+    last_w, last_r = c["top_weight"], np.where(c["top_reps"] > 0, c["top_reps"], 5)
+
+    established = today - c["first_day"] >= CHRONIC_DAYS
+    gap = np.clip(np.where(c["sessions"] > 1, (c["day"] - c["first_day"]) / np.maximum(c["sessions"] - 1, 1), 7), 1, 14)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        step = np.clip(np.nan_to_num(slope * gap / level), MIN_STEP, MAX_STEP)
+    action = np.select(
+        [level <= 0, m["days_since"] > DETRAIN_DAYS, established & (acwr > ACWR_HIGH),
+         (established & (acwr > ACWR_CAUTION)) | ((slope < 0) & (c["sessions"] >= 4))],
+        ["none", "return", "deload", "hold"], "progress")
+    target = level * np.select([action == "progress", action == "hold"], [1 + step, 1.0], 0.9)
+
+    reps = last_r.copy()
+    weight = np.floor(target / np.where(reps == 1, 1.0, 1 + reps / 30.0) / increment) * increment
+    # flooring to the plates can undercut the current e1RM; progress never goes below it
+    weight = np.where((action == "progress") & (epley(weight, reps) < level), weight + increment, weight)
+    lighter = (action == "deload") | (action == "return")
+    weight = np.where(lighter, np.minimum(weight, last_w), weight)
+    hold = action == "hold"
+    weight = np.where(hold, last_w, weight)
+    # double progression: same weight for another rep before adding plates
+    stuck = (action == "progress") & (weight <= last_w)
+    more_reps = stuck & (last_r < MAX_REPS)
+    weight = np.where(stuck, np.where(more_reps, last_w, last_w + increment), weight)
+    reps = np.where(more_reps, last_r + 1, reps)
+    weight = np.where(action == "none", 0.0, np.maximum(weight, 0.0))
+    return {"action": action, "weight_kg": weight, "reps": reps.astype(np.int64),
+            "sets": np.maximum(c["top_sets"], 1).astype(np.int64), "target_e1rm": epley(weight, reps), **m}
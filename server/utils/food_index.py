@@ -0,0 +1,192 @@
+"""
+Offline food database with prefix and trigram (typo-tolerant) search.
+
+A bulk dump (CSV, JSON array or NDJSON whose records use the same keys as
+/foods/search items) is compiled once into a directory of .npy files that
+are memory-mapped at load time, so workers share pages and start instantly:
+
+    python -m utils.food_index build foods.csv data/food_index
+    python -m utils.food_index search data/food_index "chiken brest"
+"""
+import os
+import csv
+import sys
+import json
+import zlib
+import numpy as np
+
+NUMERIC = ["serving_qty", "calories", "protein_g", "carbs_g", "fat_g"]
+TEXT = ["name", "brand", "serving_unit"]
+MIN_SIMILARITY = 0.3
+
+def normalize(s):
+    return " ".join((s or "").lower().split())
+
+def trigrams(s):
+    # padded like pg_trgm so short words and word starts still produce grams
+    grams = set()
+    for word in normalize(s).split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def gram_key(gram):
+    return zlib.crc32(gram.encode("utf-8"))
+
+def read_dump(path):
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+        return
+    with open(path, encoding="utf-8") as f:
+        first = f.read(1)
+        f.seek(0)
+        if first == "[":
+            yield from json.load(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def build(src_path, out_dir):
+    """Compile a dump into `out_dir`. Returns the number of foods indexed."""
+    numbers, strings = [], []
+    for rec in read_dump(src_path):
+        name = (rec.get("name") or "").strip()
+        if not name:
+            continue
+        numbers.append([_number(rec.get(k)) for k in NUMERIC])
+        strings.append([(rec.get(k) or "").strip() for k in TEXT])
+
+    n = len(strings)
+    os.makedirs(out_dir, exist_ok=True)
+
+    # strings: one utf-8 blob plus offsets, 3 fields per food
+    blob = bytearray()
+    offsets = np.zeros(n * len(TEXT) + 1, dtype=np.uint64)
+    for i, fields in enumerate(strings):
+        for j, value in enumerate(fields):
+            blob += value.encode("utf-8")
+            offsets[i * len(TEXT) + j + 1] = len(blob)
+
+    # names sorted case-insensitively, for prefix range scans
+    by_name = np.array(sorted(range(n), key=lambda i: normalize(strings[i][0])), dtype=np.uint32)
+
+    # trigram postings: sorted keys -> slices of food ids
+    postings = {}
+    gram_counts = np.zeros(n, dtype=np.uint16)
+    for i, fields in enumerate(strings):
+        grams = trigrams(fields[0])
+        gram_counts[i] = min(len(grams), 65535)
+        for key in {gram_key(g) for g in grams}:
+            postings.setdefault(key, []).append(i)
+    keys = np.array(sorted(postings), dtype=np.uint32)
+    lengths = np.array([len(postings[k]) for k in keys], dtype=np.uint64)
+    starts = np.concatenate([[0], np.cumsum(lengths)]).astype(np.uint64)
+    ids = np.fromiter((i for k in keys for i in postings[k]), dtype=np.uint32, count=int(starts[-1]))
+
+    np.save(os.path.join(out_dir, "numbers.npy"), np.array(numbers, dtype=np.float32).reshape(n, len(NUMERIC)))
+    np.save(os.path.join(out_dir, "text.npy"), np.frombuffer(bytes(blob), dtype=np.uint8))
+    np.save(os.path.join(out_dir, "text_offsets.npy"), offsets)
+    np.save(os.path.join(out_dir, "by_name.npy"), by_name)
+    np.save(os.path.join(out_dir, "gram_keys.npy"), keys)
+    np.save(os.path.join(out_dir, "gram_starts.npy"), starts)
+    np.save(os.path.join(out_dir, "gram_ids.npy"), ids)
+    np.save(os.path.join(out_dir, "gram_counts.npy"), gram_counts)
+    return n
+
+class FoodIndex:
+    def __init__(self, path):
+        load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        self.numbers = load("numbers")
+        self.text = load("text")
+        self.text_offsets = load("text_offsets")
+        self.by_name = load("by_name")
+        self.gram_keys = load("gram_keys")
+        self.gram_starts = load("gram_starts")
+        self.gram_ids = load("gram_ids")
+        self.gram_counts = load("gram_counts")
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def _text(self, i, field):
+        k = int(i) * len(TEXT) + field
+        return bytes(self.text[int(self.text_offsets[k]):int(self.text_offsets[k + 1])]).decode("utf-8")
+
+    def item(self, i):
+        """Food `i` in the same shape /foods/search returns."""
+        out = {}
+        for field, key in enumerate(TEXT):
+            value = self._text(i, field)
+            if value:
+                out[key] = value
+        for key, value in zip(NUMERIC, self.numbers[int(i)].tolist()):
+            if value == value:  # skip NaN
+                out[key] = round(value, 2)
+        return out
+
+    def _prefix_ids(self, q, limit):
+        lo, hi = 0, len(self.by_name)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if normalize(self._text(self.by_name[mid], 0)) < q:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        for pos in range(lo, min(lo + limit, len(self.by_name))):
+            i = int(self.by_name[pos])
+            if not normalize(self._text(i, 0)).startswith(q):
+                break
+            found.append(i)
+        return found
+
+    def _fuzzy_ids(self, q, limit):
+        grams = {gram_key(g) for g in trigrams(q)}
+        if not grams:
+            return []
+        keys = np.fromiter(grams, dtype=np.uint32)
+        pos = np.searchsorted(self.gram_keys, keys)
+        inside = pos < len(self.gram_keys)
+        pos, keys = pos[inside], keys[inside]
+        # a missing gram's position points at the next key, which may be another query gram
+        pos = pos[self.gram_keys[pos] == keys]
+        if not len(pos):
+            return []
+        hits = np.concatenate([self.gram_ids[int(self.gram_starts[p]):int(self.gram_starts[p + 1])] for p in pos])
+        ids, shared = np.unique(hits, return_counts=True)
+        # Jaccard similarity over trigram sets
+        score = shared / (len(grams) + self.gram_counts[ids].astype(np.float32) - shared)
+        keep = score >= MIN_SIMILARITY
+        ids, score = ids[keep], score[keep]
+        order = np.lexsort((self.gram_counts[ids], -score))[:limit]
+        return ids[order].tolist()
+
+    def search(self, q, limit=25):
+        """Exact-prefix matches first (shortest names first), then fuzzy matches."""
+        q = normalize(q)
+        if not q:
+            return []
+        prefix = sorted(self._prefix_ids(q, limit * 4), key=lambda i: len(self._text(i, 0)))[:limit]
+        if len(prefix) == limit:
+            return [self.item(i) for i in prefix]
+        seen = set(prefix)
+        ranked = prefix + [i for i in self._fuzzy_ids(q, limit) if i not in seen]
+        return [self.item(i) for i in ranked[:limit]]
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "build":
+        print(f"Indexed {build(sys.argv[2], sys.argv[3])} foods into {sys.argv[3]}")
+    elif len(sys.argv) == 4 and sys.argv[1] == "search":
+        for item in FoodIndex(sys.argv[2]).search(sys.argv[3]):
+            print(json.dumps(item))
+    else:
+        print("usage: python -m utils.food_index build <dump> <out_dir> | search <index_dir> <query>")
+        sys.exit(2)
@@ -0,0 +1,61 @@
+"""
+Write .gz (and, if the optional `brotli` package is installed, .br) copies
+of the compressible files in a React build, for app/assets.py to serve:
+
+    python -m utils.precompress ../client/build
+
+Run it after `npm run build`; files whose copies are already up to date are
+skipped. Copies that come out no smaller than the original are not kept.
+"""
+import os
+import sys
+import gzip
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESSIBLE = (".html", ".js", ".css", ".json", ".map", ".svg", ".txt", ".ico", ".xml", ".webmanifest")
+MIN_BYTES = 1024
+
+def compressors():
+    yield ".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+    if brotli is not None:
+        yield ".br", lambda data: brotli.compress(data, quality=11)
+
+def precompress(root):
+    """Returns (files written, bytes saved)."""
+    written = saved = 0
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            path = os.path.join(dirpath, name)
+            if os.path.getsize(path) < MIN_BYTES:
+                continue
+            data = None
+            for suffix, compress in compressors():
+                out = path + suffix
+                if os.path.exists(out) and os.path.getmtime(out) >= os.path.getmtime(path):
+                    continue
+                if data is None:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                packed = compress(data)
+                if len(packed) >= len(data):
+                    if os.path.exists(out):
+                        os.remove(out)
+                    continue
+                with open(out, "wb") as f:
+                    f.write(packed)
+                written += 1
+                saved += len(data) - len(packed)
+    return written, saved
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("usage: python -m utils.precompress <build_dir>")
+        sys.exit(2)
+    n, saved = precompress(sys.argv[1])
+    print(f"Wrote {n} compressed files ({saved / 1024:.0f} KiB smaller){'' if brotli else ' (gzip only; pip install brotli for .br)'}")